@@ -0,0 +1,315 @@
+"""
+NEU-DET 标注索引：一次性解析所有 VOC XML，保存为紧凑的列式数组
+
+data/{train,validation}/annotations 下约 1800 个 XML 文件记录了缺陷的 bndbox。
+每次访问都重新解析 XML 代价很高；本模块把一个数据划分的全部标注并行解析一次，写入 ./cache/annotations_{split}.npz：
+- 图像列：image_ids（文件名，不含扩展名）、width、height、offsets（第 i 张图的框为 offsets[i]:offsets[i+1]）
+- 框列：box_image、box_class、xmin、ymin、xmax、ymax（整数数组）
+- 按类别排序的框序号 class_order 与 class_offsets，用于按类别查询
+
+AnnotationIndex 提供按图像、按类别的 O(1) 切片查询；RoiCropDataset 在缩放前把每张图片裁剪到缺陷框，
+供 train.py --roi-crop 使用。
+
+用法：
+    python annotations.py build                 # 解析并保存 train / validation 的索引
+    python annotations.py stats                 # 各类别框数、每张图的框数分布
+    python annotations.py bench                 # 对比重新解析 XML 与索引查询的耗时
+"""
+
+import argparse
+import glob
+import os
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+from torch.utils.data import Dataset
+from torchvision import datasets
+
+from model_utils import class_names, data_dir, split_dir
+
+INDEX_DIR = './cache'
+INDEX_VERSION = 1
+
+
+# ============================================
+# 1. 解析 XML
+# ============================================
+def annotation_dir(split):
+    return os.path.join(data_dir, split, 'annotations')
+
+
+def _boxes(root):
+    boxes = []
+    for obj in root.iter('object'):
+        bb = obj.find('bndbox')
+        boxes.append((obj.findtext('name'), *(int(float(bb.findtext(k))) for k in ('xmin', 'ymin', 'xmax', 'ymax'))))
+    return boxes
+
+
+def parse_annotation(xml_path):
+    """读取 VOC 格式标注，返回 [(类别名, xmin, ymin, xmax, ymax), ...]"""
+    return _boxes(ET.parse(xml_path).getroot())
+
+
+def _parse_file(xml_path):
+    """解析单个文件：(图像 ID, 宽, 高, 框列表)"""
+    root = ET.parse(xml_path).getroot()
+    size = root.find('size')
+    width = int(size.findtext('width')) if size is not None else 0
+    height = int(size.findtext('height')) if size is not None else 0
+    image_id = os.path.splitext(os.path.basename(xml_path))[0]
+    return image_id, width, height, _boxes(root)
+
+
+# ============================================
+# 2. 构建与读写索引
+# ============================================
+def index_path(split, index_dir=INDEX_DIR):
+    return os.path.join(index_dir, f'annotations_{split}.npz')
+
+
+def build_index(split, index_dir=INDEX_DIR, num_workers=4):
+    """并行解析一个划分的全部 XML，写入列式 .npz，返回 AnnotationIndex"""
+    xml_paths = sorted(glob.glob(os.path.join(annotation_dir(split), '*.xml')))
+    if not xml_paths:
+        raise FileNotFoundError(f'未找到 {annotation_dir(split)} 下的标注文件')
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            parsed = list(pool.map(_parse_file, xml_paths, chunksize=64))
+    else:
+        parsed = [_parse_file(p) for p in xml_paths]
+
+    class_to_idx = {name: i for i, name in enumerate(class_names)}
+    num_boxes = sum(len(boxes) for *_, boxes in parsed)
+    offsets = np.zeros(len(parsed) + 1, dtype=np.int32)
+    box_image = np.empty(num_boxes, dtype=np.int32)
+    box_class = np.empty(num_boxes, dtype=np.int8)
+    coords = np.empty((4, num_boxes), dtype=np.int16)
+    k = 0
+    for i, (_, _, _, boxes) in enumerate(parsed):
+        for name, *box in boxes:
+            box_image[k] = i
+            box_class[k] = class_to_idx[name]
+            coords[:, k] = box
+            k += 1
+        offsets[i + 1] = k
+
+    # 按类别稳定排序的框序号：class_order[class_offsets[c]:class_offsets[c+1]] 为类别 c 的全部框
+    class_order = np.argsort(box_class, kind='stable').astype(np.int32)
+    class_offsets = np.concatenate([[0], np.cumsum(np.bincount(box_class, minlength=len(class_names)))]).astype(np.int32)
+
+    arrays = {
+        'version': np.array(INDEX_VERSION),
+        'source_mtime': np.array(max(os.path.getmtime(p) for p in xml_paths)),
+        'classes': np.array(class_names),
+        'image_ids': np.array([image_id for image_id, *_ in parsed]),
+        'width': np.array([w for _, w, _, _ in parsed], dtype=np.int16),
+        'height': np.array([h for _, _, h, _ in parsed], dtype=np.int16),
+        'offsets': offsets,
+        'box_image': box_image,
+        'box_class': box_class,
+        'xmin': coords[0], 'ymin': coords[1], 'xmax': coords[2], 'ymax': coords[3],
+        'class_order': class_order,
+        'class_offsets': class_offsets,
+    }
+    os.makedirs(index_dir, exist_ok=True)
+    np.savez(index_path(split, index_dir), **arrays)
+    return AnnotationIndex(arrays)
+
+
+def load_or_build_index(split, index_dir=INDEX_DIR, num_workers=4):
+    """读取已有索引；不存在、版本不符或 XML 有更新时重新构建"""
+    path = index_path(split, index_dir)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            arrays = {k: data[k] for k in data.files}
+        xml_paths = glob.glob(os.path.join(annotation_dir(split), '*.xml'))
+        fresh = (int(arrays['version']) == INDEX_VERSION and len(xml_paths) == len(arrays['image_ids'])
+                 and max(os.path.getmtime(p) for p in xml_paths) <= float(arrays['source_mtime']))
+        if fresh:
+            return AnnotationIndex(arrays)
+    return build_index(split, index_dir, num_workers)
+
+
+# ============================================
+# 3. 查询
+# ============================================
+class AnnotationIndex:
+    """列式标注索引；所有查询返回数组切片或视图，不再访问 XML"""
+
+    def __init__(self, arrays):
+        self.classes = [str(c) for c in arrays['classes']]
+        self.image_ids = arrays['image_ids']
+        self.width = arrays['width']
+        self.height = arrays['height']
+        self.offsets = arrays['offsets']
+        self.box_image = arrays['box_image']
+        self.box_class = arrays['box_class']
+        # [num_boxes, 4]：xmin, ymin, xmax, ymax
+        self.boxes = np.stack([arrays['xmin'], arrays['ymin'], arrays['xmax'], arrays['ymax']], axis=1)
+        self.class_order = arrays['class_order']
+        self.class_offsets = arrays['class_offsets']
+        self._id_to_row = {str(image_id): i for i, image_id in enumerate(self.image_ids)}
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    @property
+    def num_boxes(self):
+        return len(self.box_class)
+
+    def row(self, image_id):
+        """图像 ID（如 'crazing_240'）对应的行号，不存在时返回 None"""
+        return self._id_to_row.get(image_id)
+
+    def boxes_for(self, image_id):
+        """一张图片的全部框 [K, 4]；没有标注时返回空数组"""
+        i = self.row(image_id)
+        if i is None:
+            return self.boxes[:0]
+        return self.boxes[self.offsets[i]:self.offsets[i + 1]]
+
+    def classes_for(self, image_id):
+        i = self.row(image_id)
+        if i is None:
+            return self.box_class[:0]
+        return self.box_class[self.offsets[i]:self.offsets[i + 1]]
+
+    def union_box(self, image_id):
+        """覆盖一张图片所有缺陷框的最小外接框，没有标注时返回 None"""
+        boxes = self.boxes_for(image_id)
+        if len(boxes) == 0:
+            return None
+        return (int(boxes[:, 0].min()), int(boxes[:, 1].min()), int(boxes[:, 2].max()), int(boxes[:, 3].max()))
+
+    def box_ids_of_class(self, name):
+        """某个类别的全部框序号"""
+        c = self.classes.index(name)
+        return self.class_order[self.class_offsets[c]:self.class_offsets[c + 1]]
+
+    def images_with_class(self, name):
+        """含有某个类别缺陷框的图像 ID"""
+        return self.image_ids[np.unique(self.box_image[self.box_ids_of_class(name)])]
+
+
+# ============================================
+# 4. ROI 裁剪数据集
+# ============================================
+class RoiCropDataset(Dataset):
+    """
+    与 ImageFolder 相同的样本与标签，但在 transform（缩放/增强）之前先把图片裁剪到缺陷框
+    mode='union'：每张图片一个样本，裁剪到所有框的外接框；
+    mode='box'：每个框一个样本（多框图片会产生多个样本）；
+    框向外扩展 margin（相对边长），且不小于 min_size 像素；没有标注的图片保持原图
+    """
+
+    def __init__(self, split, transform=None, mode='union', margin=0.1, min_size=32, index=None):
+        if mode not in ('union', 'box'):
+            raise ValueError(f"mode 只能是 'union' 或 'box'，实际为 '{mode}'")
+        folder = datasets.ImageFolder(split_dir(split))
+        self.classes = folder.classes
+        self.class_to_idx = folder.class_to_idx
+        self.transform = transform
+        self.margin = margin
+        self.min_size = min_size
+        if index is None:
+            index = load_or_build_index(split)
+
+        self.samples = []
+        for path, target in folder.samples:
+            image_id = os.path.splitext(os.path.basename(path))[0]
+            if mode == 'union':
+                self.samples.append((path, target, index.union_box(image_id)))
+            else:
+                boxes = index.boxes_for(image_id)
+                if len(boxes) == 0:
+                    self.samples.append((path, target, None))
+                self.samples.extend((path, target, tuple(int(v) for v in box)) for box in boxes)
+        self.targets = [target for _, target, _ in self.samples]
+
+    def crop_box(self, box, width, height):
+        """按 margin 扩展并保证最小边长，裁剪到图像范围内"""
+        x0, y0, x1, y1 = box
+        pad_x = max((x1 - x0) * self.margin, (self.min_size - (x1 - x0)) / 2, 0)
+        pad_y = max((y1 - y0) * self.margin, (self.min_size - (y1 - y0)) / 2, 0)
+        return (max(0, int(x0 - pad_x)), max(0, int(y0 - pad_y)),
+                min(width, int(round(x1 + pad_x))), min(height, int(round(y1 + pad_y))))
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        path, target, box = self.samples[idx]
+        with Image.open(path) as image:
+            image = image.convert('RGB')
+        if box is not None:
+            image = image.crop(self.crop_box(box, *image.size))
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, target
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NEU-DET 标注索引')
+    parser.add_argument('command', choices=['build', 'stats', 'bench'],
+                        help='build: 构建索引；stats: 统计信息；bench: 与重新解析 XML 的耗时对比')
+    parser.add_argument('--index-dir', default=INDEX_DIR, help='索引文件目录')
+    parser.add_argument('--workers', type=int, default=4, help='并行解析的进程数')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        for split in ['train', 'validation']:
+            start = time.perf_counter()
+            index = build_index(split, args.index_dir, args.workers)
+            size_kb = os.path.getsize(index_path(split, args.index_dir)) / 1024
+            print(f"✅ {split}: {len(index)} 个标注文件，{index.num_boxes} 个框，"
+                  f"耗时 {time.perf_counter() - start:.2f}s，索引 {size_kb:.1f} KB")
+        return
+
+    if args.command == 'stats':
+        for split in ['train', 'validation']:
+            index = load_or_build_index(split, args.index_dir, args.workers)
+            per_image = np.diff(index.offsets)
+            print(f"\n{split}: {len(index)} 张图片，{index.num_boxes} 个框，"
+                  f"每张图 {per_image.mean():.2f} 个框（最多 {per_image.max()}）")
+            print("=" * 56)
+            print(f"{'类别':<20s}{'框数':>8s}{'图片数':>8s}{'平均框面积占比':>18s}")
+            for name in index.classes:
+                ids = index.box_ids_of_class(name)
+                boxes = index.boxes[ids].astype(np.float32)
+                area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+                image_area = (index.width[index.box_image[ids]].astype(np.float32)
+                              * index.height[index.box_image[ids]])
+                ratio = float((area / np.maximum(image_area, 1)).mean()) if len(ids) else 0.0
+                print(f"{name:<20s}{len(ids):>8d}{len(index.images_with_class(name)):>8d}{ratio:>18.1%}")
+        return
+
+    # bench：逐张查询全部图片的框
+    split = 'train'
+    xml_paths = sorted(glob.glob(os.path.join(annotation_dir(split), '*.xml')))
+    start = time.perf_counter()
+    for path in xml_paths:
+        parse_annotation(path)
+    parse_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = load_or_build_index(split, args.index_dir, args.workers)
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for image_id in index.image_ids:
+        index.boxes_for(str(image_id))
+    for name in index.classes:
+        index.images_with_class(name)
+    query_time = time.perf_counter() - start
+
+    print(f"{split}: {len(xml_paths)} 个标注文件")
+    print(f"逐个解析 XML:      {parse_time * 1000:>10.1f} ms")
+    print(f"读取索引:          {load_time * 1000:>10.1f} ms")
+    print(f"全部按图/按类查询: {query_time * 1000:>10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
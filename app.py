@@ -4,12 +4,8 @@
 """
 
 import streamlit as st
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
 from PIL import Image
-import numpy as np
-import os
+import io
 
 # 设置页面配置
 st.set_page_config(
@@ -19,92 +15,85 @@ st.set_page_config(
 )
 
 # ============================================
-# 1. 定义类别名称（与训练时一致）
+# 1. 类别名称、模型结构、预处理与推理（与训练时一致，定义见 model_utils.py）
 # ============================================
-class_names = ['crazing', 'inclusion', 'patches', 'pitted_surface', 'rolled-in_scale', 'scratches']
-class_names_cn = {
-    'crazing': '裂纹',
-    'inclusion': '夹杂',
-    'patches': '斑块',
-    'pitted_surface': '麻点',
-    'rolled-in_scale': '氧化皮',
-    'scratches': '划痕'
-}
+# model_utils / tta 会导入 torch 和 torchvision，推迟到加载模型时再导入，页面框架先渲染出来
+from prediction_cache import PredictionCache, image_digest, model_version
+from metrics import metrics
+from startup import StartupTimer, mark_ready
+from model_registry import ModelRegistry
 
 # ============================================
-# 2. 定义模型结构（必须与训练时完全一致）
+# 2. 加载模型
 # ============================================
 @st.cache_resource
-def load_model():
-    """加载训练好的模型，使用缓存加速"""
-    # 加载预训练的 ResNet18
-    model = models.resnet18(pretrained=False)
-    
-    # 获取原始全连接层的输入特征数
-    num_ftrs = model.fc.in_features
-    
-    # 修改全连接层（与训练时一致：Linear(输入,256) -> ReLU -> Linear(256,6)）
-    model.fc = nn.Sequential(
-        nn.Linear(num_ftrs, 256),
-        nn.ReLU(),
-        nn.Linear(256, 6)
-    )
-    
-    # 加载训练好的权重
-    if os.path.exists('best_model.pth'):
-        model.load_state_dict(torch.load('best_model.pth', map_location='cpu'))
-        st.success("✅ 模型加载成功！")
-    else:
-        st.error("❌ 未找到模型文件 'best_model.pth'，请先运行 train.py 训练模型")
-        return None
-    
-    # 设置为评估模式
-    model.eval()
-    return model
+def get_registry():
+    """所有会话共享的模型注册表：新版本在后台加载预热后原子切换，旧版本按内存上限 LRU 淘汰（见 model_registry.py）"""
+    registry = ModelRegistry()
+    registry.start_watching()
+    return registry
 
-# ============================================
-# 3. 定义图像预处理（与验证集一致）
-# ============================================
-def preprocess_image(image):
-    """对上传的图像进行预处理"""
-    # 定义预处理变换（与验证集一致）
-    preprocess = transforms.Compose([
-        transforms.Resize(256),
-        transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-    ])
-    
-    # 应用预处理
-    image_tensor = preprocess(image)
-    # 添加batch维度
-    image_tensor = image_tensor.unsqueeze(0)
-    return image_tensor
+@st.cache_resource(show_spinner="⏳ 正在加载并预热模型...")
+def warm_start(input_mode='rgb'):
+    """启动时加载并预热当前版本（每种 input_mode 只执行一次），完成后写入就绪标记"""
+    # 导入 model_utils、加载训练好的权重（内存映射读取），并用一次空前向预热，各阶段分别计时
+    timer = StartupTimer()
+    try:
+        entry = get_registry().current(input_mode, timer)
+    except FileNotFoundError as e:
+        st.error(f"❌ 未找到模型文件 '{e.filename}'，请先运行 train.py 训练模型")
+        return False
+    mark_ready({'input_mode': input_mode, 'version': entry.version, 'startup': timer.summary()})
+    st.success(f"✅ 模型 {entry.version} 加载成功！（{timer}）")
+    return True
 
-# ============================================
-# 4. 模型推理函数
-# ============================================
-def predict(image, model):
-    """对图像进行预测"""
-    # 预处理图像
-    image_tensor = preprocess_image(image)
-    
-    # 进行推理
-    with torch.no_grad():
-        outputs = model(image_tensor)
-        # 获取预测结果
-        probabilities = torch.nn.functional.softmax(outputs[0], dim=0)
-        # 获取最大概率的类别
-        confidence, predicted_idx = torch.max(probabilities, 0)
-    
-    # 转换为Python类型
-    predicted_class = class_names[predicted_idx.item()]
-    confidence_percent = confidence.item() * 100
-    
-    return predicted_class, confidence_percent, probabilities.numpy()
+def show_model_versions(placeholder, registry):
+    """在侧边栏显示当前版本、后台加载状态，并可切换到其他已注册版本"""
+    versions = registry.versions()
+    status = registry.status()
+    with placeholder.container():
+        st.header("🗂️ 模型版本")
+        if len(versions) > 1:
+            if not status['pending']:
+                # 版本也可能由命令行 activate 切换，下拉框跟随实际生效的版本
+                st.session_state.model_version = status['active']
+            st.selectbox("当前版本", list(versions), key='model_version',
+                         on_change=lambda: registry.activate(st.session_state.model_version, persist=True),
+                         help="新版本在后台加载并预热，完成后才切换，期间旧版本继续提供服务")
+        meta = versions[status['active']]
+        accuracy = f"{meta['accuracy']:.2%}" if meta.get('accuracy') is not None else '未记录'
+        st.caption(f"{status['active']}：验证集准确率 {accuracy}，输入 {meta['input_mode']}"
+                   + (f"，注册于 {meta['created']}" if meta.get('created') else ''))
+        if status['pending']:
+            st.info(f"⏳ 正在后台加载 {status['pending']}，完成后自动切换")
+        if status['error']:
+            st.warning(f"⚠️ 版本加载失败：{status['error']}")
+        st.caption(f"已加载 {len(status['loaded'])} 个模型，{status['memory_mb']:.0f}/{status['max_memory_mb']:.0f} MB，"
+                   f"淘汰 {status['evictions']} 次")
+
+@st.cache_resource
+def get_prediction_cache():
+    """所有会话共享的预测结果缓存（按图片内容哈希 + 模型版本）"""
+    return PredictionCache(max_entries=256)
+
+def show_cache_stats(placeholder):
+    """在侧边栏显示缓存命中统计"""
+    stats = get_prediction_cache().stats()
+    with placeholder.container():
+        st.header("⚡ 预测缓存")
+        c1, c2, c3 = st.columns(3)
+        c1.metric("命中", stats['hits'])
+        c2.metric("未命中", stats['misses'])
+        c3.metric("淘汰", stats['evictions'])
+        st.caption(f"缓存条目 {stats['size']}/{stats['capacity']}，命中率 {stats['hit_rate']:.0%}")
+        if metrics.enabled:
+            # DEFECT_METRICS=1 时显示各推理阶段的平均耗时
+            st.header("⏱️ 推理阶段耗时")
+            for name, item in metrics.summary().items():
+                st.caption(f"{name.split('/', 1)[1]}: {item['mean_ms']:.2f} ms（{item['count']} 次）")
 
 # ============================================
-# 5. Streamlit 主界面
+# 3. Streamlit 主界面
 # ============================================
 def main():
     # 页面标题
@@ -143,6 +132,42 @@ def main():
         st.markdown("---")
         
         st.info("💡 提示：建议上传清晰的工业零件表面图片以获得最佳检测效果")
+
+        st.markdown("---")
+
+        st.header("⚙️ 推理设置")
+        gray_mode = st.checkbox(
+            "单通道快速推理",
+            value=False,
+            help="NEU-DET 图像为灰度图，可将 conv1 与标准化折叠为单通道卷积，结果与 RGB 路径一致"
+        )
+        input_mode = 'gray' if gray_mode else 'rgb'
+        use_tta = st.checkbox(
+            "测试时增强（TTA）",
+            value=False,
+            help="对翻转、多位置裁剪和小角度旋转的多个视图一次性批量推理并聚合概率，适合难以判断的图片"
+        )
+        tta_views, tta_reduce, tta_threshold = 1, 'mean', None
+        if use_tta:
+            from tta import TTA_VIEWS
+            tta_views = st.slider("TTA 视图数", 2, len(TTA_VIEWS), 6, help="视图越多越稳定，但延迟越高")
+            tta_reduce = st.radio("概率聚合", ['mean', 'max'], horizontal=True)
+            threshold = st.slider("仅当置信度低于（%）时启用", 0, 100, 90,
+                                  help="先做普通预测，置信度低于该值才补算其余视图；设为 100 则总是启用")
+            tta_threshold = threshold / 100 if threshold < 100 else None
+
+        st.markdown("---")
+
+        # 模型版本和缓存统计在模型加载 / 本次预测完成后再填充
+        versions_placeholder = st.empty()
+        cache_stats_placeholder = st.empty()
+
+    # 启动时即加载并预热模型，第一次上传不再等待；本次运行始终使用同一个版本，切换不影响进行中的预测
+    entry = None
+    if warm_start(input_mode):
+        registry = get_registry()
+        entry = registry.current(input_mode)
+        show_model_versions(versions_placeholder, registry)
     
     # 主内容区域
     col1, col2 = st.columns([1, 1])
@@ -156,21 +181,35 @@ def main():
         )
         
         if uploaded_file is not None:
-            # 读取并显示图片
-            image = Image.open(uploaded_file).convert('RGB')
-            st.image(image, caption="上传的图片", use_column_width=True)
+            # 显示图片（直接使用原始字节，解码只在缓存未命中时进行）
+            image_bytes = uploaded_file.getvalue()
+            st.image(image_bytes, caption="上传的图片", use_column_width=True)
     
     with col2:
         st.subheader("🔍 检测结果")
         
         if uploaded_file is not None:
-            # 加载模型（使用缓存）
-            model = load_model()
-            
-            if model is not None:
-                # 进行预测
+            if entry is not None:
+                from model_utils import MODEL_BACKEND, MODEL_PRECISION, class_names, class_names_cn, predict
+                from tta import predict_tta
+                # 进行预测（相同图片 + 相同模型版本直接返回缓存结果）
+                model = entry.model
+                cache = get_prediction_cache()
+                if use_tta:
+                    variant = (input_mode, MODEL_BACKEND, MODEL_PRECISION, f'tta{tta_views}-{tta_reduce}-{tta_threshold}')
+                    compute = lambda: predict_tta(Image.open(io.BytesIO(image_bytes)), model, input_mode,
+                                                  tta_views, tta_reduce, tta_threshold)
+                else:
+                    variant = (input_mode, MODEL_BACKEND, MODEL_PRECISION)
+                    compute = lambda: (*predict(Image.open(io.BytesIO(image_bytes)).convert('RGB'), model, input_mode), 1)
+                key = cache.make_key(image_bytes, model_version(entry.path, entry.version, *variant))
                 with st.spinner("正在分析图片..."):
-                    predicted_class, confidence, probabilities = predict(image, model)
+                    (predicted_class, confidence, probabilities, views_used), hit = cache.get_or_compute(key, compute)
+                # 记录本次结果由哪个模型版本给出
+                registry.log_prediction(entry, image_digest(image_bytes)[:16], predicted_class, confidence, cached=hit)
+                st.caption(f"🏷️ 模型版本：{entry.version}")
+                if use_tta:
+                    st.caption(f"🔁 TTA：使用了 {views_used} 个视图" if views_used > 1 else "🔁 TTA：置信度已达阈值，未启用多视图")
                 
                 # 显示预测结果
                 st.markdown(f"""
@@ -247,6 +286,8 @@ def main():
             </div>
             """, unsafe_allow_html=True)
     
+    show_cache_stats(cache_stats_placeholder)
+
     # 页脚
     st.markdown("---")
     st.markdown("""
@@ -0,0 +1,200 @@
+"""
+批量离线推理：对目录或文件列表中的所有图片分类，逐行输出 JSONL
+
+app.py 的 predict 一次只处理一张图片（batch size = 1），无法离线批量评分整个班次的线阵相机采集图像。
+本脚本用 DataLoader 多进程并行解码，按可配置的 batch size 在 inference_mode 下推理，
+每处理完一个批次就把每张图片的一条 JSON 记录写出（类别、置信度、完整概率向量）。
+输入路径是流式遍历的，不会一次性展开到内存，内存占用与输入规模无关。
+
+用法：
+    python batch_predict.py data/validation/images > predictions.jsonl
+    python batch_predict.py --file-list shift_0412.txt --batch-size 64 --workers 8 -o out.jsonl
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+from metrics import attach_layer_hooks, metrics
+from model_utils import MODEL_PATH, MODEL_PRECISION, infer_backend, class_names, load_model, preprocess_image, with_precision
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+# ============================================
+# 1. 输入：流式遍历图片路径
+# ============================================
+def iter_image_paths(inputs, file_lists=()):
+    """依次产出所有图片路径：目录递归遍历，文件直接产出，文件列表逐行读取"""
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMG_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield item
+    for list_path in file_lists:
+        with open(list_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+
+
+class ImagePathDataset(IterableDataset):
+    """
+    按路径流式解码图片；多个工作进程按序号取模分片，各自解码互不重叠的子集
+    解码失败的图片产出 None，由主进程写出错误记录
+    """
+
+    def __init__(self, inputs, file_lists=(), input_mode='rgb'):
+        self.inputs = list(inputs)
+        self.file_lists = list(file_lists)
+        self.input_mode = input_mode
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker else (0, 1)
+        for idx, path in enumerate(iter_image_paths(self.inputs, self.file_lists)):
+            if idx % num_workers != worker_id:
+                continue
+            try:
+                with Image.open(path) as image:
+                    tensor = preprocess_image(image, self.input_mode)[0]
+                yield tensor, path, None
+            except Exception as e:
+                yield None, path, f'{type(e).__name__}: {e}'
+
+
+def collate(batch):
+    """把成功解码的图片拼成一个批次，失败的单独返回"""
+    tensors = [t for t, _, err in batch if err is None]
+    paths = [p for _, p, err in batch if err is None]
+    errors = [(p, err) for _, p, err in batch if err is not None]
+    images = torch.stack(tensors) if tensors else None
+    return images, paths, errors
+
+
+# ============================================
+# 2. 批量推理
+# ============================================
+def prediction_record(probs):
+    """把一张图片的概率向量（list）转换为输出记录：类别、置信度、完整概率向量"""
+    idx = max(range(len(probs)), key=probs.__getitem__)
+    return {
+        'class': class_names[idx],
+        'confidence': round(probs[idx], 6),
+        'probabilities': [round(p, 6) for p in probs],
+    }
+
+
+def predict_batches(model, loader):
+    """逐批次推理，产出每张图片的结果记录（dict）"""
+    with torch.inference_mode():
+        for images, paths, errors in loader:
+            for path, err in errors:
+                yield {'path': path, 'error': err}
+            if images is None:
+                continue
+            with metrics.stage('forward'):
+                logits = model(images)
+            with metrics.stage('softmax'):
+                probabilities = torch.softmax(logits, dim=1)
+            for path, probs in zip(paths, probabilities.tolist()):
+                yield {'path': path, **prediction_record(probs)}
+
+
+def build_loader(inputs, file_lists=(), input_mode='rgb', batch_size=32, num_workers=4):
+    dataset = ImagePathDataset(inputs, file_lists, input_mode)
+    return DataLoader(dataset, batch_size=batch_size, num_workers=num_workers, collate_fn=collate,
+                      prefetch_factor=2 if num_workers > 0 else None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量离线推理，逐行输出 JSONL')
+    parser.add_argument('inputs', nargs='*', help='图片文件或目录（目录递归遍历）')
+    parser.add_argument('--file-list', action='append', default=[],
+                        help='包含图片路径的文本文件（每行一个，可重复指定）')
+    parser.add_argument('--model', default=MODEL_PATH, help='模型文件路径')
+    parser.add_argument('--batch-size', type=int, default=32, help='推理 Batch Size')
+    parser.add_argument('--workers', type=int, default=4, help='并行解码的 DataLoader 工作进程数')
+    parser.add_argument('--gray', action='store_true', help='使用单通道快速推理路径')
+    parser.add_argument('--backend', default=None, choices=['eager', 'torchscript', 'onnx'],
+                        help='推理后端（默认按模型文件扩展名推断，torchscript/onnx 需先运行 export.py）')
+    parser.add_argument('--optimize', action='store_true',
+                        help='折叠 BN、融合 ReLU 并使用 channels_last 布局（见 optimize.py，仅 eager 后端）')
+    parser.add_argument('--threads', type=int, default=None, help='推理使用的 CPU 线程数')
+    parser.add_argument('--precision', default=MODEL_PRECISION, choices=['fp32', 'bf16'],
+                        help='推理精度：bf16 以 bfloat16 autocast 计算卷积和全连接，softmax 仍为 float32')
+    parser.add_argument('--early-exit', type=float, default=None, metavar='THRESHOLD',
+                        help='使用 early_exit.py 训练的 layer2/layer3 辅助出口，置信度达到阈值即提前返回（仅 eager 后端）')
+    parser.add_argument('--metrics-file', default=None,
+                        help='开启分阶段计时并把直方图写入该文件（Prometheus 文本格式；'
+                             '预处理阶段在工作进程中执行，仅 --workers 0 时计入）')
+    parser.add_argument('--layer-hooks', action='store_true', help='同时记录逐层前向耗时（仅 eager 后端）')
+    parser.add_argument('-o', '--output', default='-', help='输出 JSONL 文件（默认标准输出）')
+    args = parser.parse_args()
+
+    if not args.inputs and not args.file_list:
+        parser.error('请指定图片文件、目录或 --file-list')
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    input_mode = 'gray' if args.gray else 'rgb'
+    backend = args.backend or infer_backend(args.model)
+    if args.precision == 'bf16' and backend == 'onnx':
+        parser.error('onnx 后端只支持 fp32 推理')
+    if args.optimize and backend != 'eager':
+        parser.error(f'--optimize 只支持 eager 后端，当前为 {backend}')
+    # 提前退出和逐层钩子要访问 layer1..layer4 子模块，TorchScript 冻结后的模型没有这些属性
+    for flag, used in (('--early-exit', args.early_exit is not None), ('--layer-hooks', args.layer_hooks)):
+        if used and (backend != 'eager' or args.optimize):
+            parser.error(f'{flag} 只支持未经 --optimize 的 eager 后端')
+    model = load_model(args.model, input_mode=input_mode, backend=args.backend, precision='fp32')
+    if args.optimize:
+        from optimize import build_optimized_model
+        model = build_optimized_model(model)
+    if args.metrics_file:
+        metrics.enable()
+        if args.layer_hooks:
+            # 钩子挂在原模型的子模块上，提前退出包装后仍会经过这些子模块
+            attach_layer_hooks(model)
+    if args.early_exit is not None:
+        from early_exit import load_early_exit
+        model = load_early_exit(model, threshold=args.early_exit)
+    # 精度包装放在最后，优化、提前退出和逐层钩子都作用在原模型上
+    model = with_precision(model, args.precision)
+    loader = build_loader(args.inputs, args.file_list, input_mode, args.batch_size, args.workers)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    count = failed = 0
+    start = time.perf_counter()
+    try:
+        for record in predict_batches(model, loader):
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+            failed += 'error' in record
+            if count % args.batch_size == 0:
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ 完成 {count} 张图片（失败 {failed} 张），耗时 {elapsed:.1f}s，"
+          f"{count / max(elapsed, 1e-9):.1f} 图片/秒", file=sys.stderr)
+    if args.metrics_file:
+        metrics.dump(args.metrics_file)
+        print(f"📊 分阶段耗时已写入 {args.metrics_file}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
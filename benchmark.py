@@ -0,0 +1,231 @@
+"""
+性能基准测试：JPEG 解码、预处理、模型前向和端到端 predict 分阶段测量
+
+每个阶段在独立的子进程中运行，输出 p50/p95/p99 延迟、吞吐量（图片/秒）、该阶段进程的峰值内存（RSS）
+以及测量期间相对准备阶段（导入、加载模型、读图）的峰值增量，结果写入 JSON。
+ru_maxrss 是整个进程的历史最高值，各阶段共用一个进程时只会单调增长，无法反映单个阶段的峰值。
+指定基线 JSON 时逐项比较 p50 延迟、吞吐量和峰值 RSS，退化超过容差则以非零状态退出，可直接用于 CI；
+p95/p99 只作参考不参与判定（前向阶段默认只有 20 次迭代，p99 接近最大值，波动很大）。
+只依赖 CPU 和仓库自带的 data/validation 图片。
+
+用法：
+    python benchmark.py                                        # 运行并写出 benchmark_results.json
+    python benchmark.py --save-baseline benchmarks/baseline.json
+    python benchmark.py --baseline benchmarks/baseline.json --tolerance 0.15
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import torch
+from PIL import Image
+
+from model_utils import MODEL_PATH, load_model, predict, preprocess_image, split_dir
+
+GATED_METRICS = ('p50_ms', 'peak_rss_mb')  # 越大越差；images_per_sec 越小越差，单独比较
+
+
+# ============================================
+# 1. 计时工具
+# ============================================
+def peak_rss_mb():
+    """进程峰值常驻内存（MB）；Linux 上 ru_maxrss 单位为 KB，macOS 为字节，Windows 不支持时返回 0"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def summarize(timings, items_per_call=1):
+    """由每次调用的耗时（秒）计算分位数延迟与吞吐量"""
+    values = sorted(timings)
+
+    def pct(q):
+        return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))] * 1000
+
+    return {
+        'p50_ms': round(pct(50), 3),
+        'p95_ms': round(pct(95), 3),
+        'p99_ms': round(pct(99), 3),
+        'images_per_sec': round(items_per_call * len(values) / sum(values), 2),
+        'calls': len(values),
+    }
+
+
+def time_calls(fn, args_list, warmup=3):
+    """对 args_list 中的每组参数调用 fn 并计时，返回耗时列表"""
+    for args in args_list[:warmup]:
+        fn(*args)
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+# ============================================
+# 2. 各阶段基准（每个阶段一个子进程）
+# ============================================
+def stage_names(batch_sizes=(1, 8, 32), thread_counts=None):
+    thread_counts = thread_counts or sorted({1, torch.get_num_threads()})
+    forward = [f'forward/bs={bs}/threads={threads}' for threads in thread_counts for bs in batch_sizes]
+    return ['decode', 'preprocess', *forward, 'predict_e2e']
+
+
+def decode(path):
+    with Image.open(path) as image:
+        return image.convert('RGB')
+
+
+def run_stage(name, model_path, num_images=200, iters=20):
+    """子进程入口：完成准备工作后只测量 name 一个阶段，返回统计结果和内存"""
+    paths = sorted(glob.glob(os.path.join(split_dir('validation'), '*', '*.jpg')))[:num_images]
+    if not paths:
+        raise FileNotFoundError('未找到 data/validation/images 下的图片')
+
+    items_per_call = 1
+    if name == 'decode':
+        fn, calls = decode, [(p,) for p in paths]
+    elif name == 'preprocess':
+        fn, calls = preprocess_image, [(decode(p),) for p in paths]
+    elif name.startswith('forward/'):
+        batch_size, threads = (int(part.split('=')[1]) for part in name.split('/')[1:])
+        torch.set_num_threads(threads)
+        model = load_model(model_path)
+
+        def fn(x):
+            with torch.inference_mode():
+                model(x)
+
+        calls, items_per_call = [(torch.randn(batch_size, 3, 224, 224),)] * iters, batch_size
+    elif name == 'predict_e2e':
+        model = load_model(model_path)
+
+        def fn(path):
+            with Image.open(path) as image:
+                return predict(image.convert('RGB'), model)
+
+        calls = [(p,) for p in paths]
+    else:
+        raise ValueError(f'未知阶段: {name}')
+
+    setup_rss = peak_rss_mb()
+    result = summarize(time_calls(fn, calls), items_per_call)
+    result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    result['stage_rss_mb'] = round(result['peak_rss_mb'] - setup_rss, 1)
+    return result
+
+
+def run_child(name, model_path, num_images, iters):
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', name, '--model', model_path,
+           '--images', str(num_images), '--iters', str(iters)]
+    output = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_benchmarks(model_path, num_images=200, batch_sizes=(1, 8, 32), thread_counts=None, iters=20):
+    results = {}
+    for name in stage_names(batch_sizes, thread_counts):
+        print(f"⏱️ {name}", flush=True)
+        results[name] = run_child(name, model_path, num_images, iters)
+    return results
+
+
+# ============================================
+# 3. 与基线比较
+# ============================================
+def compare(results, baseline, tolerance):
+    """逐项比较 p50 延迟、吞吐量和峰值 RSS，返回退化项列表；p95/p99 样本太少，不参与判定"""
+    regressions = []
+    for name, base in baseline.get('results', {}).items():
+        current = results.get(name)
+        if current is None:
+            continue
+        for metric in GATED_METRICS:
+            if metric in base and current[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f'{name} {metric}: {base[metric]:.2f} -> {current[metric]:.2f}')
+        if current['images_per_sec'] < base['images_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name} images_per_sec: {base['images_per_sec']:.1f} -> "
+                               f"{current['images_per_sec']:.1f}")
+    return regressions
+
+
+def print_table(results, baseline=None):
+    base = (baseline or {}).get('results', {})
+    print(f"{'阶段':<30s}{'p50(ms)':>10s}{'p95(ms)':>10s}{'p99(ms)':>10s}{'图片/秒':>12s}{'RSS(MB)':>10s}"
+          f"{'增量(MB)':>10s}{'基线p50':>10s}")
+    print("=" * 102)
+    for name, r in results.items():
+        base_p50 = f"{base[name]['p50_ms']:.2f}" if name in base else '-'
+        print(f"{name:<30s}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+              f"{r['images_per_sec']:>12.1f}{r['peak_rss_mb']:>10.1f}{r['stage_rss_mb']:>10.1f}{base_p50:>10s}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分阶段性能基准测试')
+    parser.add_argument('--model', default=MODEL_PATH, help='模型文件路径')
+    parser.add_argument('--images', type=int, default=200, help='解码/预处理/端到端阶段使用的图片数')
+    parser.add_argument('--batch-sizes', default='1,8,32', help='前向阶段的 batch size（逗号分隔）')
+    parser.add_argument('--threads', default=None, help='前向阶段的线程数（逗号分隔，默认 1 和全部核心）')
+    parser.add_argument('--iters', type=int, default=20, help='前向阶段每个配置的迭代次数')
+    parser.add_argument('--output', default='benchmark_results.json', help='结果 JSON 输出路径')
+    parser.add_argument('--baseline', default=None, help='基线 JSON，退化超过容差时以非零状态退出')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='允许的相对退化比例')
+    parser.add_argument('--save-baseline', default=None, help='把本次结果另存为基线 JSON')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_stage(args.child, args.model, args.images, args.iters)))
+        return
+
+    batch_sizes = [int(x) for x in args.batch_sizes.split(',')]
+    thread_counts = [int(x) for x in args.threads.split(',')] if args.threads else None
+    results = run_benchmarks(args.model, args.images, batch_sizes, thread_counts, args.iters)
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'torch': torch.__version__,
+        },
+        'results': results,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 结果已写入 {args.output}")
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.save_baseline) or '.', exist_ok=True)
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 基线已保存到 {args.save_baseline}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ 发现 {len(regressions)} 项性能退化（容差 {args.tolerance:.0%}）:")
+            for item in regressions:
+                print(f"  - {item}")
+            raise SystemExit(1)
+        print(f"\n✅ 与基线相比无退化（容差 {args.tolerance:.0%}）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""
+知识蒸馏：以 best_model.pth 为教师，训练适合边缘设备 CPU 的小型学生网络
+
+ResNet18 + 两层全连接对 6 类 200x200 灰度小块来说过大。本脚本在与 train.py 相同的 ImageFolder 数据上，
+用教师的软标签（温度 T 的 softmax）加真实标签训练一个小得多的学生网络：
+- resnet-narrow：4 个 stage、每个 stage 1 个 BasicBlock，通道数 16/32/64/128（默认）；
+- mobilenet：torchvision MobileNetV3-Small（width_mult 可调）。
+
+教师 logits 预先计算并缓存：训练集生成 K 个增强视图（每个视图的随机增强由 (种子, 视图, 样本序号) 唯一确定），
+第 e 个 epoch 使用第 e % K 个视图，学生看到的图像与缓存 logits 对应的图像完全一致，因此教师对每个视图只运行一次。
+
+学生模型保存为 student_model.pth（结构配置 + state_dict），同时导出 TorchScript 版本 student_model.pt，
+可直接被 app.py（DEFECT_MODEL_PATH=student_model.pt）、batch_predict.py 和 serve.py 加载。
+
+用法：
+    python distill.py                                   # 训练 resnet-narrow 学生并输出对比报告
+    python distill.py --student mobilenet --width 0.5 --epochs 40
+    python distill.py --report-only                     # 只评估已有的 student_model.pth
+"""
+
+import argparse
+import os
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.optim as optim
+from torch.utils.data import DataLoader, Dataset
+from torchvision import datasets, models
+from torchvision.models.resnet import BasicBlock
+from tqdm import tqdm
+
+from model_utils import (MODEL_PATH, class_names, count_parameters, data_transforms, load_model, measure_latency,
+                         per_class_accuracy, split_dir)
+from prediction_cache import model_version
+
+CACHE_VERSION = 1
+LOGITS_CACHE = './cache/teacher_logits.pt'
+STUDENT_PATH = 'student_model.pth'
+
+
+# ============================================
+# 1. 学生网络
+# ============================================
+class NarrowResNet(nn.Module):
+    """窄版 ResNet：每个 stage 一个 BasicBlock，通道数由 widths 指定"""
+
+    def __init__(self, widths=(16, 32, 64, 128), num_classes=6):
+        super().__init__()
+        self.stem = nn.Sequential(
+            nn.Conv2d(3, widths[0], kernel_size=3, stride=2, padding=1, bias=False),
+            nn.BatchNorm2d(widths[0]),
+            nn.ReLU(inplace=True),
+            nn.MaxPool2d(kernel_size=3, stride=2, padding=1),
+        )
+        blocks = []
+        in_ch = widths[0]
+        for i, width in enumerate(widths):
+            stride = 1 if i == 0 else 2
+            downsample = None
+            if stride != 1 or in_ch != width:
+                downsample = nn.Sequential(nn.Conv2d(in_ch, width, 1, stride, bias=False), nn.BatchNorm2d(width))
+            blocks.append(BasicBlock(in_ch, width, stride, downsample))
+            in_ch = width
+        self.layers = nn.Sequential(*blocks)
+        self.avgpool = nn.AdaptiveAvgPool2d(1)
+        self.fc = nn.Linear(in_ch, num_classes)
+
+    def forward(self, x):
+        x = self.layers(self.stem(x))
+        return self.fc(torch.flatten(self.avgpool(x), 1))
+
+
+def build_student(arch='resnet-narrow', width=1.0, num_classes=6):
+    """按结构名和宽度系数构建学生网络"""
+    if arch == 'resnet-narrow':
+        widths = tuple(max(8, int(round(c * width))) for c in (16, 32, 64, 128))
+        return NarrowResNet(widths, num_classes)
+    if arch == 'mobilenet':
+        return models.mobilenet_v3_small(weights=None, num_classes=num_classes, width_mult=width)
+    raise ValueError(f"未知的学生网络结构 '{arch}'")
+
+
+def load_student(path=STUDENT_PATH):
+    """读取 distill.py 保存的学生模型，返回 eval 模式的模型"""
+    checkpoint = torch.load(path, map_location='cpu')
+    model = build_student(checkpoint['arch'], checkpoint['width'], len(checkpoint['classes']))
+    model.load_state_dict(checkpoint['state_dict'])
+    return model.eval()
+
+
+# ============================================
+# 2. 可复现的增强视图与教师 logits 缓存
+# ============================================
+class SeededViewDataset(Dataset):
+    """
+    ImageFolder 的确定性增强版本：第 view 个视图中第 idx 张图片的随机增强只由 (seed, view, idx) 决定
+    在独立的随机数状态中执行增强，不影响训练循环的随机数序列
+    """
+
+    def __init__(self, split, transform, seed=42):
+        self.folder = datasets.ImageFolder(split_dir(split))
+        self.classes = self.folder.classes
+        self.transform = transform
+        self.seed = seed
+        self.view = 0
+
+    def __len__(self):
+        return len(self.folder)
+
+    def __getitem__(self, idx):
+        image, target = self.folder[idx]
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(self.seed * 1_000_003 + self.view * len(self.folder) + idx)
+            image = self.transform(image)
+        return image, target, idx
+
+
+@torch.inference_mode()
+def teacher_logits(teacher, dataset, batch_size=64, num_workers=0):
+    """对数据集的当前视图运行教师，返回 logits[N, C]（按样本序号排列）"""
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    return torch.cat([teacher(inputs).float() for inputs, _, _ in tqdm(loader, desc='Teacher', leave=False)])
+
+
+def load_or_build_logits(teacher_path, views, seed=42, cache_path=LOGITS_CACHE, num_workers=0):
+    """
+    读取或生成训练集的教师 logits 缓存：train 为 [K, N, C]（验证集只用真实标签评估学生，不需要教师 logits）
+    教师权重（内容哈希）、种子或视图数不匹配时重新生成
+    """
+    teacher_id = model_version(teacher_path)
+    if os.path.exists(cache_path):
+        cache = torch.load(cache_path, map_location='cpu')
+        if (cache.get('version') == CACHE_VERSION and cache['teacher'] == teacher_id
+                and cache['seed'] == seed and cache['train'].shape[0] >= views):
+            cache['train'] = cache['train'][:views]
+            print(f"✅ 复用教师 logits 缓存: {cache_path} ({views} 个视图)")
+            return cache
+
+    teacher = load_model(teacher_path, backend='eager')
+    train_set = SeededViewDataset('train', data_transforms['train'], seed)
+    start = time.perf_counter()
+    train_logits = []
+    for view in range(views):
+        print(f"计算教师 logits：训练集视图 {view + 1}/{views}")
+        train_set.view = view
+        train_logits.append(teacher_logits(teacher, train_set, num_workers=num_workers))
+    cache = {
+        'version': CACHE_VERSION,
+        'teacher': teacher_id,
+        'seed': seed,
+        'train': torch.stack(train_logits),
+        'classes': train_set.classes,
+        'build_time': time.perf_counter() - start,
+    }
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    torch.save(cache, cache_path)
+    print(f"💾 教师 logits 已缓存: {cache_path}，耗时 {cache['build_time']:.1f}s")
+    return cache
+
+
+# ============================================
+# 3. 蒸馏训练
+# ============================================
+def distillation_loss(student_logits, teacher_logits, labels, temperature=4.0, alpha=0.7):
+    """alpha * T² * KL(学生软分布 || 教师软分布) + (1 - alpha) * 交叉熵"""
+    soft = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                    F.softmax(teacher_logits / temperature, dim=1), reduction='batchmean')
+    return alpha * temperature ** 2 * soft + (1 - alpha) * F.cross_entropy(student_logits, labels)
+
+
+def train_student(student, cache, num_epochs=30, batch_size=32, lr=1e-3, temperature=4.0, alpha=0.7,
+                  seed=42, num_workers=0):
+    """训练学生网络，返回 (最佳 state_dict, 最佳验证集准确率)"""
+    torch.manual_seed(seed)
+    train_set = SeededViewDataset('train', data_transforms['train'], seed)
+    val_loader = DataLoader(datasets.ImageFolder(split_dir('validation'), data_transforms['validation']),
+                            batch_size=64, shuffle=False, num_workers=num_workers)
+    num_views = cache['train'].shape[0]
+
+    optimizer = optim.AdamW(student.parameters(), lr=lr, weight_decay=1e-4)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, num_epochs)
+    best_acc, best_state = 0.0, None
+    for epoch in range(num_epochs):
+        # 第 e 个 epoch 使用第 e % K 个视图，与缓存的教师 logits 一一对应
+        train_set.view = epoch % num_views
+        view_logits = cache['train'][train_set.view]
+        loader = DataLoader(train_set, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+
+        student.train()
+        running_loss, running_corrects = 0.0, 0
+        for inputs, labels, idx in tqdm(loader, desc=f'Epoch {epoch + 1}/{num_epochs}', leave=False):
+            optimizer.zero_grad()
+            outputs = student(inputs)
+            loss = distillation_loss(outputs, view_logits[idx], labels, temperature, alpha)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item() * inputs.size(0)
+            running_corrects += (outputs.argmax(1) == labels).sum().item()
+        scheduler.step()
+
+        student.eval()
+        _, val_acc = per_class_accuracy(student, val_loader)
+        print(f"Epoch {epoch + 1}/{num_epochs}  Loss: {running_loss / len(train_set):.4f}  "
+              f"Train Acc: {running_corrects / len(train_set):.4f}  Val Acc: {val_acc:.4f}")
+        if val_acc > best_acc:
+            best_acc = val_acc
+            best_state = {k: v.clone() for k, v in student.state_dict().items()}
+    return best_state, best_acc
+
+
+def save_student(student, arch, width, path=STUDENT_PATH):
+    """保存结构配置 + state_dict，并导出同名 TorchScript（.pt）供 load_model 直接加载"""
+    torch.save({'arch': arch, 'width': width, 'classes': class_names, 'state_dict': student.state_dict()}, path)
+    script_path = os.path.splitext(path)[0] + '.pt'
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(student.eval(), torch.rand(1, 3, 224, 224)))
+    traced.save(script_path)
+    return script_path
+
+
+# ============================================
+# 4. 对比报告
+# ============================================
+def report(teacher, student, teacher_path, student_path, batch_size=16):
+    loader = DataLoader(datasets.ImageFolder(split_dir('validation'), data_transforms['validation']),
+                        batch_size=batch_size, shuffle=False, num_workers=0)
+    teacher_acc, teacher_total = per_class_accuracy(teacher, loader)
+    student_acc, student_total = per_class_accuracy(student, loader)
+
+    print("\n" + "=" * 56)
+    print("各类别准确率对比（验证集）")
+    print("=" * 56)
+    print(f"{'类别':<18s}{'教师':>10s}{'学生':>10s}{'差值':>10s}")
+    for name, a, b in zip(class_names, teacher_acc, student_acc):
+        print(f"{name:<18s}{a:>10.4f}{b:>10.4f}{b - a:>+10.4f}")
+    print(f"{'总体':<18s}{teacher_total:>10.4f}{student_total:>10.4f}{student_total - teacher_total:>+10.4f}")
+
+    print("\n" + "=" * 56)
+    print("延迟、参数量与模型大小")
+    print("=" * 56)
+    for bs in (1, batch_size):
+        teacher_ms = measure_latency(teacher, bs)
+        student_ms = measure_latency(student, bs)
+        print(f"batch={bs:<3d} 教师: {teacher_ms:8.2f} ms  学生: {student_ms:8.2f} ms  加速 {teacher_ms / student_ms:.2f}x")
+    teacher_params, student_params = count_parameters(teacher), count_parameters(student)
+    print(f"参数量    教师: {teacher_params / 1e6:.2f} M  学生: {student_params / 1e6:.3f} M  "
+          f"缩小 {teacher_params / student_params:.1f}x")
+    teacher_mb = os.path.getsize(teacher_path) / 1024 / 1024
+    student_mb = os.path.getsize(student_path) / 1024 / 1024
+    print(f"模型大小  教师: {teacher_mb:.1f} MB  学生: {student_mb:.2f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='知识蒸馏：训练小型学生网络')
+    parser.add_argument('--teacher', default=MODEL_PATH, help='教师模型（.pth）')
+    parser.add_argument('--student', default='resnet-narrow', choices=['resnet-narrow', 'mobilenet'],
+                        help='学生网络结构')
+    parser.add_argument('--width', type=float, default=1.0, help='学生网络宽度系数')
+    parser.add_argument('--views', type=int, default=8, help='训练集缓存的增强视图数')
+    parser.add_argument('--epochs', type=int, default=30, help='训练轮数')
+    parser.add_argument('--batch-size', type=int, default=32, help='Batch Size')
+    parser.add_argument('--lr', type=float, default=1e-3, help='学习率（AdamW + 余弦退火）')
+    parser.add_argument('--temperature', type=float, default=4.0, help='蒸馏温度')
+    parser.add_argument('--alpha', type=float, default=0.7, help='软标签损失权重')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子（决定增强视图）')
+    parser.add_argument('--workers', type=int, default=0, help='DataLoader 工作进程数')
+    parser.add_argument('--output', default=STUDENT_PATH, help='学生模型输出路径')
+    parser.add_argument('--report-only', action='store_true', help='不训练，只评估已有的学生模型')
+    args = parser.parse_args()
+
+    teacher = load_model(args.teacher, backend='eager')
+    if args.report_only:
+        student = load_student(args.output)
+    else:
+        cache = load_or_build_logits(args.teacher, args.views, args.seed, num_workers=args.workers)
+        student = build_student(args.student, args.width, len(class_names))
+        print(f"学生网络: {args.student}（宽度 {args.width}），参数量 {count_parameters(student) / 1e6:.3f} M")
+        best_state, best_acc = train_student(student, cache, args.epochs, args.batch_size, args.lr,
+                                             args.temperature, args.alpha, args.seed, args.workers)
+        student.load_state_dict(best_state)
+        script_path = save_student(student, args.student, args.width, args.output)
+        print(f"💾 学生模型已保存: {args.output}（TorchScript: {script_path}），最佳验证集准确率 {best_acc:.4f}")
+    report(teacher, student.eval(), args.teacher, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""
+基于置信度的提前退出（early exit）分类
+
+NEU-DET 中 patches、scratches、inclusion 等类别很容易区分，但每张图片都要完整地经过 ResNet18 的四个 stage。
+本模块在 layer2 和 layer3 之后各加一个轻量辅助分类头（全局平均池化 + 两层全连接），
+在冻结主干的特征上训练（特征只提取一次并缓存在内存中）。推理时：
+- 某个头的 softmax 最大概率达到阈值的样本立即返回该头的结果；
+- 同一批次中只有尚未确定的样本继续进入更深的 stage（按索引取子批次），已确定的样本不再计算。
+
+报告每个阈值下的准确率、平均退出深度、各出口占比以及相对完整模型节省的延迟。
+
+用法：
+    python early_exit.py                                # 训练辅助头并扫描阈值
+    python early_exit.py --thresholds 0.9,0.95,0.99 --eval-only
+    python batch_predict.py data/validation/images --early-exit 0.95
+"""
+
+import argparse
+import copy
+import time
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader
+from torchvision import datasets
+from tqdm import tqdm
+
+from model_utils import MODEL_PATH, build_head, class_names, data_transforms, load_model, split_dir
+
+HEADS_PATH = 'early_exit_heads.pth'
+EXITS = ('layer2', 'layer3')
+EXIT_CHANNELS = {'layer2': 128, 'layer3': 256}
+
+
+# ============================================
+# 1. 带辅助出口的模型
+# ============================================
+class ExitHead(nn.Module):
+    """全局平均池化 + build_head 同结构的两层全连接"""
+
+    def __init__(self, in_channels, hidden_size=128, num_classes=6):
+        super().__init__()
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.fc = build_head(in_channels, hidden_size, num_classes)
+
+    def forward(self, x):
+        return self.fc(torch.flatten(self.pool(x), 1))
+
+
+class EarlyExitModel(nn.Module):
+    """
+    ResNet18 + layer2 / layer3 辅助出口，调用方式与原模型相同（输入批次，输出 logits）
+    exit_counts 记录各出口累计返回的样本数：0=layer2，1=layer3，2=完整模型
+    """
+
+    def __init__(self, model, heads, threshold=0.95):
+        super().__init__()
+        self.model = model
+        self.heads = nn.ModuleDict(heads)
+        self.threshold = threshold
+        self.exit_counts = [0] * (len(EXITS) + 1)
+
+    def forward(self, x):
+        m = self.model
+        x = m.layer1(m.maxpool(m.relu(m.bn1(m.conv1(x)))))
+        logits = None
+        remaining = torch.arange(x.shape[0])
+        for depth, name in enumerate(EXITS):
+            x = getattr(m, name)(x)
+            head_logits = self.heads[name](x)
+            if logits is None:
+                logits = head_logits.new_empty(remaining.shape[0], head_logits.shape[1])
+            resolved = torch.softmax(head_logits, dim=1).max(dim=1).values >= self.threshold
+            logits[remaining[resolved]] = head_logits[resolved]
+            self.exit_counts[depth] += int(resolved.sum())
+            if resolved.all():
+                return logits
+            # 只有未确定的样本继续向后计算
+            unresolved = ~resolved
+            remaining, x = remaining[unresolved], x[unresolved]
+        x = m.layer4(x)
+        logits[remaining] = m.fc(torch.flatten(m.avgpool(x), 1))
+        self.exit_counts[-1] += remaining.shape[0]
+        return logits
+
+    def reset_counts(self):
+        self.exit_counts = [0] * (len(EXITS) + 1)
+
+
+def stage_features(model, x):
+    """冻结主干前向，返回 layer2、layer3 输出经全局平均池化后的特征"""
+    x = model.layer1(model.maxpool(model.relu(model.bn1(model.conv1(x)))))
+    feats = {}
+    for name in EXITS:
+        x = getattr(model, name)(x)
+        feats[name] = torch.flatten(nn.functional.adaptive_avg_pool2d(x, 1), 1)
+    return feats
+
+
+def load_early_exit(model, heads_path=HEADS_PATH, threshold=0.95):
+    """把训练好的辅助头装到 eager 模型上，返回 EarlyExitModel"""
+    checkpoint = torch.load(heads_path, map_location='cpu')
+    heads = {}
+    for name in EXITS:
+        heads[name] = ExitHead(EXIT_CHANNELS[name], checkpoint['hidden_size'], len(class_names))
+        heads[name].load_state_dict(checkpoint['heads'][name])
+    return EarlyExitModel(model, heads, threshold).eval()
+
+
+# ============================================
+# 2. 在冻结特征上训练辅助头
+# ============================================
+@torch.no_grad()
+def extract_stage_features(model, split, views=1, batch_size=64):
+    """返回 ({出口名: 特征[views*N, C]}, 标签[views*N])；训练集的每个视图是一次独立的随机增强"""
+    dataset = datasets.ImageFolder(split_dir(split), data_transforms[split])
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=0)
+    feats = {name: [] for name in EXITS}
+    labels = []
+    for view in range(views):
+        for inputs, targets in tqdm(loader, desc=f'Extract {split} {view + 1}/{views}', leave=False):
+            for name, f in stage_features(model, inputs).items():
+                feats[name].append(f)
+            labels.append(targets)
+    return {name: torch.cat(f) for name, f in feats.items()}, torch.cat(labels)
+
+
+def train_heads(model, views=4, epochs=30, batch_size=64, lr=1e-3, hidden_size=128, seed=42):
+    """在缓存的池化特征上训练各出口的全连接层，返回 {出口名: ExitHead}"""
+    torch.manual_seed(seed)
+    train_feats, train_labels = extract_stage_features(model, 'train', views)
+    val_feats, val_labels = extract_stage_features(model, 'validation')
+    heads = {}
+    criterion = nn.CrossEntropyLoss()
+    for name in EXITS:
+        head = ExitHead(EXIT_CHANNELS[name], hidden_size, len(class_names))
+        optimizer = optim.Adam(head.fc.parameters(), lr=lr)
+        best_acc, best_state = 0.0, None
+        for _ in range(epochs):
+            head.fc.train()
+            order = torch.randperm(len(train_labels))
+            for start in range(0, len(order), batch_size):
+                idx = order[start:start + batch_size]
+                optimizer.zero_grad()
+                criterion(head.fc(train_feats[name][idx]), train_labels[idx]).backward()
+                optimizer.step()
+            head.fc.eval()
+            with torch.no_grad():
+                acc = (head.fc(val_feats[name]).argmax(1) == val_labels).float().mean().item()
+            if acc > best_acc:
+                best_acc, best_state = acc, copy.deepcopy(head.state_dict())
+        head.load_state_dict(best_state)
+        heads[name] = head.eval()
+        print(f"✅ {name} 出口头: 验证集准确率 {best_acc:.4f}")
+    return heads
+
+
+# ============================================
+# 3. 阈值扫描
+# ============================================
+@torch.inference_mode()
+def evaluate(model, loader):
+    """返回 (准确率, 总耗时秒)"""
+    correct = total = 0
+    elapsed = 0.0
+    for inputs, labels in loader:
+        start = time.perf_counter()
+        preds = model(inputs).argmax(1)
+        elapsed += time.perf_counter() - start
+        correct += (preds == labels).sum().item()
+        total += labels.numel()
+    return correct / total, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='基于置信度的提前退出分类')
+    parser.add_argument('--model', default=MODEL_PATH, help='模型文件路径（.pth）')
+    parser.add_argument('--heads', default=HEADS_PATH, help='辅助头权重路径')
+    parser.add_argument('--thresholds', default='0.8,0.9,0.95,0.99', help='扫描的置信度阈值（逗号分隔）')
+    parser.add_argument('--views', type=int, default=4, help='训练辅助头时训练集的增强视图数')
+    parser.add_argument('--epochs', type=int, default=30, help='辅助头训练轮数')
+    parser.add_argument('--hidden-size', type=int, default=128, help='辅助头隐藏层维度')
+    parser.add_argument('--batch-size', type=int, default=16, help='评估时的 Batch Size')
+    parser.add_argument('--threads', type=int, default=None, help='推理使用的 CPU 线程数')
+    parser.add_argument('--eval-only', action='store_true', help='不训练，直接使用已有的辅助头')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = load_model(args.model, backend='eager')
+    if args.eval_only:
+        early = load_early_exit(model, args.heads)
+    else:
+        heads = train_heads(model, args.views, args.epochs, hidden_size=args.hidden_size)
+        torch.save({'hidden_size': args.hidden_size,
+                    'heads': {name: head.state_dict() for name, head in heads.items()}}, args.heads)
+        print(f"💾 辅助头已保存: {args.heads}")
+        early = EarlyExitModel(model, heads).eval()
+
+    dataset = datasets.ImageFolder(split_dir('validation'), data_transforms['validation'])
+    loaders = {bs: DataLoader(dataset, batch_size=bs, shuffle=False, num_workers=0) for bs in (1, args.batch_size)}
+    full = {bs: evaluate(model, loader) for bs, loader in loaders.items()}
+
+    print("\n" + "=" * 96)
+    print(f"{'阈值':>8s}{'准确率':>10s}{'平均深度':>10s}{'layer2':>9s}{'layer3':>9s}{'完整':>9s}"
+          f"{'bs=1 节省':>12s}{f'bs={args.batch_size} 节省':>14s}")
+    print("=" * 96)
+    acc, _ = full[1]
+    print(f"{'完整模型':>6s}{acc:>10.4f}{4.0:>10.2f}{'-':>9s}{'-':>9s}{'100%':>9s}{'-':>12s}{'-':>14s}")
+    for threshold in [float(t) for t in args.thresholds.split(',')]:
+        early.threshold = threshold
+        saved = {}
+        for bs, loader in loaders.items():
+            early.reset_counts()
+            acc_bs, elapsed = evaluate(early, loader)
+            saved[bs] = 1 - elapsed / full[bs][1]
+            if bs == 1:
+                acc, counts = acc_bs, list(early.exit_counts)
+        total = sum(counts)
+        # 退出深度以 ResNet stage 计：layer2 出口 = 2，layer3 出口 = 3，完整模型 = 4
+        depth = sum(d * c for d, c in zip((2, 3, 4), counts)) / total
+        fractions = ''.join(f"{c / total:>9.1%}" for c in counts)
+        print(f"{threshold:>8.2f}{acc:>10.4f}{depth:>10.2f}{fractions}{saved[1]:>12.1%}{saved[args.batch_size]:>14.1%}")
+
+
+if __name__ == '__main__':
+    main()
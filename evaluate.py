@@ -0,0 +1,224 @@
+"""
+模型评估：对一个或多个 .pth 检查点在指定数据划分上流式计算混淆矩阵与各类别指标
+
+train.py 末尾的评估代码只能在训练结束后运行，并把所有预测追加到 Python 列表再交给 sklearn。
+本脚本可以单独评估任意检查点：
+- 每个批次直接把 (标签, 预测) 计数累加进预先分配的 KxK 混淆矩阵张量，不保存逐样本预测；
+- 由混淆矩阵计算各类别 precision / recall / F1 / support 以及 macro / weighted 平均；
+- 多个检查点时，数据集只解码一次（uint8 张量放入共享内存），各检查点在独立进程中并行评估；
+- 结果写入 JSON 报告。
+
+用法：
+    python evaluate.py best_model.pth
+    python evaluate.py best_model.pth runs/*.pth --workers 4 --output evaluation_report.json
+    python evaluate.py best_model.pth --split train --gray
+"""
+
+import argparse
+import json
+import os
+import time
+
+import torch
+import torch.multiprocessing as mp
+from torchvision import datasets, transforms
+
+from model_utils import IMAGENET_MEAN, IMAGENET_STD, class_names, load_model, split_dir
+
+
+# ============================================
+# 1. 增量混淆矩阵
+# ============================================
+class ConfusionMatrix:
+    """matrix[i, j] 为真实类别 i 被预测为 j 的样本数；update 在每个批次上原地累加"""
+
+    def __init__(self, num_classes=len(class_names)):
+        self.num_classes = num_classes
+        self.matrix = torch.zeros(num_classes, num_classes, dtype=torch.int64)
+
+    def update(self, preds, labels):
+        k = self.num_classes
+        self.matrix += torch.bincount(labels.cpu() * k + preds.cpu(), minlength=k * k).view(k, k)
+
+    def merge(self, other):
+        self.matrix += other.matrix
+        return self
+
+    @property
+    def total(self):
+        return int(self.matrix.sum())
+
+    def accuracy(self):
+        return (self.matrix.diag().sum() / self.matrix.sum().clamp(min=1)).item()
+
+    def per_class(self):
+        """返回 (precision, recall, f1, support) 四个长度为 K 的张量"""
+        m = self.matrix.double()
+        tp = m.diag()
+        support = m.sum(dim=1)
+        precision = tp / m.sum(dim=0).clamp(min=1)
+        recall = tp / support.clamp(min=1)
+        f1 = 2 * precision * recall / (precision + recall).clamp(min=1e-12)
+        return precision, recall, f1, support
+
+    def summary(self, names=class_names):
+        """JSON 友好的指标字典"""
+        precision, recall, f1, support = self.per_class()
+        weights = support / support.sum().clamp(min=1)
+        return {
+            'accuracy': round(self.accuracy(), 6),
+            'samples': self.total,
+            'macro': {'precision': round(precision.mean().item(), 6), 'recall': round(recall.mean().item(), 6),
+                      'f1': round(f1.mean().item(), 6)},
+            'weighted': {'precision': round((precision * weights).sum().item(), 6),
+                         'recall': round((recall * weights).sum().item(), 6),
+                         'f1': round((f1 * weights).sum().item(), 6)},
+            'per_class': {name: {'precision': round(p, 6), 'recall': round(r, 6), 'f1': round(f, 6), 'support': int(s)}
+                          for name, p, r, f, s in zip(names, precision.tolist(), recall.tolist(),
+                                                      f1.tolist(), support.tolist())},
+            'confusion_matrix': self.matrix.tolist(),
+        }
+
+    def report(self, names=class_names):
+        """与 sklearn classification_report 相同排版的文本报告"""
+        precision, recall, f1, support = self.per_class()
+        summary = self.summary(names)
+        width = max(len(n) for n in names + ['weighted avg'])
+        lines = [f"{'':>{width}s}{'precision':>11s}{'recall':>10s}{'f1-score':>10s}{'support':>10s}", '']
+        for name, p, r, f, s in zip(names, precision.tolist(), recall.tolist(), f1.tolist(), support.tolist()):
+            lines.append(f"{name:>{width}s}{p:>11.2f}{r:>10.2f}{f:>10.2f}{int(s):>10d}")
+        lines.append('')
+        lines.append(f"{'accuracy':>{width}s}{'':>11s}{'':>10s}{summary['accuracy']:>10.2f}{self.total:>10d}")
+        for avg in ('macro', 'weighted'):
+            m = summary[avg]
+            lines.append(f"{avg + ' avg':>{width}s}{m['precision']:>11.2f}{m['recall']:>10.2f}{m['f1']:>10.2f}"
+                         f"{self.total:>10d}")
+        return '\n'.join(lines)
+
+
+@torch.no_grad()
+def evaluate_model(model, loader, device='cpu', prepare=None):
+    """遍历 loader（产出 (inputs, labels)），返回 ConfusionMatrix；prepare 可在前向前转换输入"""
+    confusion = ConfusionMatrix()
+    for inputs, labels in loader:
+        if prepare is not None:
+            inputs = prepare(inputs)
+        preds = model(inputs.to(device)).argmax(dim=1)
+        confusion.update(preds, labels)
+    return confusion
+
+
+# ============================================
+# 2. 共享的解码数据
+# ============================================
+# 验证集预处理中与随机性无关的几何部分；ToTensor + Normalize 在批次上完成
+decode_transform = transforms.Compose([
+    transforms.Resize(256),
+    transforms.CenterCrop(224),
+    transforms.PILToTensor(),
+])
+
+
+def decode_split(split):
+    """把一个数据划分解码为 uint8 张量 [N,3,224,224] 和标签 [N]，放入共享内存"""
+    dataset = datasets.ImageFolder(split_dir(split), decode_transform)
+    images = torch.empty(len(dataset), 3, 224, 224, dtype=torch.uint8)
+    labels = torch.empty(len(dataset), dtype=torch.int64)
+    for i in range(len(dataset)):
+        images[i], labels[i] = dataset[i]
+    return images.share_memory_(), labels.share_memory_()
+
+
+class Normalizer:
+    """uint8 批次 -> 模型输入（与 ToTensor + Normalize 一致；gray 模式只取一个通道且不标准化）"""
+
+    def __init__(self, input_mode='rgb'):
+        self.input_mode = input_mode
+        self.mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+        self.std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+
+    def __call__(self, batch):
+        x = batch.float().div_(255)
+        if self.input_mode == 'gray':
+            return x[:, :1].contiguous()
+        return (x - self.mean) / self.std
+
+
+def batches(images, labels, batch_size):
+    for start in range(0, len(labels), batch_size):
+        yield images[start:start + batch_size], labels[start:start + batch_size]
+
+
+def evaluate_checkpoint(path, images, labels, input_mode='rgb', batch_size=64, threads=None):
+    """评估单个检查点，返回指标字典（可在子进程中运行）"""
+    if threads:
+        torch.set_num_threads(threads)
+    start = time.perf_counter()
+    model = load_model(path, input_mode=input_mode, backend='eager')
+    confusion = evaluate_model(model, batches(images, labels, batch_size), prepare=Normalizer(input_mode))
+    result = confusion.summary()
+    result['eval_time'] = round(time.perf_counter() - start, 3)
+    return path, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查点评估：混淆矩阵与各类别指标')
+    parser.add_argument('checkpoints', nargs='+', help='一个或多个 .pth 检查点')
+    parser.add_argument('--split', default='validation', choices=['train', 'validation'], help='评估的数据划分')
+    parser.add_argument('--gray', action='store_true', help='使用单通道快速推理路径')
+    parser.add_argument('--batch-size', type=int, default=64, help='评估 Batch Size')
+    parser.add_argument('--workers', type=int, default=None, help='并行评估的进程数（默认 min(检查点数, CPU 核数)）')
+    parser.add_argument('--output', default='evaluation_report.json', help='JSON 报告输出路径')
+    args = parser.parse_args()
+
+    # 报告按检查点路径索引：同一文件（包括不同写法的路径）只评估一次
+    seen, checkpoints = set(), []
+    for path in args.checkpoints:
+        if os.path.abspath(path) not in seen:
+            seen.add(os.path.abspath(path))
+            checkpoints.append(path)
+    if len(checkpoints) < len(args.checkpoints):
+        print(f"⚠️ 忽略 {len(args.checkpoints) - len(checkpoints)} 个重复的检查点")
+    args.checkpoints = checkpoints
+
+    input_mode = 'gray' if args.gray else 'rgb'
+    start = time.perf_counter()
+    images, labels = decode_split(args.split)
+    decode_time = time.perf_counter() - start
+    print(f"✅ {args.split}: 解码 {len(labels)} 张图片，耗时 {decode_time:.1f}s")
+
+    workers = min(args.workers or os.cpu_count() or 1, len(args.checkpoints))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    if workers > 1:
+        # 解码后的张量位于共享内存，子进程直接映射，不重复解码或复制
+        with mp.get_context('spawn').Pool(workers) as pool:
+            results = pool.starmap(evaluate_checkpoint, [(path, images, labels, input_mode, args.batch_size, threads)
+                                                         for path in args.checkpoints])
+    else:
+        results = [evaluate_checkpoint(path, images, labels, input_mode, args.batch_size)
+                   for path in args.checkpoints]
+
+    for path, result in results:
+        confusion = ConfusionMatrix()
+        confusion.matrix = torch.tensor(result['confusion_matrix'])
+        print(f"\n{'=' * 60}\n{path}（{result['eval_time']:.1f}s）\n{'=' * 60}")
+        print(confusion.report())
+
+    if len(results) > 1:
+        print(f"\n{'检查点':<40s}{'准确率':>10s}{'macro F1':>10s}")
+        for path, result in sorted(results, key=lambda r: -r[1]['accuracy']):
+            print(f"{path:<40s}{result['accuracy']:>10.4f}{result['macro']['f1']:>10.4f}")
+
+    report = {
+        'meta': {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'split': args.split, 'input_mode': input_mode,
+                 'samples': len(labels), 'classes': class_names, 'decode_time': round(decode_time, 3),
+                 'workers': workers},
+        'checkpoints': dict(results),
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 评估报告已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+导出编译后的推理模型（TorchScript / ONNX），并在加载时选择推理后端
+
+load_model() 默认总是重新构建 eager 模式的 resnet18 再加载 state_dict。本脚本从 best_model.pth 导出：
+- TorchScript：trace 后 freeze，权重内联为常量，便于图级优化（conv-bn 折叠等）；
+- ONNX：动态 batch 维度，由 ONNX Runtime 以最高图优化级别执行。
+
+model_utils.load_model(backend='eager' | 'torchscript' | 'onnx') 会自动找到对应的导出文件，
+三种后端都通过同一个 predict 接口调用。
+
+用法：
+    python export.py                      # 导出 TorchScript 和 ONNX
+    python export.py --gray               # 导出单通道快速路径版本
+    python export.py --check              # 各后端输出一致性检查与延迟对比
+"""
+
+import argparse
+import os
+import time
+
+import torch
+
+from model_utils import MODEL_PATH, class_names, load_model
+
+BACKENDS = ('eager', 'torchscript', 'onnx')
+
+
+def export_paths(model_path=MODEL_PATH, input_mode='rgb'):
+    """返回某个权重文件对应的导出文件路径"""
+    base = os.path.splitext(model_path)[0] + ('_gray' if input_mode == 'gray' else '')
+    return {'torchscript': base + '_ts.pt', 'onnx': base + '.onnx'}
+
+
+def example_input(input_mode='rgb', batch_size=1):
+    channels = 1 if input_mode == 'gray' else 3
+    return torch.rand(batch_size, channels, 224, 224)
+
+
+# ============================================
+# 1. 导出
+# ============================================
+def export_torchscript(model, path, input_mode='rgb'):
+    """trace + freeze，保存为 TorchScript"""
+    with torch.no_grad():
+        traced = torch.jit.trace(model.eval(), example_input(input_mode))
+        frozen = torch.jit.freeze(traced)
+    torch.jit.save(frozen, path)
+    return path
+
+
+def export_onnx(model, path, input_mode='rgb', opset=17):
+    """导出为 ONNX，batch 维度可变"""
+    torch.onnx.export(
+        model.eval(), example_input(input_mode), path,
+        input_names=['input'], output_names=['logits'],
+        dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=opset,
+    )
+    return path
+
+
+# ============================================
+# 2. ONNX Runtime 后端（与 nn.Module 相同的调用方式）
+# ============================================
+class OnnxModel:
+    """包装 onnxruntime.InferenceSession：输入输出均为 torch.Tensor，可直接交给 predict 使用"""
+
+    def __init__(self, path, threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, inputs):
+        outputs = self.session.run(None, {self.input_name: inputs.detach().cpu().float().numpy()})
+        return torch.from_numpy(outputs[0])
+
+    def eval(self):
+        return self
+
+
+# ============================================
+# 3. 一致性检查与延迟对比
+# ============================================
+def check_backends(model_path=MODEL_PATH, input_mode='rgb', batch_sizes=(1, 16), iters=30):
+    """用同一批验证集图片比较各后端的 logits，并测量各 batch size 下的延迟"""
+    from torch.utils.data import DataLoader
+    from torchvision import datasets
+    from model_utils import split_dir, preprocess_image
+
+    dataset = datasets.ImageFolder(split_dir('validation'),
+                                   lambda image: preprocess_image(image, input_mode)[0])
+    inputs, _ = next(iter(DataLoader(dataset, batch_size=64, shuffle=True)))
+
+    models = {backend: load_model(model_path, input_mode, backend) for backend in BACKENDS}
+    with torch.inference_mode():
+        reference = models['eager'](inputs)
+        print(f"{'后端':<14s}{'最大 logits 误差':>18s}{'预测一致':>12s}")
+        max_diff = 0.0
+        for backend, model in models.items():
+            outputs = model(inputs)
+            diff = (outputs - reference).abs().max().item()
+            agree = (outputs.argmax(1) == reference.argmax(1)).sum().item()
+            max_diff = max(max_diff, diff)
+            print(f"{backend:<14s}{diff:>18.2e}{agree:>9d}/{len(inputs)}")
+
+        print(f"\n{'后端':<14s}" + ''.join(f"{f'batch={b} (ms)':>16s}" for b in batch_sizes))
+        for backend, model in models.items():
+            row = f"{backend:<14s}"
+            for batch_size in batch_sizes:
+                batch = example_input(input_mode, batch_size)
+                for _ in range(5):
+                    model(batch)
+                start = time.perf_counter()
+                for _ in range(iters):
+                    model(batch)
+                row += f"{(time.perf_counter() - start) / iters * 1000:>16.2f}"
+            print(row)
+    return max_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导出 TorchScript / ONNX 推理模型')
+    parser.add_argument('--model', default=MODEL_PATH, help='权重文件路径（.pth）')
+    parser.add_argument('--gray', action='store_true', help='导出单通道快速路径版本')
+    parser.add_argument('--formats', default='torchscript,onnx', help='导出格式（逗号分隔）')
+    parser.add_argument('--check', action='store_true', help='导出后检查各后端输出一致性并对比延迟')
+    parser.add_argument('--atol', type=float, default=1e-3, help='一致性检查允许的 logits 最大误差')
+    args = parser.parse_args()
+
+    input_mode = 'gray' if args.gray else 'rgb'
+    model = load_model(args.model, input_mode, backend='eager')
+    paths = export_paths(args.model, input_mode)
+    formats = args.formats.split(',')
+    if 'torchscript' in formats:
+        print(f"💾 TorchScript: {export_torchscript(model, paths['torchscript'], input_mode)}")
+    if 'onnx' in formats:
+        print(f"💾 ONNX: {export_onnx(model, paths['onnx'], input_mode)}")
+
+    if args.check:
+        print(f"\n各后端一致性检查（类别: {len(class_names)}）")
+        print("=" * 48)
+        if check_backends(args.model, input_mode) > args.atol:
+            print("❌ 后端输出不一致")
+            raise SystemExit(1)
+        print("✅ 各后端输出一致")
+
+
+if __name__ == '__main__':
+    main()
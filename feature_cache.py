@@ -0,0 +1,268 @@
+"""
+特征缓存训练模式：冻结的 ResNet18 主干只运行一次，全连接层在缓存特征上训练
+
+train.py 冻结了除 fc 以外的所有参数，但每个 epoch 仍要对每张图片完整地跑一遍卷积主干，
+并且在 train 模式下运行 BatchNorm，导致冻结层的 running stats 不断变化。
+本脚本：
+1. 以 eval 模式运行冻结主干，把 avgpool 输出的 512 维特征保存到磁盘；
+2. 训练集额外保存 K 个预先计算的增强视图（每个 epoch 随机选取其中一个视图）；
+3. 仅在缓存张量上训练 Linear(512,256) -> ReLU -> Linear(256,6)，几秒即可完成训练。
+
+用法：
+    python feature_cache.py                 # 提取/复用特征缓存并训练全连接层
+    python feature_cache.py --views 8       # 训练集缓存 8 个增强视图
+    python feature_cache.py --compare       # 额外测量原训练循环的耗时并报告加速比
+"""
+
+import argparse
+import os
+import time
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader
+from torchvision import datasets
+from tqdm import tqdm
+
+from model_utils import data_transforms, split_dir, build_model, build_head, freeze_backbone
+
+CACHE_VERSION = 1
+
+
+# ============================================
+# 1. 特征提取
+# ============================================
+def build_backbone(device):
+    """加载 ImageNet 预训练主干（去掉全连接层），固定为 eval 模式"""
+    model = build_model(pretrained=True)
+    model.fc = nn.Identity()
+    model.eval()
+    return model.to(device)
+
+
+@torch.inference_mode()
+def extract_features(backbone, dataset, device, batch_size=64, num_workers=0):
+    """对数据集做一次完整前向，返回 (特征[N,512], 标签[N])"""
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    features, labels = [], []
+    for inputs, targets in tqdm(loader, desc='Extract', leave=False):
+        features.append(backbone(inputs.to(device)).float().cpu())
+        labels.append(targets)
+    return torch.cat(features), torch.cat(labels)
+
+
+def cache_path(cache_dir, split):
+    return os.path.join(cache_dir, f'features_{split}.pt')
+
+
+def load_or_build_cache(cache_dir, views, device, batch_size=64, num_workers=0, seed=42):
+    """
+    读取或生成特征缓存
+    训练集：features 形状为 [K, N, 512]，每个视图都是一次独立的随机增强
+    验证集：features 形状为 [1, N, 512]，使用验证集的确定性预处理
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    caches = {}
+    backbone = None
+    for split, num_views in (('train', views), ('validation', 1)):
+        path = cache_path(cache_dir, split)
+        if os.path.exists(path):
+            cache = torch.load(path, map_location='cpu')
+            if cache.get('version') == CACHE_VERSION and cache['features'].shape[0] >= num_views:
+                cache['features'] = cache['features'][:num_views]
+                caches[split] = cache
+                print(f"✅ 复用特征缓存: {path} ({num_views} 个视图)")
+                continue
+
+        if backbone is None:
+            backbone = build_backbone(device)
+        dataset = datasets.ImageFolder(split_dir(split), data_transforms[split])
+        torch.manual_seed(seed)
+        start = time.perf_counter()
+        view_features = []
+        labels = None
+        for view in range(num_views):
+            print(f"提取 {split} 特征：视图 {view + 1}/{num_views}")
+            feats, labels = extract_features(backbone, dataset, device, batch_size, num_workers)
+            view_features.append(feats)
+        cache = {
+            'version': CACHE_VERSION,
+            'features': torch.stack(view_features),
+            'labels': labels,
+            'classes': dataset.classes,
+            'extract_time': time.perf_counter() - start,
+        }
+        torch.save(cache, path)
+        print(f"💾 特征缓存已保存: {path}，耗时 {cache['extract_time']:.1f}s")
+        caches[split] = cache
+    return caches
+
+
+# ============================================
+# 2. 在缓存特征上训练全连接层
+# ============================================
+def build_optimizer(name, params, lr, momentum=0.9, weight_decay=0.0):
+    """按名称构建优化器：sgd（train.py 的默认配置）、adam、adamw"""
+    if name == 'sgd':
+        return optim.SGD(params, lr=lr, momentum=momentum, weight_decay=weight_decay)
+    if name == 'adam':
+        return optim.Adam(params, lr=lr, weight_decay=weight_decay)
+    if name == 'adamw':
+        return optim.AdamW(params, lr=lr, weight_decay=weight_decay)
+    raise ValueError(f"未知的优化器 '{name}'")
+
+
+def train_head(caches, num_epochs=15, batch_size=16, lr=0.001, momentum=0.9,
+               hidden_size=256, seed=42, verbose=True, optimizer_name='sgd', weight_decay=0.0, should_stop=None):
+    """
+    训练全连接层，默认超参数与 train.py 保持一致
+    每个 epoch 为每张训练图片随机选择一个缓存视图，相当于一次新的随机增强
+    should_stop(epoch, val_acc) 返回 True 时提前结束训练
+    返回 (最佳全连接层 state_dict, 最佳验证集准确率, 训练历史)
+    """
+    torch.manual_seed(seed)
+    train_feats = caches['train']['features']
+    train_labels = caches['train']['labels']
+    val_feats = caches['validation']['features'][0]
+    val_labels = caches['validation']['labels']
+    num_views, num_train, num_ftrs = train_feats.shape
+    num_classes = len(caches['train']['classes'])
+
+    head = build_head(num_ftrs, hidden_size, num_classes)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = build_optimizer(optimizer_name, head.parameters(), lr, momentum, weight_decay)
+
+    history = {'train_loss': [], 'train_acc': [], 'val_loss': [], 'val_acc': []}
+    best_acc = 0.0
+    best_state = None
+    for epoch in range(num_epochs):
+        # 训练阶段：随机视图 + 随机顺序
+        head.train()
+        view_idx = torch.randint(num_views, (num_train,))
+        inputs_all = train_feats[view_idx, torch.arange(num_train)]
+        order = torch.randperm(num_train)
+        running_loss = 0.0
+        running_corrects = 0
+        for start in range(0, num_train, batch_size):
+            idx = order[start:start + batch_size]
+            inputs, labels = inputs_all[idx], train_labels[idx]
+            optimizer.zero_grad()
+            outputs = head(inputs)
+            loss = criterion(outputs, labels)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item() * inputs.size(0)
+            running_corrects += (outputs.argmax(1) == labels).sum().item()
+        history['train_loss'].append(running_loss / num_train)
+        history['train_acc'].append(running_corrects / num_train)
+
+        # 验证阶段：整批前向即可
+        head.eval()
+        with torch.no_grad():
+            outputs = head(val_feats)
+            val_loss = criterion(outputs, val_labels).item()
+            val_acc = (outputs.argmax(1) == val_labels).float().mean().item()
+        history['val_loss'].append(val_loss)
+        history['val_acc'].append(val_acc)
+
+        if verbose:
+            print(f"Epoch {epoch + 1}/{num_epochs}  "
+                  f"Train Loss: {history['train_loss'][-1]:.4f} Acc: {history['train_acc'][-1]:.4f}  "
+                  f"Val Loss: {val_loss:.4f} Acc: {val_acc:.4f}")
+
+        if val_acc > best_acc:
+            best_acc = val_acc
+            best_state = {k: v.clone() for k, v in head.state_dict().items()}
+        if should_stop is not None and should_stop(epoch, val_acc):
+            break
+
+    return best_state, best_acc, history
+
+
+def save_full_model(head_state, output_path, hidden_size=256, num_classes=6):
+    """把训练好的全连接层装回 ResNet18，保存为与 app.py 兼容的完整 state_dict"""
+    model = build_model(pretrained=True, hidden_size=hidden_size, num_classes=num_classes)
+    model.fc.load_state_dict(head_state)
+    torch.save(model.state_dict(), output_path)
+
+
+# ============================================
+# 3. 与原训练循环的耗时对比
+# ============================================
+def time_full_epoch(device, batch_size=16, max_batches=None):
+    """
+    按 train.py 的方式运行一个训练 epoch（完整主干前向 + fc 反向），返回耗时（秒）
+    max_batches 用于只测量部分批次后按比例外推
+    """
+    model = freeze_backbone(build_model(pretrained=True)).to(device)
+    model.train()
+    dataset = datasets.ImageFolder(split_dir('train'), data_transforms['train'])
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=0)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.SGD(filter(lambda p: p.requires_grad, model.parameters()), lr=0.001, momentum=0.9)
+
+    total_batches = len(loader)
+    measured = 0
+    start = time.perf_counter()
+    for inputs, labels in tqdm(loader, desc='Baseline', leave=False):
+        optimizer.zero_grad()
+        loss = criterion(model(inputs.to(device)), labels.to(device))
+        loss.backward()
+        optimizer.step()
+        measured += 1
+        if max_batches is not None and measured >= max_batches:
+            break
+    elapsed = time.perf_counter() - start
+    return elapsed * total_batches / measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description='特征缓存训练模式：仅在缓存的主干特征上训练全连接层')
+    parser.add_argument('--cache-dir', default='./cache', help='特征缓存目录')
+    parser.add_argument('--views', type=int, default=5, help='训练集预计算的增强视图数 K')
+    parser.add_argument('--epochs', type=int, default=15, help='训练轮数')
+    parser.add_argument('--batch-size', type=int, default=16, help='全连接层训练的 Batch Size')
+    parser.add_argument('--lr', type=float, default=0.001, help='学习率')
+    parser.add_argument('--output', default='best_model.pth', help='保存的完整模型路径')
+    parser.add_argument('--workers', type=int, default=0, help='特征提取时 DataLoader 的进程数')
+    parser.add_argument('--compare', action='store_true', help='测量原训练循环的耗时并报告加速比')
+    parser.add_argument('--compare-batches', type=int, default=20,
+                        help='对比时原训练循环实际测量的批次数（其余按比例外推）')
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    print(f"设备: {device}")
+
+    extract_start = time.perf_counter()
+    caches = load_or_build_cache(args.cache_dir, args.views, device, num_workers=args.workers)
+    extract_time = time.perf_counter() - extract_start
+
+    print("\n" + "=" * 50)
+    print("在缓存特征上训练全连接层...")
+    print("=" * 50)
+    train_start = time.perf_counter()
+    head_state, best_acc, _ = train_head(caches, num_epochs=args.epochs,
+                                         batch_size=args.batch_size, lr=args.lr)
+    train_time = time.perf_counter() - train_start
+
+    save_full_model(head_state, args.output, num_classes=len(caches['train']['classes']))
+    print(f"\n>>> 最佳验证集准确率: {best_acc:.4f}，模型已保存为 '{args.output}'")
+    print(f"特征提取/加载耗时: {extract_time:.2f}s，全连接层训练耗时: {train_time:.2f}s")
+
+    if args.compare:
+        print("\n测量原训练循环（train.py）的耗时...")
+        epoch_time = time_full_epoch(device, max_batches=args.compare_batches)
+        baseline_time = epoch_time * args.epochs
+        # 首次提取特征的成本计入缓存方案；缓存复用时只剩全连接层训练
+        first_run = sum(c.get('extract_time', 0.0) for c in caches.values()) + train_time
+        print("\n" + "=" * 50)
+        print("耗时对比（仅训练阶段，不含验证）")
+        print("=" * 50)
+        print(f"原训练循环: 每 epoch {epoch_time:.1f}s，{args.epochs} 个 epoch 约 {baseline_time:.1f}s")
+        print(f"特征缓存（首次，含提取）: {first_run:.1f}s，加速 {baseline_time / first_run:.1f}x")
+        print(f"特征缓存（复用缓存）: {train_time:.2f}s，加速 {baseline_time / train_time:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+单通道（灰度）推理快速路径
+
+NEU-DET 图像为单通道（标注 XML 中 depth=1），但原推理流程会先 convert('RGB') 把灰度复制成三个相同的通道，
+再对三个相同的平面分别做 ImageNet 标准化。
+由于三个输入通道完全相同，conv1 的三组输入权重和逐通道的 mean/std 可以折叠为一个单通道卷积：
+
+    conv(Σ_c (x - m_c) / s_c * W_c) = conv(x, Σ_c W_c / s_c) - conv(1_valid, Σ_c W_c · m_c / s_c)
+
+第二项只取决于输入尺寸（零填充区域在标准化空间里为 0，所以边界处的偏置会变化），
+按输入尺寸计算一次后缓存。折叠后的模型直接接收 1x224x224、取值 [0,1] 的张量，
+预处理内存减少为原来的 1/3，conv1 的计算量也减少为 1/3。
+
+用法：
+    python grayscale.py                     # 在验证集上检查与 RGB 路径的一致性并对比耗时
+"""
+
+import argparse
+import copy
+import os
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torchvision import transforms
+
+from model_utils import IMAGENET_MEAN, IMAGENET_STD, MODEL_PATH, class_names, split_dir
+
+
+def to_gray(image):
+    """转换为单通道灰度图（对灰度来源的 RGB 图像是无损的）"""
+    return image.convert('L')
+
+
+# 灰度预处理：与验证集预处理相同，但不复制通道、不做标准化（已折叠进 conv1）
+gray_preprocess = transforms.Compose([
+    transforms.Lambda(to_gray),
+    transforms.Resize(256),
+    transforms.CenterCrop(224),
+    transforms.ToTensor(),
+])
+
+
+class GrayscaleStem(nn.Module):
+    """替换 ResNet 的 conv1：单通道输入，内含 ImageNet 标准化"""
+
+    def __init__(self, conv, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        super().__init__()
+        weight = conv.weight.detach()
+        mean = torch.tensor(mean, dtype=weight.dtype).view(1, -1, 1, 1)
+        std = torch.tensor(std, dtype=weight.dtype).view(1, -1, 1, 1)
+        self.weight = nn.Parameter((weight / std).sum(dim=1, keepdim=True))
+        self.register_buffer('offset_kernel', (weight * mean / std).sum(dim=1, keepdim=True))
+        self.register_parameter('bias', None)  # 折叠 BatchNorm 后才会有偏置（见 optimize.py）
+        self.stride = conv.stride
+        self.padding = conv.padding
+        self._offsets = {}
+
+    def offset(self, height, width, device, dtype):
+        """返回标准化偏置项 [1,C,H',W']，按输入尺寸缓存"""
+        key = (height, width, device, dtype)
+        offset = self._offsets.get(key)
+        if offset is None:
+            with torch.no_grad():
+                ones = torch.ones(1, 1, height, width, device=device, dtype=dtype)
+                offset = F.conv2d(ones, self.offset_kernel.to(dtype), None, self.stride, self.padding)
+            self._offsets[key] = offset
+        return offset
+
+    def _apply(self, fn, *args, **kwargs):
+        # 设备或精度变化时清空缓存
+        self._offsets = {}
+        return super()._apply(fn, *args, **kwargs)
+
+    def forward(self, x):
+        out = F.conv2d(x, self.weight, self.bias, self.stride, self.padding)
+        return out - self.offset(x.shape[-2], x.shape[-1], x.device, x.dtype)
+
+
+def fold_grayscale(model):
+    """返回 conv1 折叠为单通道的模型副本（原模型不变）"""
+    model = copy.deepcopy(model)
+    model.conv1 = GrayscaleStem(model.conv1)
+    return model.eval()
+
+
+# ============================================
+# 一致性检查：灰度路径 vs RGB 路径
+# ============================================
+def check_parity(model_path=MODEL_PATH, split='validation', limit=None):
+    """在数据集上比较两条推理路径的输出，返回 (最大 logits 误差, 预测一致率)"""
+    from PIL import Image
+    from model_utils import load_model, preprocess_image
+
+    rgb_model = load_model(model_path)
+    gray_model = load_model(model_path, input_mode='gray')
+
+    paths = []
+    for class_name in class_names:
+        class_dir = os.path.join(split_dir(split), class_name)
+        paths += [os.path.join(class_dir, f) for f in sorted(os.listdir(class_dir))]
+    if limit:
+        paths = paths[:limit]
+
+    max_diff = 0.0
+    agree = 0
+    rgb_time = gray_time = 0.0
+    with torch.no_grad():
+        for path in paths:
+            image = Image.open(path)
+            start = time.perf_counter()
+            rgb_out = rgb_model(preprocess_image(image, 'rgb'))
+            rgb_time += time.perf_counter() - start
+            start = time.perf_counter()
+            gray_out = gray_model(preprocess_image(image, 'gray'))
+            gray_time += time.perf_counter() - start
+            max_diff = max(max_diff, (rgb_out - gray_out).abs().max().item())
+            agree += int(rgb_out.argmax() == gray_out.argmax())
+
+    print(f"图片数量: {len(paths)}")
+    print(f"logits 最大绝对误差: {max_diff:.2e}")
+    print(f"预测一致率: {agree}/{len(paths)}")
+    print(f"RGB 路径平均耗时:  {rgb_time / len(paths) * 1000:.2f} ms/张")
+    print(f"灰度路径平均耗时:  {gray_time / len(paths) * 1000:.2f} ms/张")
+    return max_diff, agree / len(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='单通道推理快速路径：与 RGB 路径的一致性检查')
+    parser.add_argument('--model', default=MODEL_PATH, help='模型文件路径')
+    parser.add_argument('--split', default='validation', choices=['train', 'validation'], help='数据划分')
+    parser.add_argument('--limit', type=int, default=None, help='最多检查的图片数量')
+    parser.add_argument('--atol', type=float, default=1e-3, help='允许的 logits 最大绝对误差')
+    args = parser.parse_args()
+
+    max_diff, agreement = check_parity(args.model, args.split, args.limit)
+    if max_diff > args.atol or agreement < 1.0:
+        print("❌ 灰度路径与 RGB 路径不一致")
+        raise SystemExit(1)
+    print("✅ 灰度路径与 RGB 路径数值等价")
+
+
+if __name__ == '__main__':
+    main()
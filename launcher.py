@@ -10,6 +10,9 @@ import subprocess
 import webbrowser
 import time
 import socket
+import tempfile
+
+from startup import clear_ready, wait_ready
 
 def get_resource_path(relative_path):
     """获取资源文件的绝对路径"""
@@ -25,7 +28,7 @@ def is_port_in_use(port):
         return s.connect_ex(('localhost', port)) == 0
 
 def wait_for_server(port, timeout=30):
-    """等待服务器启动"""
+    """等待服务器端口打开（此时页面可以访问，但模型尚未加载）"""
     start_time = time.time()
     while time.time() - start_time < timeout:
         if is_port_in_use(port):
@@ -62,6 +65,9 @@ def main():
     
     # 设置环境变量
     os.environ['STREAMLIT_SERVER_HEADLESS'] = 'true'
+    # 就绪标记：app.py 在模型加载并预热完成后写入（每次启动使用新的文件，避免读到上次残留的标记）
+    ready_file = os.path.join(tempfile.gettempdir(), f'defect_app_{os.getpid()}.ready')
+    os.environ['DEFECT_READY_FILE'] = ready_file
     os.environ['STREAMLIT_SERVER_PORT'] = '8501'
     os.environ['STREAMLIT_BROWSER_GATHER_USAGE_STATS'] = 'false'
     
@@ -92,8 +98,18 @@ def main():
             print("=" * 50)
             print()
             
-            # 只打开一次浏览器
+            # 只打开一次浏览器（第一个会话触发模型加载和预热）
             webbrowser.open("http://localhost:8501")
+
+            print("⏳ 模型加载预热中...")
+            info = wait_ready(ready_file, timeout=120, process=process)
+            clear_ready(ready_file)
+            if info:
+                phases = '，'.join(f"{name} {seconds:.2f}s" for name, seconds in info['startup'].items())
+                print(f"✅ 模型已就绪，可以开始检测（{phases}）")
+            else:
+                print("⚠️ 等待模型就绪超时，请查看下方日志")
+            print()
         else:
             print("⚠️ 服务启动超时，请手动访问 http://localhost:8501")
         
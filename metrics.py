@@ -0,0 +1,181 @@
+"""
+推理路径的分阶段计时与指标导出
+
+产线检测延迟突增时，需要知道是解码、缩放/裁剪、前向还是 softmax 变慢。
+本模块提供可开关的轻量计时钩子：
+- metrics.stage(name)：包裹 preprocess_image / predict 的各个阶段；
+- attach_layer_hooks(model)：可选的逐层前向钩子（conv1、layer1~4、avgpool、fc）；
+- 所有耗时写入直方图，可导出为 Prometheus 文本格式或写入文件。
+
+关闭时 stage() 直接返回一个共享的空上下文管理器，只多一次属性判断，开销可忽略。
+设置环境变量 DEFECT_METRICS=1 或调用 metrics.enable() 开启。
+"""
+
+import bisect
+import contextlib
+import os
+import threading
+import time
+
+# 默认直方图分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+class Histogram:
+    """累积分桶直方图（与 Prometheus histogram 语义一致）"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class _StageTimer:
+    __slots__ = ('registry', 'metric', 'label', 'start')
+
+    def __init__(self, registry, metric, label):
+        self.registry = registry
+        self.metric = metric
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.metric, self.label, time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """按 (指标名, 标签值) 保存直方图；enabled=False 时所有计时钩子都是空操作"""
+
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def observe(self, metric, label, seconds):
+        with self._lock:
+            hist = self._histograms.get((metric, label))
+            if hist is None:
+                hist = self._histograms[(metric, label)] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    def stage(self, name):
+        """计时上下文管理器：with metrics.stage('forward'): ..."""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _StageTimer(self, 'defect_stage_seconds', name)
+
+    def run_transforms(self, compose, x):
+        """执行 transforms.Compose；开启时逐个变换单独计时（resize、crop、to_tensor 等）"""
+        if not self.enabled:
+            return compose(x)
+        for t in compose.transforms:
+            with self.stage(TRANSFORM_STAGES.get(type(t).__name__, type(t).__name__.lower())):
+                x = t(x)
+        return x
+
+    # ============================================
+    # 导出
+    # ============================================
+    def to_prometheus(self):
+        """导出为 Prometheus 文本格式"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+        lines = []
+        seen = set()
+        for (metric, label), hist in items:
+            label_name = 'layer' if metric == 'defect_layer_seconds' else 'stage'
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f'# HELP {metric} {METRIC_HELP.get(metric, metric)}')
+                lines.append(f'# TYPE {metric} histogram')
+            for bound, total in hist.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{metric}_bucket{{{label_name}="{label}",le="{le}"}} {total}')
+            lines.append(f'{metric}_sum{{{label_name}="{label}"}} {hist.sum:.9f}')
+            lines.append(f'{metric}_count{{{label_name}="{label}"}} {hist.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """各阶段的调用次数与平均耗时（毫秒），便于在终端打印"""
+        with self._lock:
+            return {f'{metric}/{label}': {'count': h.count, 'mean_ms': h.sum / h.count * 1000}
+                    for (metric, label), h in sorted(self._histograms.items()) if h.count}
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+
+
+TRANSFORM_STAGES = {
+    'Lambda': 'decode',
+    'Resize': 'resize',
+    'CenterCrop': 'crop',
+    'ToTensor': 'to_tensor',
+    'Normalize': 'normalize',
+}
+
+METRIC_HELP = {
+    'defect_stage_seconds': 'Inference pipeline stage latency in seconds',
+    'defect_layer_seconds': 'Per-layer forward latency in seconds',
+}
+
+# 全局实例
+metrics = MetricsRegistry(enabled=os.environ.get('DEFECT_METRICS') == '1')
+
+
+# ============================================
+# 逐层前向钩子
+# ============================================
+def attach_layer_hooks(model, registry=metrics,
+                       layers=('conv1', 'layer1', 'layer2', 'layer3', 'layer4', 'avgpool', 'fc')):
+    """在指定子模块上注册前向钩子，返回句柄列表（调用 handle.remove() 卸载）"""
+    local = threading.local()
+    handles = []
+    for name in layers:
+        module = getattr(model, name, None)
+        if module is None:
+            continue
+
+        def pre_hook(mod, inputs, name=name):
+            if registry.enabled:
+                if not hasattr(local, 'starts'):
+                    local.starts = {}
+                local.starts[name] = time.perf_counter()
+
+        def post_hook(mod, inputs, output, name=name):
+            start = getattr(local, 'starts', {}).pop(name, None)
+            if start is not None:
+                registry.observe('defect_layer_seconds', name, time.perf_counter() - start)
+
+        handles.append(module.register_forward_pre_hook(pre_hook))
+        handles.append(module.register_forward_hook(post_hook))
+    return handles
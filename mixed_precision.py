@@ -0,0 +1,104 @@
+"""
+bfloat16 混合精度推理：与 fp32 的精度偏差检查和吞吐对比
+
+支持 AVX512-BF16 / AMX 的 Xeon CPU 上，卷积和全连接可以直接以 bfloat16 计算。
+model_utils.load_model(precision='bf16')（app.py 通过环境变量 DEFECT_PRECISION=bf16，batch_predict.py / serve.py 的
+--precision bf16）用 CPU autocast 包装模型，softmax 等后处理仍为 float32；train.py --bf16 在训练前向中使用同样的 autocast。
+
+本脚本在验证集上同时运行 fp32 与 bf16 模型：
+- 精度偏差：两者的准确率、预测一致率、softmax 概率的最大 / 平均绝对差，超过 --max-drift 时以非零状态退出；
+- 吞吐对比：不同 Batch Size 下的前向吞吐（images/sec）和加速比。
+
+用法：
+    python mixed_precision.py
+    python mixed_precision.py --batch-sizes 1,16,64 --threads 8 --max-drift 0.005
+"""
+
+import argparse
+import sys
+
+import torch
+
+from evaluate import Normalizer, batches, decode_split
+from model_utils import MODEL_PATH, load_model, measure_latency, with_precision
+
+
+def bf16_supported():
+    """CPU 是否有原生 bfloat16 指令（无原生支持时 autocast 仍可运行，但通常比 fp32 更慢）"""
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+@torch.inference_mode()
+def compare(reference, candidate, images, labels, input_mode='rgb', batch_size=64):
+    """在同一批输入上运行两个模型，返回精度偏差统计"""
+    normalize = Normalizer(input_mode)
+    ref_correct = cand_correct = agree = 0
+    max_diff, diff_sum = 0.0, 0.0
+    for inputs, targets in batches(images, labels, batch_size):
+        inputs = normalize(inputs)
+        ref_probs = torch.softmax(reference(inputs).float(), dim=1)
+        cand_probs = torch.softmax(candidate(inputs).float(), dim=1)
+        ref_preds, cand_preds = ref_probs.argmax(1), cand_probs.argmax(1)
+        ref_correct += (ref_preds == targets).sum().item()
+        cand_correct += (cand_preds == targets).sum().item()
+        agree += (ref_preds == cand_preds).sum().item()
+        diff = (ref_probs - cand_probs).abs()
+        max_diff = max(max_diff, diff.max().item())
+        diff_sum += diff.max(dim=1).values.sum().item()
+    n = len(labels)
+    return {
+        'fp32_acc': ref_correct / n,
+        'bf16_acc': cand_correct / n,
+        'drift': ref_correct / n - cand_correct / n,
+        'agreement': agree / n,
+        'max_prob_diff': max_diff,
+        'mean_prob_diff': diff_sum / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bfloat16 混合精度推理：精度偏差与吞吐对比')
+    parser.add_argument('--model', default=MODEL_PATH, help='模型文件路径')
+    parser.add_argument('--backend', default='eager', choices=['eager', 'torchscript'], help='推理后端')
+    parser.add_argument('--batch-sizes', default='1,16,64', help='吞吐对比的 Batch Size（逗号分隔）')
+    parser.add_argument('--iters', type=int, default=30, help='吞吐对比每个配置的迭代次数')
+    parser.add_argument('--threads', type=int, default=None, help='推理使用的 CPU 线程数')
+    parser.add_argument('--max-drift', type=float, default=0.01, help='允许的 bf16 相对 fp32 准确率下降')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if not bf16_supported():
+        print("⚠️ 当前 CPU 没有原生 bfloat16 支持，bf16 会回退到模拟计算，吞吐可能低于 fp32")
+
+    fp32 = load_model(args.model, backend=args.backend, precision='fp32')
+    bf16 = with_precision(fp32, 'bf16')
+
+    images, labels = decode_split('validation')
+    drift = compare(fp32, bf16, images, labels)
+    print(f"验证集 {len(labels)} 张图片")
+    print("=" * 56)
+    print(f"fp32 准确率: {drift['fp32_acc']:.4f}    bf16 准确率: {drift['bf16_acc']:.4f}    "
+          f"下降: {drift['drift']:+.4f}")
+    print(f"预测一致率: {drift['agreement']:.2%}    概率最大差: {drift['max_prob_diff']:.4f}    "
+          f"平均差: {drift['mean_prob_diff']:.5f}")
+
+    print("\n" + "=" * 56)
+    print(f"{'Batch Size':>10s}{'fp32 (img/s)':>15s}{'bf16 (img/s)':>15s}{'加速比':>10s}")
+    print("=" * 56)
+    for bs in [int(b) for b in args.batch_sizes.split(',')]:
+        fp32_ms = measure_latency(fp32, bs, args.iters, warmup=5)
+        bf16_ms = measure_latency(bf16, bs, args.iters, warmup=5)
+        print(f"{bs:>10d}{bs / fp32_ms * 1000:>15.1f}{bs / bf16_ms * 1000:>15.1f}{fp32_ms / bf16_ms:>10.2f}x")
+
+    if drift['drift'] > args.max_drift:
+        print(f"\n❌ bf16 准确率下降 {drift['drift']:.4f} 超过容差 {args.max_drift}")
+        sys.exit(1)
+    print(f"\n✅ bf16 准确率下降在容差 {args.max_drift} 以内")
+
+
+if __name__ == '__main__':
+    main()
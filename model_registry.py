@@ -0,0 +1,334 @@
+"""
+模型注册表：带元数据的版本化检查点与不停机热切换
+
+app.py 原先只用 @st.cache_resource 缓存一个固定路径的模型，部署新训练的检查点需要重启应用并重新冷启动。
+注册表目录（默认 ./models，环境变量 DEFECT_REGISTRY_DIR）保存各版本的检查点和 registry.json 清单：
+- 每个版本记录路径、内容哈希、验证集准确率、类别列表、输入模式、注册时间和备注，清单中的 active 为当前版本；
+- ModelRegistry 在后台线程中加载并预热新版本，旧版本继续提供服务，全部就绪后一次性切换引用；
+- 已加载的模型按最近最少使用淘汰，总内存不超过上限（当前版本和正在加载的版本不会被淘汰）；
+- 运行中的应用每隔几秒检查清单，命令行 activate 后无需重启即可切换；
+- 每次预测记录提供服务的版本（predictions.jsonl）。
+
+注册表为空时退回到 DEFECT_MODEL_PATH / best_model.pth 作为唯一版本 'default'。
+
+用法：
+    python model_registry.py register best_model.pth --evaluate --activate
+    python model_registry.py register runs/best_model_sweep.pth --accuracy 0.9861 --notes "sweep 最优配置"
+    python model_registry.py list
+    python model_registry.py activate v2
+"""
+
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from prediction_cache import model_version
+from startup import StartupTimer, warmup
+
+REGISTRY_DIR = os.environ.get('DEFECT_REGISTRY_DIR', './models')
+MEMORY_LIMIT_MB = float(os.environ.get('DEFECT_REGISTRY_MEMORY_MB', 512))
+MANIFEST = 'registry.json'
+PREDICTION_LOG = 'predictions.jsonl'
+DEFAULT_VERSION = 'default'
+
+
+# ============================================
+# 1. 清单读写
+# ============================================
+def read_manifest(root=REGISTRY_DIR):
+    path = os.path.join(root, MANIFEST)
+    if not os.path.exists(path):
+        return {'active': None, 'versions': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, root=REGISTRY_DIR):
+    """先写临时文件再替换，运行中的应用不会读到写了一半的清单"""
+    os.makedirs(root, exist_ok=True)
+    tmp = os.path.join(root, f'{MANIFEST}.{os.getpid()}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, os.path.join(root, MANIFEST))
+
+
+def next_version(manifest):
+    """第一个未被占用的 v<序号>（手动命名的版本可能已经占用了 v<版本数 + 1>）"""
+    n = len(manifest['versions']) + 1
+    while f'v{n}' in manifest['versions']:
+        n += 1
+    return f'v{n}'
+
+
+def register(checkpoint, root=REGISTRY_DIR, version=None, accuracy=None, input_mode='rgb', notes='',
+             activate=False):
+    """把检查点复制进注册表并写入元数据，返回该版本的元数据"""
+    from model_utils import class_names, infer_backend
+
+    manifest = read_manifest(root)
+    version = version or next_version(manifest)
+    if version in manifest['versions']:
+        raise ValueError(f"版本 '{version}' 已存在")
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, version + os.path.splitext(checkpoint)[1])
+    shutil.copy2(checkpoint, path)
+    meta = {
+        'version': version,
+        'path': path,
+        'digest': model_version(path),
+        'source': os.path.abspath(checkpoint),
+        'backend': infer_backend(path),
+        'accuracy': accuracy,
+        'classes': list(class_names),
+        'input_mode': input_mode,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'notes': notes,
+    }
+    manifest['versions'][version] = meta
+    if activate or manifest['active'] is None:
+        manifest['active'] = version
+    write_manifest(manifest, root)
+    return meta
+
+
+def set_active(version, root=REGISTRY_DIR):
+    manifest = read_manifest(root)
+    if version not in manifest['versions']:
+        raise KeyError(f"未注册的版本 '{version}'")
+    manifest['active'] = version
+    write_manifest(manifest, root)
+
+
+def model_size_mb(model):
+    """参数和缓冲区占用的内存（MB）；onnx 后端的模型不在 torch 中，记为 0"""
+    if not hasattr(model, 'state_dict'):
+        return 0.0
+    return sum(t.numel() * t.element_size() for t in model.state_dict().values()) / 2 ** 20
+
+
+# ============================================
+# 2. 运行时注册表（加载、热切换、LRU 淘汰）
+# ============================================
+class LoadedModel:
+    """一个已加载并预热的模型版本；预测时持有该对象，切换版本不影响进行中的请求"""
+
+    def __init__(self, version, input_mode, model, meta, startup):
+        from model_utils import resolve_model_path
+
+        self.version = version
+        self.input_mode = input_mode
+        self.model = model
+        self.meta = meta
+        # 实际加载的文件（.pth 配合 torchscript/onnx 后端时是导出文件），预测缓存按它的内容哈希区分版本
+        self.path = resolve_model_path(meta['path'], input_mode, meta['backend'])
+        self.startup = startup
+        self.size_mb = model_size_mb(model)
+
+
+class ModelRegistry:
+    """
+    进程内共享：current(input_mode) 返回当前版本的 LoadedModel；
+    activate(version) 在后台加载并预热后原子切换，已加载的模型按 LRU 淘汰，总大小不超过 max_memory_mb
+    """
+
+    def __init__(self, root=REGISTRY_DIR, max_memory_mb=MEMORY_LIMIT_MB):
+        self.root = root
+        self.max_memory_mb = max_memory_mb
+        self._entries = OrderedDict()  # (版本, input_mode) -> LoadedModel，按最近使用排序
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._modes = set()
+        self._active = None
+        self.pending = None
+        self.error = None
+        self.evictions = 0
+
+    # ---------- 版本元数据 ----------
+    def versions(self):
+        """{版本: 元数据}；注册表为空时只有指向 DEFECT_MODEL_PATH 的 'default'"""
+        manifest = read_manifest(self.root)
+        if manifest['versions']:
+            return manifest['versions']
+        from model_utils import MODEL_BACKEND, MODEL_PATH, class_names
+        return {DEFAULT_VERSION: {'version': DEFAULT_VERSION, 'path': MODEL_PATH, 'backend': MODEL_BACKEND,
+                                  'accuracy': None, 'classes': list(class_names), 'input_mode': 'rgb',
+                                  'created': None, 'notes': ''}}
+
+    def manifest_active(self):
+        return read_manifest(self.root)['active'] or DEFAULT_VERSION
+
+    # ---------- 加载 ----------
+    def _load(self, version, input_mode, timer=None):
+        timer = timer or StartupTimer()
+        with timer.phase('import'):
+            import model_utils
+        meta = self.versions()[version]
+        if meta['classes'] != model_utils.class_names:
+            raise ValueError(f"版本 '{version}' 的类别列表与当前 class_names 不一致")
+        with timer.phase('load'):
+            model = model_utils.load_model(meta['path'], input_mode=input_mode, backend=meta['backend'],
+                                           precision=model_utils.MODEL_PRECISION)
+        with timer.phase('warmup'):
+            warmup(model, input_mode)
+        return LoadedModel(version, input_mode, model, meta, timer.summary())
+
+    def _get_or_load(self, version, input_mode, timer=None):
+        key = (version, input_mode)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        entry = self._load(version, input_mode, timer)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+        self._evict()
+        return entry
+
+    def _evict(self):
+        """按最近最少使用淘汰，直到总大小不超过上限；当前版本和正在加载的版本保留"""
+        with self._lock:
+            while sum(e.size_mb for e in self._entries.values()) > self.max_memory_mb:
+                victim = next((key for key in self._entries if key[0] not in (self._active, self.pending)), None)
+                if victim is None:
+                    break
+                # 进行中的请求仍持有 LoadedModel 引用，请求结束后才真正释放
+                del self._entries[victim]
+                self.evictions += 1
+
+    def current(self, input_mode='rgb', timer=None):
+        """返回当前版本的 LoadedModel；首次调用（或首次使用某种 input_mode）时同步加载并预热"""
+        self._modes.add(input_mode)
+        if self._active is None:
+            self._active = self.manifest_active()
+        return self._get_or_load(self._active, input_mode, timer)
+
+    # ---------- 热切换 ----------
+    def activate(self, version, background=True, persist=False):
+        """
+        加载并预热 version 的全部 input_mode 后原子切换；期间旧版本继续服务
+        persist=True 时同时写入清单（其他进程和监视线程都会切换到该版本）
+        """
+        if persist and version != DEFAULT_VERSION:
+            set_active(version, self.root)
+        if version == self._active or version == self.pending:
+            return None
+        self.pending, self.error = version, None
+
+        def run():
+            try:
+                for mode in sorted(self._modes or {'rgb'}):
+                    self._get_or_load(version, mode)
+            except Exception as e:
+                self.error = f"{version}: {e}"
+            else:
+                with self._lock:
+                    self._active = version
+            finally:
+                self.pending = None
+                self._evict()
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name=f'load-{version}', daemon=True)
+        thread.start()
+        return thread
+
+    def poll(self):
+        """清单中的 active 变化时在后台切换"""
+        target = self.manifest_active()
+        if target != self._active and target != self.pending:
+            self.activate(target)
+
+    def start_watching(self, interval=2.0):
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.poll()
+                except (OSError, ValueError) as e:
+                    self.error = str(e)
+
+        thread = threading.Thread(target=watch, name='registry-watcher', daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        with self._lock:
+            loaded = [{'version': v, 'input_mode': m, 'size_mb': round(e.size_mb, 1)}
+                      for (v, m), e in self._entries.items()]
+        return {
+            'active': self._active,
+            'pending': self.pending,
+            'error': self.error,
+            'loaded': loaded,
+            'memory_mb': round(sum(item['size_mb'] for item in loaded), 1),
+            'max_memory_mb': self.max_memory_mb,
+            'evictions': self.evictions,
+        }
+
+    # ---------- 预测记录 ----------
+    def log_prediction(self, entry, image_digest, predicted_class, confidence, cached=False):
+        """追加一条预测记录（提供服务的版本、类别、置信度），写入注册表目录下的 predictions.jsonl"""
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'version': entry.version,
+                  'input_mode': entry.input_mode, 'image': image_digest, 'class': predicted_class,
+                  'confidence': round(confidence, 4), 'cached': cached}
+        with self._log_lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, PREDICTION_LOG), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+# ============================================
+# 3. 命令行
+# ============================================
+def main():
+    parser = argparse.ArgumentParser(description='模型注册表：版本化检查点与热切换')
+    parser.add_argument('--root', default=REGISTRY_DIR, help='注册表目录')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('register', help='注册一个检查点')
+    p.add_argument('checkpoint', help='检查点路径（.pth，或导出 / 量化后的 .pt / .onnx）')
+    p.add_argument('--version', default=None, help='版本名（默认 v<序号>）')
+    p.add_argument('--accuracy', type=float, default=None, help='验证集准确率')
+    p.add_argument('--evaluate', action='store_true', help='在验证集上评估并记录准确率')
+    p.add_argument('--gray', action='store_true', help='该版本默认使用单通道输入')
+    p.add_argument('--notes', default='', help='备注')
+    p.add_argument('--activate', action='store_true', help='注册后设为当前版本')
+
+    sub.add_parser('list', help='列出已注册的版本')
+
+    p = sub.add_parser('activate', help='切换当前版本（运行中的应用会在后台加载后切换）')
+    p.add_argument('version', help='版本名')
+    args = parser.parse_args()
+
+    if args.command == 'register':
+        input_mode = 'gray' if args.gray else 'rgb'
+        accuracy = args.accuracy
+        if args.evaluate:
+            from evaluate import decode_split, evaluate_checkpoint
+            images, labels = decode_split('validation')
+            accuracy = evaluate_checkpoint(args.checkpoint, images, labels, input_mode)[1]['accuracy']
+        meta = register(args.checkpoint, args.root, args.version, accuracy, input_mode, args.notes, args.activate)
+        print(f"✅ 已注册 {meta['version']}: {meta['path']}（{meta['digest']}，"
+              f"准确率 {meta['accuracy'] if meta['accuracy'] is not None else '-'}）")
+    elif args.command == 'list':
+        manifest = read_manifest(args.root)
+        print(f"{'':2s}{'版本':<10s}{'准确率':>10s}{'输入':>6s}  {'注册时间':<20s}{'哈希':<14s}备注")
+        for version, meta in manifest['versions'].items():
+            accuracy = f"{meta['accuracy']:.4f}" if meta['accuracy'] is not None else '-'
+            mark = '*' if version == manifest['active'] else ' '
+            print(f"{mark:2s}{version:<10s}{accuracy:>10s}{meta['input_mode']:>6s}  {meta['created']:<20s}"
+                  f"{meta['digest']:<14s}{meta['notes']}")
+    else:
+        set_active(args.version, args.root)
+        print(f"✅ 当前版本已切换为 {args.version}")
+
+
+if __name__ == '__main__':
+    main()
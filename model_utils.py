@@ -0,0 +1,263 @@
+"""
+模型结构与数据预处理的公共定义
+train.py 及各工具脚本共用，保证模型结构、类别顺序和预处理与训练时完全一致
+"""
+
+import os
+import time
+
+import torch
+import torch.nn as nn
+from torchvision import models, transforms
+
+from metrics import metrics
+
+# ============================================
+# 1. 类别名称（ImageFolder 按目录名排序，与训练时一致）
+# ============================================
+class_names = ['crazing', 'inclusion', 'patches', 'pitted_surface', 'rolled-in_scale', 'scratches']
+class_names_cn = {
+    'crazing': '裂纹',
+    'inclusion': '夹杂',
+    'patches': '斑块',
+    'pitted_surface': '麻点',
+    'rolled-in_scale': '氧化皮',
+    'scratches': '划痕'
+}
+
+# ImageNet 标准化参数
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# 数据集路径
+data_dir = './data'
+
+# 默认模型文件（可通过环境变量 DEFECT_MODEL_PATH 指定其他模型，例如量化模型 best_model_int8.pt）
+MODEL_PATH = os.environ.get('DEFECT_MODEL_PATH', 'best_model.pth')
+# 推理后端（eager / torchscript / onnx），为空时按模型文件扩展名推断
+MODEL_BACKEND = os.environ.get('DEFECT_BACKEND') or None
+# 服务入口（app.py / 注册表、serve.py、batch_predict.py）的默认推理精度（fp32 / bf16），
+# bf16 在支持 AVX512-BF16 / AMX 的 CPU 上以 bfloat16 计算卷积和全连接；load_model 本身默认总是 fp32
+MODEL_PRECISION = os.environ.get('DEFECT_PRECISION', 'fp32')
+
+
+def split_dir(split):
+    """返回数据集划分（train / validation）的图像目录"""
+    return os.path.join(data_dir, split, 'images')
+
+
+# ============================================
+# 2. 数据预处理
+# ============================================
+data_transforms = {
+    'train': transforms.Compose([
+        transforms.RandomResizedCrop(224),      # 随机裁剪并调整为224x224（数据增强）
+        transforms.RandomHorizontalFlip(),      # 随机水平翻转（数据增强）
+        transforms.ToTensor(),                  # 转换为Tensor
+        transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)  # ImageNet标准化
+    ]),
+    'validation': transforms.Compose([
+        transforms.Resize(256),                 # 调整大小为256
+        transforms.CenterCrop(224),             # 中心裁剪为224x224
+        transforms.ToTensor(),                  # 转换为Tensor
+        transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)  # ImageNet标准化
+    ]),
+}
+
+
+# ============================================
+# 3. 模型结构（ResNet18 + 自定义FC层）
+# ============================================
+def build_head(num_ftrs=512, hidden_size=256, num_classes=6):
+    """自定义全连接层：Linear(输入,256) -> ReLU -> Linear(256,6)"""
+    return nn.Sequential(
+        nn.Linear(num_ftrs, hidden_size),   # 第一层全连接：输入特征 -> 256维
+        nn.ReLU(),                          # ReLU激活函数
+        nn.Linear(hidden_size, num_classes) # 第二层全连接：256维 -> 6类缺陷
+    )
+
+
+def build_model(pretrained=False, hidden_size=256, num_classes=6):
+    """构建 ResNet18 并替换全连接层"""
+    model = models.resnet18(pretrained=pretrained)
+    num_ftrs = model.fc.in_features
+    model.fc = build_head(num_ftrs, hidden_size, num_classes)
+    return model
+
+
+def freeze_backbone(model):
+    """冻结除全连接层以外的所有参数"""
+    for name, param in model.named_parameters():
+        if not name.startswith('fc.'):
+            param.requires_grad = False
+    return model
+
+
+def infer_backend(model_path):
+    """根据文件扩展名推断推理后端"""
+    if model_path.endswith('.onnx'):
+        return 'onnx'
+    if model_path.endswith('.pt'):
+        return 'torchscript'
+    return 'eager'
+
+
+def resolve_model_path(model_path=MODEL_PATH, input_mode='rgb', backend=MODEL_BACKEND):
+    """load_model 实际读取的文件：对 .pth 指定 torchscript/onnx 时为 export.py 导出的对应文件"""
+    backend = backend or infer_backend(model_path)
+    if backend != 'eager' and model_path.endswith('.pth'):
+        from export import export_paths
+        return export_paths(model_path, input_mode)[backend]
+    return model_path
+
+
+def load_weights(model_path):
+    """以内存映射方式读取 state_dict，不把整个文件复制进内存（PyTorch < 2.1 不支持 mmap，回退为完整读取）"""
+    try:
+        return torch.load(model_path, map_location='cpu', mmap=True, weights_only=True)
+    except TypeError:
+        return torch.load(model_path, map_location='cpu')
+
+
+def build_from_state_dict(state_dict):
+    """在 meta 设备上构建网络结构（跳过随机初始化），再直接引用 state_dict 中的张量"""
+    try:
+        with torch.device('meta'):
+            model = build_model(pretrained=False)
+        model.load_state_dict(state_dict, assign=True)
+    except TypeError:
+        # PyTorch < 2.1：load_state_dict 没有 assign 参数
+        model = build_model(pretrained=False)
+        model.load_state_dict(state_dict)
+    return model
+
+
+class AutocastModel(nn.Module):
+    """在 CPU autocast 下前向（卷积、全连接以 bfloat16 计算），输出 logits 转回 float32，调用方式与原模型相同"""
+
+    def __init__(self, model, dtype=torch.bfloat16):
+        super().__init__()
+        self.model = model
+        self.dtype = dtype
+
+    def forward(self, x):
+        with torch.autocast('cpu', dtype=self.dtype):
+            outputs = self.model(x)
+        return outputs.float()
+
+
+def with_precision(model, precision='fp32'):
+    """precision='bf16' 时用 AutocastModel 包装（softmax 等后处理仍为 float32），fp32 原样返回"""
+    if precision == 'fp32':
+        return model
+    if precision != 'bf16':
+        raise ValueError(f"不支持的推理精度 '{precision}'（可选 fp32 / bf16）")
+    return AutocastModel(model).eval()
+
+
+def load_model(model_path=MODEL_PATH, input_mode='rgb', backend=MODEL_BACKEND, precision='fp32'):
+    """
+    加载训练好的模型并设置为评估模式
+    backend: 'eager'（.pth state_dict）、'torchscript'（.pt）或 'onnx'（.onnx），默认按扩展名推断；
+             对 .pth 指定 torchscript/onnx 时，自动使用 export.py 导出的对应文件
+    input_mode='gray' 时把 conv1 与 ImageNet 标准化折叠为单通道卷积（见 grayscale.py）
+    precision='bf16' 时以 bfloat16 autocast 推理（见 with_precision，onnx 后端不支持）
+    """
+    backend = backend or infer_backend(model_path)
+    if backend == 'onnx' and precision != 'fp32':
+        raise ValueError("onnx 后端只支持 fp32 推理")
+    if backend != 'eager':
+        if model_path.endswith('.pth'):
+            model_path = resolve_model_path(model_path, input_mode, backend)
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(f"未找到导出文件 '{model_path}'，请先运行 python export.py")
+        elif input_mode == 'gray':
+            raise ValueError(f"模型文件 '{model_path}' 不支持单通道折叠，请使用 .pth 权重")
+        if backend == 'torchscript':
+            return with_precision(torch.jit.load(model_path, map_location='cpu').eval(), precision)
+        from export import OnnxModel
+        return OnnxModel(model_path)
+
+    model = build_from_state_dict(load_weights(model_path))
+    model.eval()
+    if input_mode == 'gray':
+        from grayscale import fold_grayscale
+        model = fold_grayscale(model)
+    return with_precision(model, precision)
+
+
+# ============================================
+# 4. 图像预处理与推理（与验证集一致）
+# ============================================
+def preprocess_image(image, input_mode='rgb'):
+    """对图像进行预处理，返回带batch维度的张量（开启 metrics 时逐个变换计时）"""
+    if input_mode == 'gray':
+        # 单通道：标准化已折叠进 conv1，只需缩放、裁剪和转张量
+        from grayscale import gray_preprocess
+        return metrics.run_transforms(gray_preprocess, image).unsqueeze(0)
+
+    # 解码（PIL 延迟解码，convert 时才真正读取像素）
+    with metrics.stage('decode'):
+        image = image.convert('RGB')
+    # 应用预处理（与验证集一致；变换在模块加载时构建一次，不在每次调用时重新构建）
+    image_tensor = metrics.run_transforms(data_transforms['validation'], image)
+    # 添加batch维度
+    image_tensor = image_tensor.unsqueeze(0)
+    return image_tensor
+
+
+def predict(image, model, input_mode='rgb'):
+    """对图像进行预测，返回 (类别名, 置信度百分比, 各类别概率)"""
+    # 预处理图像
+    with metrics.stage('preprocess'):
+        image_tensor = preprocess_image(image, input_mode)
+
+    # 进行推理
+    with torch.no_grad():
+        with metrics.stage('forward'):
+            outputs = model(image_tensor)
+        with metrics.stage('softmax'):
+            # 获取预测结果
+            probabilities = torch.nn.functional.softmax(outputs[0], dim=0)
+            # 获取最大概率的类别
+            confidence, predicted_idx = torch.max(probabilities, 0)
+
+    # 转换为Python类型
+    predicted_class = class_names[predicted_idx.item()]
+    confidence_percent = confidence.item() * 100
+
+    return predicted_class, confidence_percent, probabilities.numpy()
+
+
+# ============================================
+# 5. 准确率、参数量与延迟测量（quantize / distill / prune / mixed_precision 等工具共用）
+# ============================================
+def per_class_accuracy(model, loader):
+    """返回 (各类别准确率列表, 总体准确率)"""
+    from tqdm import tqdm
+
+    num_classes = len(class_names)
+    correct = torch.zeros(num_classes)
+    total = torch.zeros(num_classes)
+    with torch.inference_mode():
+        for inputs, labels in tqdm(loader, desc='Evaluate', leave=False):
+            preds = model(inputs).argmax(dim=1)
+            total += torch.bincount(labels, minlength=num_classes).float()
+            correct += torch.bincount(labels[preds == labels], minlength=num_classes).float()
+    return (correct / total.clamp(min=1)).tolist(), (correct.sum() / total.sum()).item()
+
+
+def count_parameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+def measure_latency(model, batch_size=1, iters=50, warmup=10, input_channels=3):
+    """单次前向的平均延迟（毫秒）；单通道快速路径的模型传入 input_channels=1"""
+    inputs = torch.randn(batch_size, input_channels, 224, 224)
+    with torch.inference_mode():
+        for _ in range(warmup):
+            model(inputs)
+        start = time.perf_counter()
+        for _ in range(iters):
+            model(inputs)
+    return (time.perf_counter() - start) / iters * 1000
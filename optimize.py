@@ -0,0 +1,158 @@
+"""
+推理优化：Conv+BatchNorm 折叠、ReLU 融合与 channels_last 内存布局
+
+app.py 的推理模型中每个 BatchNorm 都是卷积之后单独的一个算子，并使用默认的 NCHW 布局。
+build_optimized_model 构建等价的推理模型：
+1. 把每个 BN 的缩放和平移折叠进前一个卷积的权重和偏置，BN 替换为 Identity；
+2. 模型和输入转换为 channels_last（NHWC），CPU 上的 oneDNN 卷积在该布局下更快；
+3. 可选 TorchScript freeze + optimize_for_inference，把 conv+relu（以及 conv+add+relu）融合为单个算子；
+4. 显式设置 intra-op / inter-op 线程数。
+
+用法：
+    python optimize.py                          # 等价性检查 + batch 1/8/32 延迟对比
+    python optimize.py --threads 4 --no-jit
+"""
+
+import argparse
+import copy
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from model_utils import MODEL_PATH, load_model, measure_latency
+
+
+# ============================================
+# 1. Conv + BN 折叠
+# ============================================
+def fold_stem_bn(stem, bn):
+    """把 bn1 折叠进单通道 GrayscaleStem（权重、标准化偏置核和偏置同时缩放）"""
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    bias = stem.bias if stem.bias is not None else torch.zeros_like(bn.running_mean)
+    stem.weight = nn.Parameter(stem.weight * scale.view(-1, 1, 1, 1))
+    stem.offset_kernel = stem.offset_kernel * scale.view(-1, 1, 1, 1)
+    stem.bias = nn.Parameter((bias - bn.running_mean) * scale + bn.bias)
+    stem._offsets = {}
+    return stem
+
+
+def fold_batchnorm(model):
+    """
+    把 ResNet 中所有 (conv, bn) 对折叠为带偏置的卷积，bn 替换为 Identity
+    覆盖 conv1/bn1、每个 BasicBlock 的 conv1/bn1、conv2/bn2 以及 downsample 分支
+    """
+    from grayscale import GrayscaleStem
+
+    with torch.no_grad():
+        if isinstance(model.conv1, GrayscaleStem):
+            fold_stem_bn(model.conv1, model.bn1)
+        else:
+            model.conv1 = fuse_conv_bn_eval(model.conv1, model.bn1)
+        model.bn1 = nn.Identity()
+
+        for layer in (model.layer1, model.layer2, model.layer3, model.layer4):
+            for block in layer:
+                block.conv1 = fuse_conv_bn_eval(block.conv1, block.bn1)
+                block.bn1 = nn.Identity()
+                block.conv2 = fuse_conv_bn_eval(block.conv2, block.bn2)
+                block.bn2 = nn.Identity()
+                if block.downsample is not None:
+                    block.downsample = nn.Sequential(fuse_conv_bn_eval(block.downsample[0], block.downsample[1]))
+    return model
+
+
+# ============================================
+# 2. 优化推理模型
+# ============================================
+class ChannelsLastModel(nn.Module):
+    """在前向时把输入转换为 channels_last，调用方式与原模型相同"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x.contiguous(memory_format=torch.channels_last))
+
+
+def set_threads(intra_op=None, inter_op=None):
+    """显式设置线程数；inter-op 线程数只能在首次并行计算之前设置一次"""
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            pass
+
+
+def build_optimized_model(model, channels_last=True, jit=True):
+    """返回折叠 BN、channels_last 布局（可选 TorchScript 融合）的推理模型，原模型不变"""
+    model = fold_batchnorm(copy.deepcopy(model).eval())
+    input_channels = model.conv1.weight.shape[1]
+    if channels_last:
+        model = ChannelsLastModel(model.to(memory_format=torch.channels_last))
+    if jit:
+        example = torch.rand(1, input_channels, 224, 224)
+        with torch.no_grad():
+            scripted = torch.jit.freeze(torch.jit.trace(model.eval(), example))
+            # 融合 conv+relu / conv+add+relu，并把权重预先转换为 oneDNN 格式
+            model = torch.jit.optimize_for_inference(scripted)
+    return model.eval()
+
+
+# ============================================
+# 3. 等价性检查与延迟报告
+# ============================================
+def check_equivalence(reference, optimized, input_channels=3, batch_size=8):
+    """比较优化前后模型在随机输入上的 logits，返回最大绝对误差"""
+    inputs = torch.rand(batch_size, input_channels, 224, 224)
+    with torch.inference_mode():
+        return (reference(inputs) - optimized(inputs)).abs().max().item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='推理优化：Conv+BN 折叠、ReLU 融合与 channels_last')
+    parser.add_argument('--model', default=MODEL_PATH, help='模型文件路径')
+    parser.add_argument('--gray', action='store_true', help='在单通道快速路径的基础上优化')
+    parser.add_argument('--threads', type=int, default=None, help='intra-op 线程数')
+    parser.add_argument('--interop-threads', type=int, default=1, help='inter-op 线程数')
+    parser.add_argument('--no-jit', action='store_true', help='不使用 TorchScript 融合（仅折叠 BN + channels_last）')
+    parser.add_argument('--atol', type=float, default=1e-3, help='等价性检查允许的 logits 最大误差')
+    args = parser.parse_args()
+
+    set_threads(args.threads, args.interop_threads)
+    input_mode = 'gray' if args.gray else 'rgb'
+    channels = 1 if args.gray else 3
+    reference = load_model(args.model, input_mode, backend='eager')
+    variants = {
+        '原始模型': reference,
+        '折叠 BN': build_optimized_model(reference, channels_last=False, jit=False),
+        '折叠 BN + channels_last': build_optimized_model(reference, jit=False),
+    }
+    if not args.no_jit:
+        variants['+ TorchScript 融合'] = build_optimized_model(reference)
+
+    print(f"线程数: intra-op={torch.get_num_threads()}, inter-op={torch.get_num_interop_threads()}")
+    print("\n等价性检查（与原始模型的 logits 最大绝对误差）")
+    print("=" * 64)
+    failed = False
+    for name, model in list(variants.items())[1:]:
+        diff = check_equivalence(reference, model, channels)
+        failed |= diff > args.atol
+        print(f"{name:<28s}{diff:>12.2e}  {'✅' if diff <= args.atol else '❌'}")
+
+    print("\n延迟（毫秒/批次）")
+    print("=" * 64)
+    batch_sizes = (1, 8, 32)
+    print(f"{'模型':<28s}" + ''.join(f"{f'batch={b}':>12s}" for b in batch_sizes))
+    for name, model in variants.items():
+        print(f"{name:<28s}" + ''.join(f"{measure_latency(model, b, 20, 5, channels):>12.2f}" for b in batch_sizes))
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
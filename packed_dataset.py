@@ -0,0 +1,216 @@
+"""
+预解码的内存映射数据集
+
+ImageFolder 每个 epoch 都要用 PIL 重新打开、解码所有 JPEG 并转换为 RGB。
+本模块提供一次性的打包步骤：把每个数据划分解码为 N x 200 x 200 的 uint8 数组
+（.npy 格式，可直接内存映射），同时保存标签数组和类别索引。
+PackedImageDataset 以零拷贝方式读取该数组，多个 DataLoader 工作进程共享同一份页缓存。
+
+用法：
+    python packed_dataset.py pack             # 打包 train / validation
+    python packed_dataset.py bench            # 对比 ImageFolder 与打包数据集的遍历耗时
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from torchvision import datasets, transforms
+
+from model_utils import IMAGENET_MEAN, IMAGENET_STD, split_dir, data_transforms
+
+PACKED_DIR = './cache/packed'
+IMAGE_SIZE = 200
+
+
+# ============================================
+# 1. 打包：解码一次，写入内存映射数组
+# ============================================
+def packed_paths(split, packed_dir=PACKED_DIR):
+    """返回某个划分的 (图像数组, 标签数组, 元信息) 文件路径"""
+    return (os.path.join(packed_dir, f'{split}_images.npy'),
+            os.path.join(packed_dir, f'{split}_labels.npy'),
+            os.path.join(packed_dir, f'{split}_meta.json'))
+
+
+def _decode(path, size):
+    """解码单张图片为单通道 uint8 数组"""
+    with Image.open(path) as img:
+        img = img.convert('L')
+        if img.size != (size, size):
+            img = img.resize((size, size), Image.BILINEAR)
+        return np.asarray(img, dtype=np.uint8)
+
+
+def pack_split(split, packed_dir=PACKED_DIR, size=IMAGE_SIZE, num_threads=8):
+    """把一个数据划分解码并写入 .npy 内存映射文件，返回样本数"""
+    os.makedirs(packed_dir, exist_ok=True)
+    folder = datasets.ImageFolder(split_dir(split))
+    images_path, labels_path, meta_path = packed_paths(split, packed_dir)
+    num_samples = len(folder.samples)
+
+    images = np.lib.format.open_memmap(images_path, mode='w+', dtype=np.uint8,
+                                       shape=(num_samples, size, size))
+
+    def write(item):
+        idx, (path, _) = item
+        images[idx] = _decode(path, size)
+
+    # PIL 解码时会释放 GIL，用线程池并行解码即可
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        list(pool.map(write, enumerate(folder.samples)))
+    images.flush()
+    del images
+
+    np.save(labels_path, np.array(folder.targets, dtype=np.int64))
+    meta = {
+        'classes': folder.classes,
+        'class_to_idx': folder.class_to_idx,
+        'shape': [num_samples, size, size],
+        'paths': [os.path.relpath(p) for p, _ in folder.samples],
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return num_samples
+
+
+def is_packed(split, packed_dir=PACKED_DIR):
+    return all(os.path.exists(p) for p in packed_paths(split, packed_dir))
+
+
+# ============================================
+# 2. 与 data_transforms 对应的张量版预处理
+# ============================================
+class GrayToRGB:
+    """把 [1,H,W] 张量扩展为 [3,H,W]（expand 视图，不复制数据）"""
+
+    def __call__(self, x):
+        return x.expand(3, -1, -1)
+
+
+packed_transforms = {
+    'train': transforms.Compose([
+        transforms.ConvertImageDtype(torch.float32),
+        transforms.RandomResizedCrop(224, antialias=True),
+        transforms.RandomHorizontalFlip(),
+        GrayToRGB(),
+        transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)
+    ]),
+    'validation': transforms.Compose([
+        transforms.ConvertImageDtype(torch.float32),
+        transforms.Resize(256, antialias=True),
+        transforms.CenterCrop(224),
+        GrayToRGB(),
+        transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)
+    ]),
+}
+
+
+# ============================================
+# 3. 内存映射数据集
+# ============================================
+class PackedImageDataset(Dataset):
+    """
+    读取 pack_split 生成的内存映射数组
+    不指定 transform 时返回 uint8 张量 [1,200,200]，可交给批量增强处理
+    """
+
+    def __init__(self, split, transform=None, packed_dir=PACKED_DIR):
+        self.images_path, labels_path, meta_path = packed_paths(split, packed_dir)
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        self.classes = meta['classes']
+        self.class_to_idx = meta['class_to_idx']
+        self.paths = meta['paths']
+        self.targets = np.load(labels_path)
+        self.transform = transform
+        self._images = None
+
+    @property
+    def images(self):
+        # 延迟打开：每个工作进程各自映射同一个文件，共享操作系统页缓存
+        # 'c'（写时复制）模式得到可写视图，torch.from_numpy 不会告警，且从不实际写入
+        if self._images is None:
+            self._images = np.load(self.images_path, mmap_mode='c')
+        return self._images
+
+    def __getstate__(self):
+        # 传给工作进程时不序列化数组本身，避免复制整个数据集
+        state = self.__dict__.copy()
+        state['_images'] = None
+        return state
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, idx):
+        image = torch.from_numpy(self.images[idx]).unsqueeze(0)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, int(self.targets[idx])
+
+
+# ============================================
+# 4. 遍历耗时对比
+# ============================================
+def time_loader(dataset, epochs, batch_size, num_workers):
+    """返回每个 epoch 遍历 DataLoader 的耗时列表"""
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                        persistent_workers=num_workers > 0)
+    times = []
+    for _ in range(epochs):
+        start = time.perf_counter()
+        for _ in loader:
+            pass
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='预解码内存映射数据集：打包与遍历耗时对比')
+    parser.add_argument('command', choices=['pack', 'bench'], help='pack: 打包数据集；bench: 耗时对比')
+    parser.add_argument('--packed-dir', default=PACKED_DIR, help='打包文件目录')
+    parser.add_argument('--split', default='train', choices=['train', 'validation'], help='bench 使用的数据划分')
+    parser.add_argument('--epochs', type=int, default=3, help='bench 遍历的 epoch 数')
+    parser.add_argument('--batch-size', type=int, default=16, help='Batch Size')
+    parser.add_argument('--workers', type=int, default=0, help='DataLoader 工作进程数')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        for split in ['train', 'validation']:
+            start = time.perf_counter()
+            n = pack_split(split, args.packed_dir)
+            print(f"✅ {split}: {n} 张图片已打包，耗时 {time.perf_counter() - start:.2f}s")
+        return
+
+    if not is_packed(args.split, args.packed_dir):
+        print("未找到打包数据，先执行打包...")
+        pack_split(args.split, args.packed_dir)
+
+    folder = datasets.ImageFolder(split_dir(args.split), data_transforms[args.split])
+    packed = PackedImageDataset(args.split, packed_transforms[args.split], args.packed_dir)
+    raw = PackedImageDataset(args.split, None, args.packed_dir)
+
+    print(f"数据划分: {args.split}，样本数: {len(folder)}，workers={args.workers}")
+    results = {
+        'ImageFolder + PIL': time_loader(folder, args.epochs, args.batch_size, args.workers),
+        'Packed + 张量预处理': time_loader(packed, args.epochs, args.batch_size, args.workers),
+        'Packed（仅读取 uint8）': time_loader(raw, args.epochs, args.batch_size, args.workers),
+    }
+    baseline = np.mean(results['ImageFolder + PIL'])
+    print("\n" + "=" * 60)
+    print(f"{'数据集':<24s}{'平均每 epoch':>14s}{'图片/秒':>12s}{'加速':>8s}")
+    print("=" * 60)
+    for name, times in results.items():
+        mean = np.mean(times)
+        print(f"{name:<24s}{mean:>13.2f}s{len(folder) / mean:>12.0f}{baseline / mean:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
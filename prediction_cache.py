@@ -0,0 +1,95 @@
+"""
+基于内容哈希的预测结果缓存（LRU）
+
+Streamlit 每次控件交互都会重新执行整个脚本，同一张上传图片会被反复预处理和推理。
+PredictionCache 以“图片字节的 SHA-256 + 模型版本”为键缓存预测结果，容量有上限，按最近最少使用淘汰；
+重复查看、脚本重跑和重复上传都直接命中缓存。命中、未命中和淘汰次数可在侧边栏查看。
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+
+@lru_cache(maxsize=16)
+def _file_digest(path, size, mtime_ns):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()[:12]
+
+
+def image_digest(image_bytes):
+    """图片字节的 SHA-256（十六进制）"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def model_version(model_path, *variant):
+    """
+    模型版本标识：权重文件内容哈希 + 推理变体（如 input_mode、backend）
+    以文件大小和修改时间作为哈希的缓存键，文件未变化时不会重复读取
+    """
+    stat = os.stat(model_path)
+    digest = _file_digest(os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns)
+    return ':'.join([digest, *[str(v) for v in variant if v is not None]])
+
+
+class PredictionCache:
+    """线程安全的 LRU 缓存，Streamlit 多个会话共享同一个实例"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(image_bytes, version):
+        return f'{image_digest(image_bytes)}@{version}'
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """命中则直接返回，否则调用 compute() 计算并写入缓存；返回 (结果, 是否命中)"""
+        value = self.get(key)
+        if value is not None:
+            return value, True
+        value = compute()
+        self.put(key, value)
+        return value, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'capacity': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
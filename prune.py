@@ -0,0 +1,232 @@
+"""
+ResNet18 主干 layer3 / layer4 的结构化通道剪枝 + 短暂微调
+
+与非结构化稀疏（权重置零）不同，这里按重要性排序后把通道从卷积、BatchNorm 和全连接层中真正删除，
+张量和计算量都会变小，无需稀疏算子支持：
+1. 块内通道：每个 BasicBlock 的 conv1 输出 / bn1 / conv2 输入；
+2. 残差通道（--scope all）：同一 stage 内所有块共享残差宽度，需同时裁剪各块 conv2 输出、bn2、
+   downsample 分支以及下游输入（下一 stage 第一个块的 conv1 和 downsample，layer4 之后是 fc[0] 的输入维度）。
+
+通道重要性可用 BN 缩放系数 |gamma|（--criterion bn）或卷积核 L1 范数（--criterion l1）衡量。
+对每个稀疏度剪枝后在训练集上微调若干 epoch，打印准确率-延迟的帕累托表，并把剪枝模型保存为 TorchScript。
+
+用法：
+    python prune.py                                       # 稀疏度 0.25/0.5/0.75，BN gamma 排序
+    python prune.py --sparsities 0.3,0.6 --criterion l1 --epochs 3
+    python prune.py --scope internal                      # 只剪块内通道，残差宽度不变
+"""
+
+import argparse
+import copy
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader
+from torchvision import datasets
+from tqdm import tqdm
+
+from model_utils import (MODEL_PATH, count_parameters, data_transforms, load_model, measure_latency, per_class_accuracy,
+                         split_dir)
+
+PRUNE_STAGES = ('layer3', 'layer4')
+
+
+# ============================================
+# 1. 按通道索引切片各层
+# ============================================
+def slice_conv(conv, out_idx=None, in_idx=None):
+    """返回只保留指定输出/输入通道的新卷积层"""
+    weight = conv.weight.detach()
+    if out_idx is not None:
+        weight = weight[out_idx]
+    if in_idx is not None:
+        weight = weight[:, in_idx]
+    new = nn.Conv2d(weight.shape[1], weight.shape[0], conv.kernel_size, conv.stride, conv.padding,
+                    conv.dilation, bias=conv.bias is not None)
+    new.weight.data.copy_(weight)
+    if conv.bias is not None:
+        new.bias.data.copy_(conv.bias.detach() if out_idx is None else conv.bias.detach()[out_idx])
+    return new
+
+
+def slice_bn(bn, idx):
+    new = nn.BatchNorm2d(len(idx), bn.eps, bn.momentum)
+    for name in ('weight', 'bias'):
+        getattr(new, name).data.copy_(getattr(bn, name).detach()[idx])
+    for name in ('running_mean', 'running_var'):
+        getattr(new, name).copy_(getattr(bn, name)[idx])
+    new.num_batches_tracked.copy_(bn.num_batches_tracked)
+    return new
+
+
+def slice_linear_in(linear, idx):
+    new = nn.Linear(len(idx), linear.out_features, bias=linear.bias is not None)
+    new.weight.data.copy_(linear.weight.detach()[:, idx])
+    if linear.bias is not None:
+        new.bias.data.copy_(linear.bias.detach())
+    return new
+
+
+# ============================================
+# 2. 通道重要性与保留索引
+# ============================================
+def keep_indices(scores, sparsity):
+    """按分数保留前 (1 - sparsity) 的通道（至少 1 个），返回升序索引"""
+    keep = max(1, int(round(len(scores) * (1 - sparsity))))
+    return torch.sort(torch.topk(scores, keep).indices).values
+
+
+def internal_scores(block, criterion):
+    if criterion == 'bn':
+        return block.bn1.weight.detach().abs()
+    return block.conv1.weight.detach().abs().sum(dim=(1, 2, 3))
+
+
+def residual_scores(stage, criterion):
+    """stage 残差通道的分数：各块输出（bn2 / conv2）与 downsample 分支的分数之和"""
+    scores = 0
+    for block in stage:
+        if criterion == 'bn':
+            scores = scores + block.bn2.weight.detach().abs()
+            if block.downsample is not None:
+                scores = scores + block.downsample[1].weight.detach().abs()
+        else:
+            scores = scores + block.conv2.weight.detach().abs().sum(dim=(1, 2, 3))
+            if block.downsample is not None:
+                scores = scores + block.downsample[0].weight.detach().abs().sum(dim=(1, 2, 3))
+    return scores
+
+
+# ============================================
+# 3. 剪枝
+# ============================================
+def prune_internal(block, idx):
+    block.conv1 = slice_conv(block.conv1, out_idx=idx)
+    block.bn1 = slice_bn(block.bn1, idx)
+    block.conv2 = slice_conv(block.conv2, in_idx=idx)
+
+
+def prune_residual(model, stage_name, idx):
+    """裁剪一个 stage 的残差宽度，并重连下游的输入通道"""
+    stage = getattr(model, stage_name)
+    for i, block in enumerate(stage):
+        if i > 0:
+            block.conv1 = slice_conv(block.conv1, in_idx=idx)
+        block.conv2 = slice_conv(block.conv2, out_idx=idx)
+        block.bn2 = slice_bn(block.bn2, idx)
+        if block.downsample is not None:
+            block.downsample[0] = slice_conv(block.downsample[0], out_idx=idx)
+            block.downsample[1] = slice_bn(block.downsample[1], idx)
+
+    stages = ['layer1', 'layer2', 'layer3', 'layer4']
+    position = stages.index(stage_name)
+    if position + 1 < len(stages):
+        first = getattr(model, stages[position + 1])[0]
+        first.conv1 = slice_conv(first.conv1, in_idx=idx)
+        first.downsample[0] = slice_conv(first.downsample[0], in_idx=idx)
+    else:
+        # layer4 之后是全局平均池化和自定义全连接 Sequential
+        model.fc[0] = slice_linear_in(model.fc[0], idx)
+
+
+@torch.no_grad()
+def prune_model(model, sparsity, criterion='bn', scope='all', stages=PRUNE_STAGES):
+    """返回剪枝后的新模型（原模型不变）"""
+    model = copy.deepcopy(model).eval()
+    if sparsity <= 0:
+        return model
+    for stage_name in stages:
+        stage = getattr(model, stage_name)
+        for block in stage:
+            prune_internal(block, keep_indices(internal_scores(block, criterion), sparsity))
+        if scope == 'all':
+            prune_residual(model, stage_name, keep_indices(residual_scores(stage, criterion), sparsity))
+    return model
+
+
+# ============================================
+# 4. 微调与扫描
+# ============================================
+def fine_tune(model, loader, epochs=2, lr=1e-3, momentum=0.9):
+    """剪枝后全部参数以较小学习率微调，恢复精度"""
+    optimizer = optim.SGD(model.parameters(), lr=lr, momentum=momentum)
+    criterion = nn.CrossEntropyLoss()
+    for epoch in range(epochs):
+        model.train()
+        for inputs, labels in tqdm(loader, desc=f'Fine-tune {epoch + 1}/{epochs}', leave=False):
+            optimizer.zero_grad()
+            criterion(model(inputs), labels).backward()
+            optimizer.step()
+    return model.eval()
+
+
+def pareto_front(rows):
+    """准确率更高且延迟更低（或相等）的其他配置不存在时，该配置位于帕累托前沿"""
+    return [not any(o['acc'] >= r['acc'] and o['latency_ms'] <= r['latency_ms']
+                    and (o['acc'] > r['acc'] or o['latency_ms'] < r['latency_ms']) for o in rows)
+            for r in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='layer3/layer4 结构化通道剪枝与微调')
+    parser.add_argument('--model', default=MODEL_PATH, help='模型文件路径（.pth）')
+    parser.add_argument('--sparsities', default='0.25,0.5,0.75', help='要扫描的稀疏度（逗号分隔）')
+    parser.add_argument('--criterion', default='bn', choices=['bn', 'l1'], help='通道重要性：BN gamma 或卷积 L1 范数')
+    parser.add_argument('--scope', default='all', choices=['all', 'internal'],
+                        help='all: 块内通道和残差通道；internal: 只剪块内通道')
+    parser.add_argument('--epochs', type=int, default=2, help='每个稀疏度的微调轮数')
+    parser.add_argument('--lr', type=float, default=1e-3, help='微调学习率')
+    parser.add_argument('--batch-size', type=int, default=16, help='Batch Size')
+    parser.add_argument('--threads', type=int, default=None, help='测量延迟使用的 CPU 线程数')
+    parser.add_argument('--no-save', action='store_true', help='不保存剪枝后的模型')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(42)
+    train_loader = DataLoader(datasets.ImageFolder(split_dir('train'), data_transforms['train']),
+                              batch_size=args.batch_size, shuffle=True, num_workers=0)
+    val_loader = DataLoader(datasets.ImageFolder(split_dir('validation'), data_transforms['validation']),
+                            batch_size=args.batch_size, shuffle=False, num_workers=0)
+    base = load_model(args.model, backend='eager')
+
+    rows = []
+    for sparsity in [0.0] + [float(s) for s in args.sparsities.split(',')]:
+        model = prune_model(base, sparsity, args.criterion, args.scope)
+        if sparsity > 0:
+            print(f"\n稀疏度 {sparsity:.0%}: 参数量 {count_parameters(model) / 1e6:.2f} M，微调 {args.epochs} 个 epoch...")
+            _, pruned_acc = per_class_accuracy(model, val_loader)
+            fine_tune(model, train_loader, args.epochs, args.lr)
+        else:
+            pruned_acc = None
+        _, acc = per_class_accuracy(model, val_loader)
+        row = {
+            'sparsity': sparsity,
+            'params_m': count_parameters(model) / 1e6,
+            'pruned_acc': pruned_acc,
+            'acc': acc,
+            'latency_ms': measure_latency(model, 1),
+            'latency_bs16_ms': measure_latency(model, args.batch_size),
+        }
+        rows.append(row)
+        if sparsity > 0 and not args.no_save:
+            path = f"{args.model.rsplit('.', 1)[0]}_pruned{int(round(sparsity * 100))}.pt"
+            with torch.no_grad():
+                torch.jit.freeze(torch.jit.trace(model, torch.rand(1, 3, 224, 224))).save(path)
+            row['path'] = path
+
+    print("\n" + "=" * 88)
+    print(f"准确率-延迟帕累托表（criterion={args.criterion}, scope={args.scope}，★ 为帕累托前沿）")
+    print("=" * 88)
+    print(f"{'稀疏度':>8s}{'参数量(M)':>12s}{'剪枝后准确率':>14s}{'微调后准确率':>14s}"
+          f"{'bs=1(ms)':>12s}{f'bs={args.batch_size}(ms)':>12s}  前沿  模型文件")
+    for row, on_front in zip(rows, pareto_front(rows)):
+        pruned = f"{row['pruned_acc']:.4f}" if row['pruned_acc'] is not None else '-'
+        print(f"{row['sparsity']:>8.0%}{row['params_m']:>12.2f}{pruned:>14s}{row['acc']:>14.4f}"
+              f"{row['latency_ms']:>12.2f}{row['latency_bs16_ms']:>12.2f}  {'★' if on_front else ' ':^4s}  "
+              f"{row.get('path', '-')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+INT8 训练后静态量化（在验证集上校准）
+
+模型部署在仅有 CPU 的工控机上，fp32 推理是最主要的延迟来源。本脚本：
+1. 加载 best_model.pth，用 FX 图模式量化：prepare_fx 会自动融合 conv/bn/relu 并插入观察器；
+2. 在 data/validation/images 上运行前向，校准静态 INT8 观察器；
+3. convert_fx 得到量化模型，以 TorchScript 格式保存（best_model_int8.pt）；
+4. 打印各缺陷类别的 fp32 / INT8 准确率对比，以及延迟和模型大小的变化。
+
+量化模型可直接被 app.py（设置 DEFECT_MODEL_PATH=best_model_int8.pt）、batch_predict.py 和 serve.py（--model）加载。
+
+用法：
+    python quantize.py
+    python quantize.py --calib-batches 20 --output best_model_int8.pt
+"""
+
+import argparse
+import os
+import platform
+
+import torch
+from torch.utils.data import DataLoader
+from torchvision import datasets
+from tqdm import tqdm
+
+from model_utils import (MODEL_PATH, class_names, data_transforms, load_model, measure_latency, per_class_accuracy,
+                         split_dir)
+
+QUANTIZED_PATH = 'best_model_int8.pt'
+
+
+def default_engine():
+    """x86 使用 fbgemm，ARM 工控机使用 qnnpack"""
+    machine = platform.machine().lower()
+    return 'qnnpack' if machine.startswith(('arm', 'aarch')) else 'fbgemm'
+
+
+# ============================================
+# 1. 量化：融合 -> 插入观察器 -> 校准 -> 转换
+# ============================================
+def quantize_model(model, calib_loader, engine=None, calib_batches=None):
+    """对 eval 模式的 fp32 模型做静态 INT8 量化，返回量化后的 GraphModule"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = engine or default_engine()
+    torch.backends.quantized.engine = engine
+    qconfig_mapping = get_default_qconfig_mapping(engine)
+    example_inputs = (torch.randn(1, 3, 224, 224),)
+
+    # prepare_fx 内部先做 conv+bn(+relu) 融合，再插入观察器
+    prepared = prepare_fx(model.eval(), qconfig_mapping, example_inputs)
+    with torch.inference_mode():
+        for i, (inputs, _) in enumerate(tqdm(calib_loader, desc='Calibrate', leave=False)):
+            if calib_batches is not None and i >= calib_batches:
+                break
+            prepared(inputs)
+    return convert_fx(prepared)
+
+
+def save_quantized(model, path=QUANTIZED_PATH):
+    """量化模型以 TorchScript 保存，加载时不需要重新构建 FX 图"""
+    scripted = torch.jit.trace(model, torch.randn(1, 3, 224, 224))
+    torch.jit.save(scripted, path)
+    return scripted
+
+
+# ============================================
+# 2. 对比：各类别准确率、延迟、模型大小
+# ============================================
+def main():
+    parser = argparse.ArgumentParser(description='INT8 训练后静态量化（验证集校准）')
+    parser.add_argument('--model', default=MODEL_PATH, help='fp32 模型文件路径')
+    parser.add_argument('--output', default=QUANTIZED_PATH, help='量化模型输出路径（TorchScript）')
+    parser.add_argument('--engine', default=None, choices=['fbgemm', 'qnnpack', 'x86'],
+                        help='量化后端（默认按 CPU 架构选择）')
+    parser.add_argument('--calib-batches', type=int, default=None, help='校准使用的批次数（默认整个验证集）')
+    parser.add_argument('--batch-size', type=int, default=16, help='校准与评估的 Batch Size')
+    parser.add_argument('--threads', type=int, default=None, help='推理使用的 CPU 线程数')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    dataset = datasets.ImageFolder(split_dir('validation'), data_transforms['validation'])
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=0)
+
+    print("加载 fp32 模型...")
+    fp32_model = load_model(args.model, backend='eager')
+
+    print("量化模型（融合 conv/bn/relu，校准观察器）...")
+    quantized = quantize_model(load_model(args.model, backend='eager'), loader, args.engine, args.calib_batches)
+    int8_model = save_quantized(quantized, args.output)
+    print(f"💾 量化模型已保存为 '{args.output}'（后端: {torch.backends.quantized.engine}）")
+
+    print("\n评估准确率...")
+    fp32_acc, fp32_total = per_class_accuracy(fp32_model, loader)
+    int8_acc, int8_total = per_class_accuracy(int8_model, loader)
+
+    print("\n" + "=" * 56)
+    print("各类别准确率对比（注意：校准与评估均使用验证集）")
+    print("=" * 56)
+    print(f"{'类别':<18s}{'fp32':>10s}{'INT8':>10s}{'差值':>10s}")
+    for name, a, b in zip(class_names, fp32_acc, int8_acc):
+        print(f"{name:<18s}{a:>10.4f}{b:>10.4f}{b - a:>+10.4f}")
+    print(f"{'总体':<18s}{fp32_total:>10.4f}{int8_total:>10.4f}{int8_total - fp32_total:>+10.4f}")
+
+    print("\n" + "=" * 56)
+    print("延迟与模型大小")
+    print("=" * 56)
+    for batch_size in (1, args.batch_size):
+        fp32_ms = measure_latency(fp32_model, batch_size)
+        int8_ms = measure_latency(int8_model, batch_size)
+        print(f"batch={batch_size:<3d} fp32: {fp32_ms:8.2f} ms  INT8: {int8_ms:8.2f} ms  "
+              f"加速 {fp32_ms / int8_ms:.2f}x")
+    fp32_size = os.path.getsize(args.model) / 1024 / 1024
+    int8_size = os.path.getsize(args.output) / 1024 / 1024
+    print(f"模型大小  fp32: {fp32_size:.1f} MB  INT8: {int8_size:.1f} MB  缩小 {fp32_size / int8_size:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
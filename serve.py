@@ -0,0 +1,423 @@
+"""
+动态微批处理推理服务（与 Streamlit 界面并行运行）
+
+Streamlit 的每次上传都同步地对单张图片调用 predict，无法同时服务多个检测工位。
+本服务基于标准库 http.server，复用 model_utils 中的模型定义：
+- POST /predict   请求体为图片原始字节，返回 JSON（类别、置信度、概率向量）
+- GET  /stats     延迟 p50/p99、吞吐量和实际批次大小分布
+- GET  /healthz   模型加载并预热完成后返回 200，之前返回 503（/predict 同样返回 503）
+- GET  /metrics   分阶段耗时直方图（Prometheus 文本格式，需 --metrics 开启）
+
+并发请求先在处理线程中完成解码和预处理，然后进入队列；
+后台批处理线程从第一个请求到达起最多等待 max_wait_ms，或攒满 max_batch_size 后立即整批推理。
+端口在启动时立即打开，模型在后台线程中加载并预热（见 startup.py），负载均衡器以 /healthz 判断是否可以转发请求。
+
+用法：
+    python serve.py --port 8600 --max-batch-size 16 --max-wait-ms 5
+    python serve.py --bench --concurrency 32 --sweep 1,4,8,16,32    # 本地压测，对比不同批次上限
+    curl --data-binary @data/validation/images/crazing/crazing_1.jpg http://localhost:8600/predict
+"""
+
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from PIL import Image
+
+from metrics import attach_layer_hooks, metrics
+from startup import StartupTimer, mark_ready, warmup
+from model_utils import MODEL_PATH, MODEL_PRECISION, infer_backend, load_model, preprocess_image, with_precision
+from batch_predict import prediction_record
+
+MAX_BODY_BYTES = 16 * 2 ** 20  # 单张图片请求体上限，NEU-DET 原图只有几十 KB
+
+
+# ============================================
+# 1. 延迟与吞吐统计
+# ============================================
+def percentile(sorted_values, q):
+    """已排序列表的分位数（最近秩法）"""
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+
+class LatencyStats:
+    """记录最近 window 个请求的端到端延迟，以及累计请求数和批次大小分布"""
+
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = Counter()
+        self.completed = 0
+        self.started = None
+        self.lock = threading.Lock()
+
+    def record_batch(self, latencies):
+        with self.lock:
+            now = time.perf_counter()
+            if self.started is None:
+                self.started = now - max(latencies)
+            self.latencies.extend(latencies)
+            self.batch_sizes[len(latencies)] += 1
+            self.completed += len(latencies)
+
+    def summary(self):
+        with self.lock:
+            values = sorted(self.latencies)
+            elapsed = time.perf_counter() - self.started if self.started else 0.0
+            batches = sum(self.batch_sizes.values())
+            return {
+                'completed': self.completed,
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2),
+                'throughput': round(self.completed / elapsed, 1) if elapsed else 0.0,
+                'mean_batch_size': round(self.completed / batches, 2) if batches else 0.0,
+                'batch_sizes': dict(sorted(self.batch_sizes.items())),
+            }
+
+
+# ============================================
+# 2. 动态微批处理
+# ============================================
+class MicroBatcher:
+    """
+    把并发提交的单张图片张量合并为批次推理
+    一个批次在攒满 max_batch_size，或距第一个请求入队超过 max_wait_ms 时立即执行
+    """
+
+    def __init__(self, model, max_batch_size=16, max_wait_ms=5.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.stats = LatencyStats()
+        self._running = True
+        self._closed = False
+        self._submit_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, tensor, arrived=None):
+        """提交一张预处理好的图片 [C,H,W]，返回 Future，结果为概率向量（list）"""
+        future = Future()
+        with self._submit_lock:
+            if self._closed:
+                future.set_exception(RuntimeError('推理服务正在停止'))
+            else:
+                self.queue.put((tensor, future, arrived or time.perf_counter()))
+        return future
+
+    def close(self):
+        """停止批处理线程；已入队但尚未执行的请求以异常结束，不会让等待方一直挂起"""
+        with self._submit_lock:
+            self._closed = True
+            self._running = False
+            self.queue.put(None)
+        self._thread.join()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError('推理服务正在停止'))
+
+    def _collect(self):
+        """阻塞等待第一个请求，然后在截止时间前尽量攒满一个批次"""
+        first = self.queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._running = False
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while self._running:
+            batch = self._collect()
+            if not batch:
+                continue
+            tensors, futures, arrivals = zip(*batch)
+            try:
+                with torch.inference_mode():
+                    with metrics.stage('forward'):
+                        logits = self.model(torch.stack(tensors))
+                    with metrics.stage('softmax'):
+                        probabilities = torch.softmax(logits, dim=1).tolist()
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            done = time.perf_counter()
+            self.stats.record_batch([done - t for t in arrivals])
+            for future, probs in zip(futures, probabilities):
+                future.set_result((probs, len(batch)))
+
+
+# ============================================
+# 3. HTTP 服务
+# ============================================
+class InferenceHandler(BaseHTTPRequestHandler):
+    server_version = 'DefectInference/1.0'
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/healthz':
+            if self.server.ready.is_set():
+                self._send_json(200, {'status': 'ok', 'startup': self.server.startup})
+            elif self.server.load_error:
+                self._send_json(500, {'status': 'error', 'error': self.server.load_error})
+            else:
+                self._send_json(503, {'status': 'warming'})
+        elif self.path == '/stats':
+            self._send_json(200, self.server.batcher.stats.summary())
+        elif self.path == '/metrics':
+            body = metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'not found'})
+            return
+        if not self.server.ready.is_set():
+            self._send_json(503, {'error': '模型正在加载预热，请稍后重试'})
+            return
+        arrived = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self._send_json(400, {'error': 'Content-Length 不是有效的整数'})
+            return
+        if length <= 0:
+            self._send_json(400, {'error': '请求体为空，请以原始字节上传图片'})
+            return
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {'error': f'请求体超过上限 {MAX_BODY_BYTES // 2 ** 20} MB'})
+            return
+        try:
+            with Image.open(io.BytesIO(self.rfile.read(length))) as image, metrics.stage('preprocess'):
+                tensor = preprocess_image(image, self.server.input_mode)[0]
+        except Exception as e:
+            self._send_json(400, {'error': f'无法解码图片: {e}'})
+            return
+        try:
+            probs, batch_size = self.server.batcher.submit(tensor, arrived).result(timeout=30)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        record = prediction_record(probs)
+        record['batch_size'] = batch_size
+        record['latency_ms'] = round((time.perf_counter() - arrived) * 1000, 2)
+        self._send_json(200, record)
+
+    def log_message(self, format, *args):
+        # 高并发时逐请求打印日志的开销不可忽略，统计信息请查看 /stats
+        pass
+
+
+def create_server(model, host='0.0.0.0', port=8600, max_batch_size=16, max_wait_ms=5.0, input_mode='rgb', sock=None):
+    """
+    model 为 None 时服务先以未就绪状态启动，由 load_in_background 加载模型后再就绪
+    sock 为已在监听的套接字时直接使用，不再绑定端口（多个工作进程共享同一端口，见 serve_workers.py）
+    """
+    server = ThreadingHTTPServer((host, port), InferenceHandler, bind_and_activate=sock is None)
+    if sock is not None:
+        server.socket.close()
+        # 多个进程同时被唤醒时只有一个能 accept 成功，非阻塞套接字让其余进程直接回到事件循环
+        sock.setblocking(False)
+        server.socket = sock
+        server.server_address = sock.getsockname()
+    server.daemon_threads = True
+    server.batcher = MicroBatcher(model, max_batch_size, max_wait_ms)
+    server.input_mode = input_mode
+    server.ready = threading.Event()
+    server.startup = {}
+    server.load_error = None
+    if model is not None:
+        server.ready.set()
+    return server
+
+
+def load_in_background(server, build, ready_file=None):
+    """在后台线程中构建模型（build 为无参函数）并预热，完成后才把服务标记为就绪"""
+    timer = StartupTimer()
+
+    def run():
+        try:
+            with timer.phase('load'):
+                model = build()
+            with timer.phase('warmup'):
+                warmup(model, server.input_mode)
+        except Exception as e:
+            server.load_error = str(e)
+            print(f"❌ 模型加载失败: {e}")
+            return
+        server.batcher.model = model
+        server.startup = timer.summary()
+        server.ready.set()
+        if ready_file:
+            mark_ready({'startup': server.startup}, ready_file)
+        print(f"✅ 模型已就绪（{timer}）")
+
+    thread = threading.Thread(target=run, name='model-loader', daemon=True)
+    thread.start()
+    return thread
+
+
+# ============================================
+# 4. 本地压测
+# ============================================
+def run_load(url, payloads, num_requests, concurrency):
+    """
+    用 concurrency 个并发客户端发送 num_requests 个请求，返回客户端侧延迟列表和总耗时
+    url 也可以是地址列表，请求按轮询分配到各地址
+    """
+    import urllib.request
+
+    urls = [url] if isinstance(url, str) else list(url)
+
+    def send(i):
+        data = payloads[i % len(payloads)]
+        start = time.perf_counter()
+        req = urllib.request.Request(urls[i % len(urls)], data=data,
+                                     headers={'Content-Type': 'application/octet-stream'})
+        with urllib.request.urlopen(req) as resp:
+            resp.read()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(send, range(num_requests)))
+    return sorted(latencies), time.perf_counter() - start
+
+
+def bench(model, batch_sizes, max_wait_ms, concurrency, num_requests, input_mode='rgb'):
+    """对每个批次上限启动一次服务并压测，打印延迟与吞吐对比表"""
+    import glob
+
+    files = sorted(glob.glob('data/validation/images/*/*.jpg'))[:64]
+    payloads = [open(f, 'rb').read() for f in files]
+
+    print(f"并发数: {concurrency}，请求数: {num_requests}，最长等待: {max_wait_ms}ms")
+    print("=" * 66)
+    print(f"{'批次上限':>8s}{'平均批次':>10s}{'p50(ms)':>10s}{'p99(ms)':>10s}{'吞吐(张/秒)':>14s}")
+    print("=" * 66)
+    for max_batch_size in batch_sizes:
+        server = create_server(model, '127.0.0.1', 0, max_batch_size, max_wait_ms, input_mode)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = f'http://127.0.0.1:{server.server_address[1]}/predict'
+        # 预热
+        run_load(url, payloads, concurrency, concurrency)
+        server.batcher.stats = LatencyStats()
+        latencies, elapsed = run_load(url, payloads, num_requests, concurrency)
+        stats = server.batcher.stats.summary()
+        print(f"{max_batch_size:>8d}{stats['mean_batch_size']:>10.2f}"
+              f"{percentile(latencies, 50) * 1000:>10.1f}{percentile(latencies, 99) * 1000:>10.1f}"
+              f"{num_requests / elapsed:>14.1f}")
+        server.shutdown()
+        server.batcher.close()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='动态微批处理推理服务')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址')
+    parser.add_argument('--port', type=int, default=8600, help='监听端口')
+    parser.add_argument('--model', default=MODEL_PATH, help='模型文件路径')
+    parser.add_argument('--max-batch-size', type=int, default=16, help='单个批次的最大图片数')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='批次从第一个请求起的最长等待时间（毫秒）')
+    parser.add_argument('--gray', action='store_true', help='使用单通道快速推理路径')
+    parser.add_argument('--backend', default=None, choices=['eager', 'torchscript', 'onnx'],
+                        help='推理后端（默认按模型文件扩展名推断，torchscript/onnx 需先运行 export.py）')
+    parser.add_argument('--optimize', action='store_true',
+                        help='折叠 BN、融合 ReLU 并使用 channels_last 布局（见 optimize.py，仅 eager 后端）')
+    parser.add_argument('--threads', type=int, default=None, help='推理使用的 CPU 线程数')
+    parser.add_argument('--precision', default=MODEL_PRECISION, choices=['fp32', 'bf16'],
+                        help='推理精度：bf16 以 bfloat16 autocast 计算卷积和全连接，softmax 仍为 float32')
+    parser.add_argument('--metrics', action='store_true', help='开启分阶段计时，通过 GET /metrics 导出')
+    parser.add_argument('--layer-hooks', action='store_true', help='同时记录逐层前向耗时（仅 eager 后端，隐含 --metrics）')
+    parser.add_argument('--ready-file', default=None, help='模型预热完成后写入的就绪标记文件（供外部进程轮询）')
+    parser.add_argument('--bench', action='store_true', help='本地压测模式')
+    parser.add_argument('--sweep', default='1,4,8,16,32', help='压测时依次尝试的批次上限（逗号分隔）')
+    parser.add_argument('--concurrency', type=int, default=32, help='压测并发客户端数')
+    parser.add_argument('--requests', type=int, default=1000, help='压测请求总数')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    input_mode = 'gray' if args.gray else 'rgb'
+    backend = args.backend or infer_backend(args.model)
+    if args.precision == 'bf16' and backend == 'onnx':
+        parser.error('onnx 后端只支持 fp32 推理')
+    if args.optimize and backend != 'eager':
+        parser.error(f'--optimize 只支持 eager 后端，当前为 {backend}')
+    if args.layer_hooks and (backend != 'eager' or args.optimize):
+        # 逐层钩子要访问 layer1..layer4 子模块，TorchScript 冻结后的模型没有这些属性
+        parser.error('--layer-hooks 只支持未经 --optimize 的 eager 后端')
+    if args.metrics or args.layer_hooks:
+        metrics.enable()
+
+    def build():
+        model = load_model(args.model, input_mode=input_mode, backend=args.backend, precision='fp32')
+        if args.optimize:
+            from optimize import build_optimized_model
+            model = build_optimized_model(model)
+        if args.layer_hooks:
+            attach_layer_hooks(model)
+        # 精度包装放在最后，优化和逐层钩子都作用在原模型上
+        return with_precision(model, args.precision)
+
+    if args.bench:
+        model = build()
+        warmup(model, input_mode)
+        batch_sizes = [int(x) for x in args.sweep.split(',')]
+        bench(model, batch_sizes, args.max_wait_ms, args.concurrency, args.requests, input_mode)
+        return
+
+    # 先打开端口，模型在后台加载预热；就绪前 /healthz 返回 503
+    server = create_server(None, args.host, args.port, args.max_batch_size, args.max_wait_ms, input_mode)
+    load_in_background(server, build, args.ready_file)
+    print(f"🚀 推理服务已启动: http://{args.host}:{args.port}  "
+          f"(max_batch_size={args.max_batch_size}, max_wait_ms={args.max_wait_ms})，模型加载预热中...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⏹️ 正在停止服务...")
+    finally:
+        server.batcher.close()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
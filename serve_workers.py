@@ -0,0 +1,286 @@
+"""
+多进程推理服务：各工作进程共享同一份模型权重
+
+在一台机器上横向扩展时，如果每个工作进程各自读取 best_model.pth，内存中就有 N 份 ResNet18 权重。
+本脚本复用 serve.py 的微批处理 HTTP 服务，父进程打开监听端口后 fork 出 N 个工作进程共同 accept：
+- shm（默认）：父进程加载一次模型，把参数和缓冲区移入共享内存（share_memory_），fork 后各进程读取同一批物理页；
+- mmap：各工作进程自行以内存映射方式加载同一个权重文件（model_utils.load_model），页缓存由内核共享；
+- copy：各工作进程随机初始化网络后复制完整读入的 state_dict，权重各自一份。
+每个工作进程有自己的线程预算（默认 CPU 核数 / 进程数），并绑定到互不重叠的 CPU 核上（Linux）。
+
+--bench 先启动 N 个相互独立的进程（新的解释器，各自导入 torch 并完整读入权重，即不做任何共享的基准），
+再依次以三种 fork 方式启动 N 个工作进程并压测，报告每个进程的 RSS / PSS / 私有内存（USS）和总吞吐。
+fork 出的工作进程在三种方式下都共享父进程已导入的 torch 运行时页面，copy 与 mmap / shm 的差值只是权重部分，
+与独立进程基准的差值才是实际部署时的总节省。
+RSS 会把共享页重复计入每个进程，PSS 按共享进程数分摊，更能反映实际节省的内存。
+
+用法（需要 os.fork，仅 Linux / macOS）：
+    python serve_workers.py --workers 4 --port 8600
+    python serve_workers.py --workers 4 --bench --concurrency 32 --requests 2000
+"""
+
+import argparse
+import glob
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+
+import torch
+
+from model_utils import MODEL_PATH, MODEL_PRECISION, load_model, with_precision
+from serve import create_server, percentile, run_load
+from startup import load_full_copy, warmup
+
+SHARE_MODES = ('copy', 'mmap', 'shm')
+
+
+# ============================================
+# 1. 加载与共享权重
+# ============================================
+def load_for_mode(mode, model_path=MODEL_PATH, input_mode='rgb', precision='fp32'):
+    if mode == 'copy':
+        model = load_full_copy(model_path, input_mode)
+    else:
+        model = load_model(model_path, input_mode=input_mode, backend='eager', precision='fp32')
+    return with_precision(model, precision)
+
+
+def share_model(model):
+    """把参数和缓冲区移入共享内存，fork 后的子进程直接映射同一批页"""
+    return model.share_memory()
+
+
+def pin_worker(index, threads):
+    """第 index 个工作进程使用 threads 个线程，并绑定到对应的一段 CPU 核（核数不足时循环复用）"""
+    torch.set_num_threads(threads)
+    if not hasattr(os, 'sched_setaffinity'):
+        return
+    cpus = sorted(os.sched_getaffinity(0))
+    start = index * threads % len(cpus)
+    os.sched_setaffinity(0, [cpus[(start + i) % len(cpus)] for i in range(min(threads, len(cpus)))])
+
+
+def free_port():
+    with socket.create_server(('127.0.0.1', 0)) as sock:
+        return sock.getsockname()[1]
+
+
+def memory_usage(pid):
+    """读取 /proc/<pid>/smaps_rollup，返回 {'rss', 'pss', 'uss'}（MB）；非 Linux 返回 None"""
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024
+    except OSError:
+        return None
+    return {'rss': fields.get('Rss', 0.0), 'pss': fields.get('Pss', 0.0),
+            'uss': fields.get('Private_Clean', 0.0) + fields.get('Private_Dirty', 0.0)}
+
+
+# ============================================
+# 2. 工作进程
+# ============================================
+def worker_main(index, sock, model, args, input_mode, ready_fd):
+    """子进程入口：固定线程预算、（按需）加载模型、预热，然后在共享的监听套接字上提供服务"""
+    pin_worker(index, args.threads)
+    if model is None:
+        model = load_for_mode(args.share, args.model, input_mode, args.precision)
+    warmup(model, input_mode)
+    server = create_server(model, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                           input_mode=input_mode, sock=sock)
+    os.write(ready_fd, b'.')
+    os.close(ready_fd)
+    server.serve_forever()
+
+
+def start_workers(sock, args, input_mode):
+    """fork args.workers 个工作进程，等待全部预热完成后返回 pid 列表"""
+    model = None
+    if args.share == 'shm':
+        # 父进程只加载不推理：fork 前不初始化 OpenMP 线程池，子进程再各自设置线程数
+        torch.set_num_threads(1)
+        model = share_model(load_for_mode('mmap', args.model, input_mode, args.precision))
+
+    ready_r, ready_w = os.pipe()
+    pids = []
+    for index in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 0
+            try:
+                worker_main(index, sock, model, args, input_mode, ready_w)
+            except KeyboardInterrupt:
+                pass
+            except Exception:
+                # fork 出的子进程不能回到父进程的调用栈：打印错误后以非零状态直接退出
+                traceback.print_exc()
+                sys.stderr.flush()
+                code = 1
+            finally:
+                os._exit(code)
+        pids.append(pid)
+    os.close(ready_w)
+
+    wait_workers(ready_r, pids)
+    return pids
+
+
+def start_processes(args, input_mode):
+    """
+    基准：以 --standalone 启动 args.workers 个全新的解释器，各自导入 torch、完整读入权重并监听自己的端口
+    （与 fork 出的工作进程不共享任何页面），预热完成后返回 (pid 列表, URL 列表)
+    """
+    ready_r, ready_w = os.pipe()
+    pids, urls = [], []
+    for index in range(args.workers):
+        port = free_port()
+        cmd = [sys.executable, os.path.abspath(__file__), '--standalone', str(index), '--ready-fd', str(ready_w),
+               '--port', str(port), '--model', args.model, '--threads', str(args.threads),
+               '--max-batch-size', str(args.max_batch_size), '--max-wait-ms', str(args.max_wait_ms),
+               '--precision', args.precision]
+        if input_mode == 'gray':
+            cmd.append('--gray')
+        pids.append(subprocess.Popen(cmd, pass_fds=[ready_w]).pid)
+        urls.append(f'http://127.0.0.1:{port}/predict')
+    os.close(ready_w)
+    wait_workers(ready_r, pids)
+    return pids, urls
+
+
+def wait_workers(ready_r, pids):
+    """每个工作进程预热完成后向管道写入一个字节；有进程提前退出（管道关闭）时停止全部进程并报错"""
+    ready = 0
+    while ready < len(pids):
+        chunk = os.read(ready_r, len(pids))
+        if not chunk:
+            stop_workers(pids)
+            raise RuntimeError('工作进程在预热完成前退出（错误信息见上方输出）')
+        ready += len(chunk)
+    os.close(ready_r)
+
+
+def stop_workers(pids):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in pids:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+
+# ============================================
+# 3. 内存与吞吐对比
+# ============================================
+def bench(args, input_mode):
+    files = sorted(glob.glob('data/validation/images/*/*.jpg'))[:64]
+    payloads = [open(f, 'rb').read() for f in files]
+    print(f"{args.workers} 个工作进程，每个 {args.threads} 线程；并发数 {args.concurrency}，请求数 {args.requests}")
+
+    rows = {}
+    for mode in ('process', *SHARE_MODES):
+        sock = None
+        if mode == 'process':
+            pids, urls = start_processes(args, input_mode)
+        else:
+            args.share = mode
+            sock = socket.create_server(('127.0.0.1', 0), backlog=128)
+            pids = start_workers(sock, args, input_mode)
+            urls = [f'http://127.0.0.1:{sock.getsockname()[1]}/predict']
+        try:
+            run_load(urls, payloads, args.concurrency, args.concurrency)
+            latencies, elapsed = run_load(urls, payloads, args.requests, args.concurrency)
+            usage = [memory_usage(pid) for pid in pids]
+        finally:
+            stop_workers(pids)
+            if sock is not None:
+                sock.close()
+        row = {'throughput': args.requests / elapsed, 'p50': percentile(latencies, 50) * 1000,
+               'p99': percentile(latencies, 99) * 1000}
+        if all(usage):
+            for key in ('rss', 'pss', 'uss'):
+                row[key] = sum(u[key] for u in usage) / len(usage)
+        rows[mode] = row
+
+    print("=" * 99)
+    print(f"{'方式':>9s}{'RSS/进程(MB)':>14s}{'PSS/进程(MB)':>14s}{'USS/进程(MB)':>14s}{'PSS 合计(MB)':>14s}"
+          f"{'p50(ms)':>10s}{'p99(ms)':>10s}{'吞吐(张/秒)':>14s}")
+    print("=" * 99)
+    for mode, row in rows.items():
+        memory = (f"{row['rss']:>14.1f}{row['pss']:>14.1f}{row['uss']:>14.1f}{row['pss'] * args.workers:>14.1f}"
+                  if 'pss' in row else f"{'-':>14s}" * 4)
+        print(f"{mode:>9s}{memory}{row['p50']:>10.1f}{row['p99']:>10.1f}{row['throughput']:>14.1f}")
+    print("process 为独立启动的进程；copy / mmap / shm 为 fork 出的工作进程，三者都共享父进程的 torch 运行时页面")
+    if 'pss' in rows['process']:
+        for mode in SHARE_MODES:
+            saved = rows['process']['pss'] - rows[mode]['pss']
+            print(f"{mode} 相对独立进程：每个进程节省 PSS {saved:.1f} MB，{args.workers} 个进程共节省 "
+                  f"{saved * args.workers:.1f} MB，吞吐 {rows[mode]['throughput'] / rows['process']['throughput']:.2f}x")
+        for mode in ('mmap', 'shm'):
+            print(f"{mode} 相对 copy（仅权重部分）：每个进程节省 PSS {rows['copy']['pss'] - rows[mode]['pss']:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程推理服务（共享模型权重）')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址')
+    parser.add_argument('--port', type=int, default=8600, help='监听端口')
+    parser.add_argument('--model', default=MODEL_PATH, help='模型文件路径（.pth）')
+    parser.add_argument('--workers', type=int, default=4, help='工作进程数')
+    parser.add_argument('--threads', type=int, default=None, help='每个工作进程的 CPU 线程数（默认 核数 / 进程数）')
+    parser.add_argument('--share', default='shm', choices=SHARE_MODES,
+                        help='权重共享方式：shm 父进程加载后放入共享内存；mmap 各进程映射同一文件；copy 各自完整加载')
+    parser.add_argument('--max-batch-size', type=int, default=16, help='单个批次的最大图片数')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='批次从第一个请求起的最长等待时间（毫秒）')
+    parser.add_argument('--gray', action='store_true', help='使用单通道快速推理路径')
+    parser.add_argument('--precision', default=MODEL_PRECISION, choices=['fp32', 'bf16'], help='推理精度')
+    parser.add_argument('--bench', action='store_true', help='依次以独立进程 / copy / mmap / shm 方式压测并对比内存与吞吐')
+    parser.add_argument('--concurrency', type=int, default=32, help='压测并发客户端数')
+    parser.add_argument('--requests', type=int, default=1000, help='压测请求总数')
+    parser.add_argument('--standalone', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--ready-fd', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    input_mode = 'gray' if args.gray else 'rgb'
+    if args.standalone is not None:
+        # --bench 的独立进程基准：完整读入权重，在自己的端口上提供服务
+        args.share = 'copy'
+        sock = socket.create_server(('127.0.0.1', args.port), backlog=128)
+        worker_main(args.standalone, sock, None, args, input_mode, args.ready_fd)
+        return
+    if not hasattr(os, 'fork'):
+        parser.error('多进程共享模式需要 os.fork（Linux / macOS）')
+    args.threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    if args.bench:
+        bench(args, input_mode)
+        return
+
+    sock = socket.create_server((args.host, args.port), backlog=128)
+    start = time.perf_counter()
+    pids = start_workers(sock, args, input_mode)
+    print(f"🚀 推理服务已启动: http://{args.host}:{args.port}  ({args.workers} 个工作进程 × {args.threads} 线程，"
+          f"权重共享方式 {args.share}，启动耗时 {time.perf_counter() - start:.1f}s)")
+    try:
+        while pids:
+            pid, _ = os.wait()
+            pids.remove(pid)
+            print(f"⚠️ 工作进程 {pid} 已退出，剩余 {len(pids)} 个")
+    except KeyboardInterrupt:
+        print("\n⏹️ 正在停止服务...")
+    finally:
+        stop_workers(pids)
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
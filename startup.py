@@ -0,0 +1,204 @@
+"""
+快速冷启动：分阶段计时、模型预热与就绪标记
+
+冷启动的耗时主要来自三部分：导入 torch / torchvision、读取并构建模型、第一次前向（oneDNN 初始化和内存分配）。
+- 导入：app.py 只在加载模型时才导入 model_utils（以及 torch），页面框架先渲染出来；
+- 加载：model_utils.load_model 以内存映射方式读取权重（torch.load(mmap=True)），在 meta 设备上构建网络结构
+  并直接引用映射的张量，不做随机初始化和整份复制；
+- 预热：加载后立即用一张全零图片做一次前向，第一个真实请求不再承担初始化开销；
+- 就绪：预热完成后写入就绪标记文件（路径由 DEFECT_READY_FILE 指定），launcher.py 轮询该文件，
+  serve.py 的 GET /healthz 在预热完成前返回 503。
+
+本模块顶层只导入标准库，torch 在函数内部按需导入。
+
+用法：
+    python startup.py                   # 冷启动基准：对比完整读取 / 内存映射 + 预热两种方式的各阶段耗时
+    python startup.py --runs 5 --gray
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+READY_FILE = os.environ.get('DEFECT_READY_FILE') or os.path.join(tempfile.gettempdir(), 'defect_app.ready')
+PHASES = ('import', 'load', 'warmup', 'first_request', 'second_request')
+
+
+# ============================================
+# 1. 分阶段计时
+# ============================================
+class StartupTimer:
+    """按阶段记录耗时（秒）"""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def summary(self):
+        return {name: round(seconds, 4) for name, seconds in self.phases.items()}
+
+    def __str__(self):
+        return '，'.join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+
+
+# ============================================
+# 2. 预热与就绪标记
+# ============================================
+def warmup(model, input_mode='rgb', iters=1):
+    """用全零图片做 iters 次前向，触发算子初始化和内存分配"""
+    import torch
+
+    dummy = torch.zeros(1, 1 if input_mode == 'gray' else 3, 224, 224)
+    with torch.inference_mode():
+        for _ in range(iters):
+            model(dummy)
+
+
+def load_warm_model(model_path=None, input_mode='rgb', timer=None, **kwargs):
+    """导入、加载并预热模型，各阶段耗时记录在 timer 中；kwargs 透传给 model_utils.load_model"""
+    timer = timer or StartupTimer()
+    with timer.phase('import'):
+        import model_utils
+    with timer.phase('load'):
+        model = model_utils.load_model(model_path or model_utils.MODEL_PATH, input_mode=input_mode, **kwargs)
+    with timer.phase('warmup'):
+        warmup(model, input_mode)
+    return model
+
+
+def mark_ready(info=None, path=READY_FILE):
+    """原子地写入就绪标记（先写临时文件再替换），内容为 JSON"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'pid': os.getpid(), 'time': time.time(), **(info or {})}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def clear_ready(path=READY_FILE):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def wait_ready(path=READY_FILE, timeout=120, poll=0.2, process=None):
+    """轮询就绪标记，返回其内容；超时或 process 提前退出时返回 None"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        if process is not None and process.poll() is not None:
+            return None
+        time.sleep(poll)
+    return None
+
+
+# ============================================
+# 3. 冷启动基准（每次运行都在新的子进程中进行）
+# ============================================
+def load_full_copy(model_path, input_mode='rgb'):
+    """优化前的加载方式：随机初始化整个网络，再把完整读入内存的 state_dict 复制进去"""
+    import torch
+    from model_utils import build_model
+
+    model = build_model(pretrained=False)
+    model.load_state_dict(torch.load(model_path, map_location='cpu'))
+    model.eval()
+    if input_mode == 'gray':
+        from grayscale import fold_grayscale
+        model = fold_grayscale(model)
+    return model
+
+
+def sample_image():
+    """取验证集第一张图片；没有数据集时用一张随机灰度图代替"""
+    import glob
+    from PIL import Image
+
+    files = sorted(glob.glob('data/validation/images/*/*.jpg'))
+    if files:
+        return Image.open(files[0]).convert('RGB')
+    return Image.effect_noise((200, 200), 64).convert('RGB')
+
+
+def measure_child(mode, model_path, input_mode):
+    """子进程入口：按 mode 冷启动一次，返回各阶段耗时"""
+    timer = StartupTimer()
+    if mode == 'fast':
+        model = load_warm_model(model_path, input_mode, timer, backend='eager', precision='fp32')
+    else:
+        with timer.phase('import'):
+            import model_utils  # noqa: F401
+        with timer.phase('load'):
+            model = load_full_copy(model_path, input_mode)
+        timer.phases['warmup'] = 0.0
+    from model_utils import predict
+    image = sample_image()
+    for name in ('first_request', 'second_request'):
+        with timer.phase(name):
+            predict(image, model, input_mode)
+    return timer.summary()
+
+
+def run_child(mode, model_path, input_mode):
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', mode, '--model', model_path]
+    if input_mode == 'gray':
+        cmd.append('--gray')
+    start = time.perf_counter()
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process'] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description='冷启动基准：导入 / 加载 / 预热 / 首个请求耗时')
+    parser.add_argument('--model', default=os.environ.get('DEFECT_MODEL_PATH', 'best_model.pth'),
+                        help='模型文件路径（.pth）')
+    parser.add_argument('--gray', action='store_true', help='使用单通道快速推理路径')
+    parser.add_argument('--runs', type=int, default=3, help='每种方式的冷启动次数（取中位数）')
+    parser.add_argument('--child', default=None, choices=['baseline', 'fast'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    input_mode = 'gray' if args.gray else 'rgb'
+    if args.child:
+        print(json.dumps(measure_child(args.child, args.model, input_mode)))
+        return
+
+    labels = {'baseline': '完整读取，无预热', 'fast': '内存映射 + 预热'}
+    results = {}
+    for mode in labels:
+        runs = [run_child(mode, args.model, input_mode) for _ in range(args.runs)]
+        results[mode] = {name: median([r[name] for r in runs]) for name in (*PHASES, 'process')}
+
+    print(f"冷启动耗时（{args.runs} 次中位数，单位 ms，input_mode={input_mode}）")
+    print("=" * 100)
+    print(f"{'方式':<20s}{'导入':>10s}{'加载':>10s}{'预热':>10s}{'首个请求':>12s}{'第二个请求':>12s}"
+          f"{'到首个结果':>12s}{'进程总耗时':>12s}")
+    print("=" * 100)
+    for mode, r in results.items():
+        to_first = r['import'] + r['load'] + r['warmup'] + r['first_request']
+        print(f"{labels[mode]:<20s}{r['import'] * 1000:>10.1f}{r['load'] * 1000:>10.1f}{r['warmup'] * 1000:>10.1f}"
+              f"{r['first_request'] * 1000:>12.1f}{r['second_request'] * 1000:>12.1f}"
+              f"{to_first * 1000:>12.1f}{r['process'] * 1000:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
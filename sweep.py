@@ -0,0 +1,172 @@
+"""
+全连接层超参数并行搜索
+
+train.py 中 lr=0.001、momentum=0.9、15 个 epoch 和 256 维隐藏层都是写死的，调参只能改文件后从头重训。
+本脚本在 feature_cache.py 的主干特征缓存上搜索全连接层的超参数：
+- 搜索空间：优化器、学习率、隐藏层维度、epoch 数、Batch Size，支持网格搜索和随机搜索；
+- 特征缓存只加载一次并放入共享内存，进程池中的各个试验只读共享同一份数据，每个进程单线程运行；
+- 提前停止：验证集准确率连续 patience 个 epoch 没有提升，或过了预热期仍明显落后于当前全局最优的试验立即结束；
+- 所有试验按验证集准确率排序写入排行榜文件，可选把最佳配置保存为完整模型。
+
+用法：
+    python sweep.py                                             # 默认网格
+    python sweep.py --mode random --trials 60 --workers 8
+    python sweep.py --lrs 1e-3,3e-3 --hidden-sizes 128,256 --save-best best_model_sweep.pth
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import time
+
+import torch
+import torch.multiprocessing as mp
+
+from feature_cache import load_or_build_cache, save_full_model, train_head
+
+LEADERBOARD_PATH = 'sweep_leaderboard.json'
+
+# 子进程中的共享状态（由进程池 initializer 设置）
+_caches = None
+_global_best = None
+
+
+# ============================================
+# 1. 搜索空间
+# ============================================
+def parse_list(text, cast):
+    return [cast(v) for v in text.split(',') if v]
+
+
+def build_trials(space, mode='grid', num_trials=None, seed=0):
+    """网格搜索返回全部组合；随机搜索从组合中不重复地抽取 num_trials 个"""
+    keys = list(space)
+    grid = [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+    if mode == 'random' and num_trials and num_trials < len(grid):
+        grid = random.Random(seed).sample(grid, num_trials)
+    return grid
+
+
+# ============================================
+# 2. 试验进程
+# ============================================
+def _init_worker(caches, global_best):
+    global _caches, _global_best
+    _caches, _global_best = caches, global_best
+    # 每个试验单线程，靠进程数并行，避免线程超额订阅
+    torch.set_num_threads(1)
+
+
+def run_trial(trial_id, config, patience=4, warmup=3, margin=0.05, seed=42):
+    """在共享的特征缓存上训练一个配置，返回结果记录"""
+    state = {'best': 0.0, 'since_best': 0, 'reason': 'completed'}
+
+    def should_stop(epoch, val_acc):
+        if val_acc > state['best']:
+            state['best'], state['since_best'] = val_acc, 0
+        else:
+            state['since_best'] += 1
+        with _global_best.get_lock():
+            _global_best.value = max(_global_best.value, val_acc)
+            leader = _global_best.value
+        if state['since_best'] >= patience:
+            state['reason'] = 'plateau'
+            return True
+        if epoch + 1 >= warmup and state['best'] < leader - margin:
+            state['reason'] = 'hopeless'
+            return True
+        return False
+
+    start = time.perf_counter()
+    best_state, best_acc, history = train_head(
+        _caches, num_epochs=config['epochs'], batch_size=config['batch_size'], lr=config['lr'],
+        hidden_size=config['hidden_size'], seed=seed, verbose=False,
+        optimizer_name=config['optimizer'], should_stop=should_stop)
+    return {
+        'trial': trial_id,
+        **config,
+        'val_acc': round(best_acc, 6),
+        'best_epoch': history['val_acc'].index(max(history['val_acc'])) + 1,
+        'epochs_run': len(history['val_acc']),
+        'stopped': state['reason'],
+        'time': round(time.perf_counter() - start, 3),
+    }, best_state
+
+
+def print_leaderboard(results, top=10):
+    print(f"\n{'排名':>4s}{'优化器':>8s}{'学习率':>10s}{'隐藏层':>8s}{'Batch':>7s}{'Epochs':>8s}"
+          f"{'实际轮数':>10s}{'准确率':>10s}{'结束原因':>12s}")
+    print("=" * 84)
+    for rank, r in enumerate(results[:top], 1):
+        print(f"{rank:>4d}{r['optimizer']:>8s}{r['lr']:>10.0e}{r['hidden_size']:>8d}{r['batch_size']:>7d}"
+              f"{r['epochs']:>8d}{r['epochs_run']:>10d}{r['val_acc']:>10.4f}{r['stopped']:>12s}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='全连接层超参数并行搜索（基于特征缓存）')
+    parser.add_argument('--mode', default='grid', choices=['grid', 'random'], help='网格搜索或随机搜索')
+    parser.add_argument('--trials', type=int, default=40, help='随机搜索的试验数')
+    parser.add_argument('--optimizers', default='sgd,adam,adamw', help='优化器（逗号分隔）')
+    parser.add_argument('--lrs', default='3e-4,1e-3,3e-3,1e-2', help='学习率（逗号分隔）')
+    parser.add_argument('--hidden-sizes', default='128,256,512', help='隐藏层维度（逗号分隔）')
+    parser.add_argument('--epochs', default='15,30', help='最大 epoch 数（逗号分隔）')
+    parser.add_argument('--batch-sizes', default='16,64', help='Batch Size（逗号分隔）')
+    parser.add_argument('--patience', type=int, default=4, help='验证集准确率连续多少个 epoch 不提升即停止')
+    parser.add_argument('--warmup', type=int, default=3, help='预热 epoch 数，之后才与全局最优比较')
+    parser.add_argument('--margin', type=float, default=0.05, help='落后全局最优超过该值的试验视为无望并停止')
+    parser.add_argument('--workers', type=int, default=None, help='并行试验进程数（默认 CPU 核数）')
+    parser.add_argument('--cache-dir', default='./cache', help='特征缓存目录')
+    parser.add_argument('--views', type=int, default=5, help='训练集增强视图数 K')
+    parser.add_argument('--seed', type=int, default=0, help='随机搜索的抽样种子')
+    parser.add_argument('--output', default=LEADERBOARD_PATH, help='排行榜输出路径')
+    parser.add_argument('--save-best', default=None, help='把最佳配置保存为完整模型（如 best_model_sweep.pth）')
+    args = parser.parse_args()
+
+    space = {
+        'optimizer': parse_list(args.optimizers, str),
+        'lr': parse_list(args.lrs, float),
+        'hidden_size': parse_list(args.hidden_sizes, int),
+        'epochs': parse_list(args.epochs, int),
+        'batch_size': parse_list(args.batch_sizes, int),
+    }
+    trials = build_trials(space, args.mode, args.trials, args.seed)
+
+    caches = load_or_build_cache(args.cache_dir, args.views, torch.device('cpu'))
+    for cache in caches.values():
+        cache['features'].share_memory_()
+        cache['labels'].share_memory_()
+
+    workers = min(args.workers or os.cpu_count() or 1, len(trials))
+    print(f"共 {len(trials)} 个试验（{args.mode}），{workers} 个进程并行")
+    ctx = mp.get_context('spawn')
+    global_best = ctx.Value('d', 0.0)
+    start = time.perf_counter()
+    results, states = [], {}
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(caches, global_best)) as pool:
+        jobs = [(i, config, args.patience, args.warmup, args.margin) for i, config in enumerate(trials)]
+        for record, state in pool.starmap(run_trial, jobs, chunksize=1):
+            results.append(record)
+            states[record['trial']] = state
+    elapsed = time.perf_counter() - start
+
+    results.sort(key=lambda r: (-r['val_acc'], r['epochs_run']))
+    stopped = sum(r['stopped'] != 'completed' for r in results)
+    print_leaderboard(results)
+    print(f"\n总耗时 {elapsed:.1f}s，提前停止 {stopped}/{len(results)} 个试验")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'space': space, 'mode': args.mode, 'elapsed': round(elapsed, 2), 'results': results},
+                  f, indent=2, ensure_ascii=False)
+    print(f"💾 排行榜已写入 {args.output}")
+
+    if args.save_best:
+        best = results[0]
+        save_full_model(states[best['trial']], args.save_best, hidden_size=best['hidden_size'],
+                        num_classes=len(caches['train']['classes']))
+        print(f"💾 最佳配置已保存为 '{args.save_best}'（hidden_size={best['hidden_size']}）")
+
+
+if __name__ == '__main__':
+    main()
@@ -24,7 +24,7 @@ print("测试 ResNet 缺陷检测系统")
 print("="*50)
 
 # 1. 测试模型加载
-print("\n[1/3] 加载模型...")
+print("\n[1/4] 加载模型...")
 model = models.resnet18(pretrained=False)
 num_ftrs = model.fc.in_features
 model.fc = nn.Sequential(
@@ -43,7 +43,7 @@ else:
 model.eval()
 
 # 2. 测试图像预处理
-print("\n[2/3] 测试图像预处理...")
+print("\n[2/4] 测试图像预处理...")
 test_image_path = 'data/train/images/crazing/crazing_1.jpg'
 
 if os.path.exists(test_image_path):
@@ -65,7 +65,7 @@ else:
     exit(1)
 
 # 3. 测试模型推理
-print("\n[3/3] 测试模型推理...")
+print("\n[3/4] 测试模型推理...")
 with torch.no_grad():
     outputs = model(image_tensor)
     probabilities = torch.nn.functional.softmax(outputs[0], dim=0)
@@ -87,6 +87,21 @@ for i, class_name in enumerate(class_names):
     bar = '█' * int(prob / 5)
     print(f"{class_names_cn[class_name]:8s} ({class_name:15s}): {prob:6.2f}% {bar}")
 
+# 4. 测试单通道快速推理路径（与 RGB 路径一致性）
+print("\n[4/4] 测试单通道快速推理路径...")
+from grayscale import fold_grayscale, gray_preprocess
+
+gray_model = fold_grayscale(model)
+gray_tensor = gray_preprocess(Image.open(test_image_path)).unsqueeze(0)
+with torch.no_grad():
+    gray_outputs = gray_model(gray_tensor)
+
+max_diff = (gray_outputs - outputs).abs().max().item()
+if max_diff > 1e-3 or gray_outputs.argmax() != outputs.argmax():
+    print(f"❌ 单通道路径与 RGB 路径不一致，logits 最大误差: {max_diff:.2e}")
+    exit(1)
+print(f"✅ 单通道输入张量形状: {gray_tensor.shape}，与 RGB 路径 logits 最大误差: {max_diff:.2e}")
+
 print(f"\n{'='*50}")
 print("✅ 所有测试通过！系统运行正常。")
 print(f"{'='*50}")
@@ -0,0 +1,291 @@
+"""
+大幅面钢带图像的分块滑窗推理
+
+模型只对单个 200x200 小块（缩放到 256 后中心裁剪 224）分类，而产线相机采集的钢带图像远大于此。
+本脚本把大图切成相互重叠的分块，逐批送入分类器：
+- 分块批次由 numpy sliding_window_view 的跨步视图按索引取出，不为每个分块创建 PIL 图像；
+  缩放、裁剪和标准化在整批张量上完成，与验证集预处理等价；
+- 输出每个类别的缺陷热力图（重叠分块的概率取平均）和分块级检测结果（类别、置信度、像素框）；
+- 按行带（band）流式处理：输入为单通道 uint8 .npy，以内存映射方式打开，每次只读取覆盖若干行分块的像素，
+  内存占用与图像高度无关，可处理十亿像素级的长条图像。
+  PNG / JPEG 等格式无法按行带解码（PIL 会把整幅图像读入内存），需先转换为 .npy。
+
+--check 模式把验证集图片拼成一张大图，用标注 XML 中的 bndbox 检查分块检测结果。
+
+用法：
+    python tiled.py strip.npy -o detections.json --heatmap heatmap.npz
+    python tiled.py strip.npy --stride 100 --threshold 0.9 --gray --batch-size 64
+    python tiled.py --check --mosaic 6x10
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+from annotations import parse_annotation
+from model_utils import IMAGENET_MEAN, IMAGENET_STD, MODEL_PATH, class_names, data_dir, load_model, predict
+
+TILE_SIZE = 200   # NEU-DET 原始小块尺寸
+RESIZE = 256
+CROP = 224
+
+
+# ============================================
+# 1. 输入与分块位置
+# ============================================
+def open_strip(path):
+    """以内存映射方式打开单通道 uint8 .npy 大图，只有被访问的行会读入内存"""
+    if not path.endswith('.npy'):
+        raise ValueError(f"'{path}' 不是 .npy 文件：只有内存映射的 .npy 能按行带流式读取，"
+                         f"其他图片格式请先转换为单通道 uint8 .npy")
+    array = np.load(path, mmap_mode='r')
+    if array.ndim != 2 or array.dtype != np.uint8:
+        raise ValueError(f"'{path}' 需要是单通道 uint8 图像，实际为 {array.dtype} {array.shape}")
+    return array
+
+
+def tile_positions(length, tile, stride):
+    """一维分块起点；最后一个分块与边界对齐，保证整幅图像都被覆盖"""
+    if length < tile:
+        raise ValueError(f'图像尺寸 {length} 小于分块尺寸 {tile}')
+    positions = list(range(0, length - tile + 1, stride))
+    if positions[-1] != length - tile:
+        positions.append(length - tile)
+    return positions
+
+
+def iter_bands(array, ys, tile, band_rows):
+    """按行带产出 (起始分块行号, 行带像素, 该行带内各分块行的相对偏移)"""
+    for start in range(0, len(ys), band_rows):
+        rows = ys[start:start + band_rows]
+        # 行切片是视图：内存映射输入只有这一段会被读入
+        yield start, array[rows[0]:rows[-1] + tile], [y - rows[0] for y in rows]
+
+
+# ============================================
+# 2. 批量预处理与推理
+# ============================================
+def preprocess_tiles(tiles, input_mode='rgb'):
+    """
+    uint8 分块 [B,T,T] -> 模型输入，等价于验证集的 Resize(256) + CenterCrop(224) + ToTensor + Normalize
+    gray 模式不复制通道也不做标准化（已折叠进 conv1，见 grayscale.py）
+    """
+    x = torch.from_numpy(tiles).unsqueeze(1).float().div_(255)
+    x = F.interpolate(x, size=(RESIZE, RESIZE), mode='bilinear', align_corners=False, antialias=True)
+    offset = (RESIZE - CROP) // 2
+    x = x[:, :, offset:offset + CROP, offset:offset + CROP]
+    if input_mode == 'gray':
+        return x.contiguous()
+    mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+    return (x.expand(-1, 3, -1, -1) - mean) / std
+
+
+def classify_strip(model, array, tile=TILE_SIZE, stride=TILE_SIZE // 2, batch_size=32,
+                   band_rows=4, input_mode='rgb'):
+    """
+    对整幅图像做滑窗分类，返回 (probs, ys, xs)
+    probs 形状为 [分块行数, 分块列数, 类别数]，ys/xs 为各分块行、列的像素起点
+    """
+    height, width = array.shape
+    ys = tile_positions(height, tile, stride)
+    xs = np.asarray(tile_positions(width, tile, stride))
+    probs = np.zeros((len(ys), len(xs), len(class_names)), dtype=np.float32)
+
+    with torch.inference_mode():
+        for row_start, band, offsets in iter_bands(array, ys, tile, band_rows):
+            # 跨步视图 [band_h-T+1, W-T+1, T, T]，不复制像素
+            windows = sliding_window_view(band, (tile, tile))
+            rows = np.repeat(np.asarray(offsets), len(xs))
+            cols = np.tile(xs, len(offsets))
+            band_probs = np.empty((len(rows), len(class_names)), dtype=np.float32)
+            for i in range(0, len(rows), batch_size):
+                # 花式索引只复制当前批次的分块
+                tiles = windows[rows[i:i + batch_size], cols[i:i + batch_size]]
+                logits = model(preprocess_tiles(tiles, input_mode))
+                band_probs[i:i + batch_size] = torch.softmax(torch.as_tensor(logits), dim=1).numpy()
+            probs[row_start:row_start + len(offsets)] = band_probs.reshape(len(offsets), len(xs), -1)
+    return probs, ys, xs.tolist()
+
+
+# ============================================
+# 3. 热力图与检测结果
+# ============================================
+def build_heatmap(probs, ys, xs, tile, shape, cell):
+    """把分块概率平均到 cell x cell 的网格上，返回 [类别数, ceil(H/cell), ceil(W/cell)]"""
+    height, width = shape
+    grid_h, grid_w = -(-height // cell), -(-width // cell)
+    total = np.zeros((len(class_names), grid_h, grid_w), dtype=np.float32)
+    count = np.zeros((grid_h, grid_w), dtype=np.float32)
+    for i, y in enumerate(ys):
+        r0, r1 = y // cell, -(-(y + tile) // cell)
+        for j, x in enumerate(xs):
+            c0, c1 = x // cell, -(-(x + tile) // cell)
+            total[:, r0:r1, c0:c1] += probs[i, j][:, None, None]
+            count[r0:r1, c0:c1] += 1
+    return total / np.maximum(count, 1)
+
+
+def tile_detections(probs, ys, xs, tile, threshold=0.8):
+    """置信度不低于阈值的分块作为检测结果：类别、置信度、像素框 [x0, y0, x1, y1]"""
+    detections = []
+    best = probs.argmax(axis=2)
+    for i, j in zip(*np.nonzero(probs.max(axis=2) >= threshold)):
+        y, x = ys[i], xs[j]
+        detections.append({
+            'class': class_names[best[i, j]],
+            'confidence': round(float(probs[i, j, best[i, j]]), 6),
+            'box': [int(x), int(y), int(x) + tile, int(y) + tile],
+        })
+    return detections
+
+
+# ============================================
+# 4. 与标注 bndbox 对照检查
+# ============================================
+def build_mosaic(split='validation', rows=4, cols=6, seed=0):
+    """
+    随机挑选带标注的图片拼成 rows x cols 的大图
+    返回 (大图数组, 各小图 (类别, 路径, x, y), 偏移后的标注框列表)
+    """
+    annotation_dir = os.path.join(data_dir, split, 'annotations')
+    samples = []
+    for path in sorted(glob.glob(os.path.join(data_dir, split, 'images', '*', '*.jpg'))):
+        xml_path = os.path.join(annotation_dir, os.path.splitext(os.path.basename(path))[0] + '.xml')
+        if os.path.exists(xml_path):
+            samples.append((path, xml_path))
+    if len(samples) < rows * cols:
+        raise ValueError(f'{split} 中带标注的图片不足 {rows * cols} 张')
+    chosen = random.Random(seed).sample(samples, rows * cols)
+
+    mosaic = np.zeros((rows * TILE_SIZE, cols * TILE_SIZE), dtype=np.uint8)
+    cells, boxes = [], []
+    for k, (path, xml_path) in enumerate(chosen):
+        y, x = (k // cols) * TILE_SIZE, (k % cols) * TILE_SIZE
+        with Image.open(path) as image:
+            mosaic[y:y + TILE_SIZE, x:x + TILE_SIZE] = np.asarray(image.convert('L').resize((TILE_SIZE, TILE_SIZE)))
+        cells.append((os.path.basename(os.path.dirname(path)), path, x, y))
+        for name, x0, y0, x1, y1 in parse_annotation(xml_path):
+            boxes.append((name, x + x0, y + y0, x + x1, y + y1))
+    return mosaic, cells, boxes
+
+
+def overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def check(model, rows, cols, stride, threshold, batch_size, input_mode, seed=0):
+    mosaic, cells, boxes = build_mosaic('validation', rows, cols, seed)
+    start = time.perf_counter()
+    probs, ys, xs = classify_strip(model, mosaic, TILE_SIZE, stride, batch_size, input_mode=input_mode)
+    elapsed = time.perf_counter() - start
+    detections = tile_detections(probs, ys, xs, TILE_SIZE, threshold)
+
+    # 与单张图片 predict 对比：与原图对齐的分块应得到相同的类别和近似的概率
+    y_index, x_index = {y: i for i, y in enumerate(ys)}, {x: j for j, x in enumerate(xs)}
+    correct = agree = 0
+    max_diff = 0.0
+    for name, path, x, y in cells:
+        tile_probs = probs[y_index[y], x_index[x]]
+        with Image.open(path) as image:
+            ref_class, _, ref_probs = predict(image.convert('RGB'), model, input_mode)
+        correct += class_names[int(tile_probs.argmax())] == name
+        agree += class_names[int(tile_probs.argmax())] == ref_class
+        max_diff = max(max_diff, float(np.abs(tile_probs - ref_probs).max()))
+
+    # 标注框召回：同类别且有重叠的检测框即视为命中；检测精度：与同类别标注框有重叠的检测占比
+    hit = {name: [0, 0] for name in class_names}
+    for name, *box in boxes:
+        hit[name][1] += 1
+        hit[name][0] += any(d['class'] == name and overlaps(d['box'], box) for d in detections)
+    matched = sum(any(d['class'] == name and overlaps(d['box'], box) for name, *box in boxes)
+                  for d in detections)
+
+    print(f"拼接大图: {mosaic.shape[1]}x{mosaic.shape[0]}，分块 {len(ys)}x{len(xs)}（步长 {stride}），"
+          f"耗时 {elapsed * 1000:.0f}ms，{len(ys) * len(xs) / elapsed:.1f} 分块/秒")
+    print(f"对齐分块准确率: {correct / len(cells):.2%}，与单张 predict 类别一致率: {agree / len(cells):.2%}，"
+          f"概率最大偏差: {max_diff:.4f}")
+    print(f"\n标注框召回（置信度阈值 {threshold}）")
+    print("=" * 48)
+    for name, (found, total) in hit.items():
+        if total:
+            print(f"{name:<20s}{found:>6d}/{total:<6d}{found / total:>10.2%}")
+    total_found = sum(v[0] for v in hit.values())
+    print(f"{'总计':<18s}{total_found:>6d}/{len(boxes):<6d}{total_found / len(boxes):>10.2%}")
+    if detections:
+        print(f"检测精度: {matched}/{len(detections)} = {matched / len(detections):.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='大幅面图像的分块滑窗推理')
+    parser.add_argument('image', nargs='?', help='输入大图（单通道 uint8 .npy，以内存映射方式流式读取）')
+    parser.add_argument('--model', default=MODEL_PATH, help='模型文件路径')
+    parser.add_argument('--tile', type=int, default=TILE_SIZE, help='分块边长（像素）')
+    parser.add_argument('--stride', type=int, default=TILE_SIZE // 2, help='分块步长（像素），小于分块边长时相互重叠')
+    parser.add_argument('--batch-size', type=int, default=32, help='每批推理的分块数')
+    parser.add_argument('--band-rows', type=int, default=4, help='每个行带包含的分块行数（决定峰值内存）')
+    parser.add_argument('--threshold', type=float, default=0.8, help='检测结果的最低置信度')
+    parser.add_argument('--cell', type=int, default=None, help='热力图网格边长（像素，默认等于步长）')
+    parser.add_argument('--gray', action='store_true', help='使用单通道快速推理路径')
+    parser.add_argument('--backend', default=None, choices=['eager', 'torchscript', 'onnx'],
+                        help='推理后端（默认按模型文件扩展名推断，torchscript/onnx 需先运行 export.py）')
+    parser.add_argument('--threads', type=int, default=None, help='推理使用的 CPU 线程数')
+    parser.add_argument('-o', '--output', default='detections.json', help='检测结果 JSON 输出路径')
+    parser.add_argument('--heatmap', default=None, help='热力图输出路径（.npz）')
+    parser.add_argument('--check', action='store_true', help='用验证集拼接大图和标注 bndbox 检查检测结果')
+    parser.add_argument('--mosaic', default='4x6', help='--check 时拼接的行数x列数')
+    args = parser.parse_args()
+
+    if args.check and TILE_SIZE % args.stride:
+        # 拼接大图的小图起点是 200 的倍数，步长整除 200 时才有与之对齐的分块
+        parser.error(f'--check 需要能整除 {TILE_SIZE} 的 --stride，当前为 {args.stride}')
+    if not args.check and not args.image:
+        parser.error('请指定输入图像，或使用 --check')
+    array = None
+    if not args.check:
+        # 先打开输入（只建立内存映射）再加载模型，格式不符时立即报错
+        try:
+            array = open_strip(args.image)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    input_mode = 'gray' if args.gray else 'rgb'
+    model = load_model(args.model, input_mode=input_mode, backend=args.backend)
+
+    if args.check:
+        rows, cols = (int(v) for v in args.mosaic.lower().split('x'))
+        check(model, rows, cols, args.stride, args.threshold, args.batch_size, input_mode)
+        return
+
+    start = time.perf_counter()
+    probs, ys, xs = classify_strip(model, array, args.tile, args.stride, args.batch_size, args.band_rows, input_mode)
+    elapsed = time.perf_counter() - start
+    detections = tile_detections(probs, ys, xs, args.tile, args.threshold)
+    print(f"✅ {array.shape[1]}x{array.shape[0]} 图像，{len(ys) * len(xs)} 个分块，耗时 {elapsed:.1f}s，"
+          f"检测到 {len(detections)} 个缺陷分块（阈值 {args.threshold}）")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'image': args.image, 'width': array.shape[1], 'height': array.shape[0], 'tile': args.tile,
+                   'stride': args.stride, 'threshold': args.threshold, 'detections': detections},
+                  f, indent=2, ensure_ascii=False)
+    print(f"💾 检测结果已写入 {args.output}")
+    if args.heatmap:
+        cell = args.cell or args.stride
+        heatmap = build_heatmap(probs, ys, xs, args.tile, array.shape, cell)
+        np.savez_compressed(args.heatmap, heatmap=heatmap, tile_probs=probs, ys=ys, xs=xs,
+                            cell=cell, classes=np.array(class_names))
+        print(f"💾 热力图已写入 {args.heatmap}（{len(class_names)}x{heatmap.shape[1]}x{heatmap.shape[2]}）")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,11 @@
 选题：基于 ResNet 的工业零件表面缺陷分类
 """
 
+import argparse
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torchvision import datasets, models, transforms
+from torchvision import datasets
 from torch.utils.data import DataLoader
 import matplotlib.pyplot as plt
 import numpy as np
@@ -16,6 +17,24 @@ from tqdm import tqdm
 import warnings
 warnings.filterwarnings('ignore')
 
+from model_utils import data_transforms, split_dir, build_model, freeze_backbone
+
+# 命令行参数（均为可选，不加参数时与原训练流程一致）
+parser = argparse.ArgumentParser(description='基于 ResNet18 的工业零件表面缺陷分类训练脚本')
+parser.add_argument('--packed', action='store_true',
+                    help='使用 packed_dataset.py 预解码的内存映射数据集，代替 ImageFolder + PIL')
+parser.add_argument('--batch-aug', action='store_true',
+                    help='训练集在整批 uint8 张量上做向量化增强（batch_augment.py），隐含 --packed')
+parser.add_argument('--roi-crop', default=None, choices=['union', 'box'],
+                    help='训练集在缩放前裁剪到标注缺陷框（annotations.py）：union 每图一个外接框，box 每个框一个样本')
+parser.add_argument('--bf16', action='store_true',
+                    help='混合精度：前向在 bfloat16 autocast 下计算卷积和全连接，loss 仍为 float32')
+args = parser.parse_args()
+if args.batch_aug:
+    args.packed = True
+if args.roi_crop and args.packed:
+    parser.error('--roi-crop 需要读取原始图片，不能与 --packed / --batch-aug 同时使用')
+
 # 设置随机种子以保证结果可复现
 torch.manual_seed(42)
 np.random.seed(42)
@@ -23,27 +42,33 @@ np.random.seed(42)
 # ============================================
 # 1. 数据预处理（考核要求：数据预处理）
 # ============================================
-data_transforms = {
-    'train': transforms.Compose([
-        transforms.RandomResizedCrop(224),      # 随机裁剪并调整为224x224（数据增强）
-        transforms.RandomHorizontalFlip(),      # 随机水平翻转（数据增强）
-        transforms.ToTensor(),                  # 转换为Tensor
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])  # ImageNet标准化
-    ]),
-    'validation': transforms.Compose([
-        transforms.Resize(256),                 # 调整大小为256
-        transforms.CenterCrop(224),             # 中心裁剪为224x224
-        transforms.ToTensor(),                  # 转换为Tensor
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])  # ImageNet标准化
-    ]),
-}
-
-# 数据集路径（根据实际数据结构调整）
-data_dir = './data'
-image_datasets = {
-    'train': datasets.ImageFolder(os.path.join(data_dir, 'train/images'), data_transforms['train']),
-    'validation': datasets.ImageFolder(os.path.join(data_dir, 'validation/images'), data_transforms['validation'])
-}
+# 数据预处理定义见 model_utils.data_transforms（训练集增强 + 验证集中心裁剪）
+if args.packed:
+    # 预解码数据集：JPEG 只在打包时解码一次，之后每个 epoch 直接读取内存映射数组
+    from packed_dataset import PackedImageDataset, packed_transforms, is_packed, pack_split
+    for split in ['train', 'validation']:
+        if not is_packed(split):
+            print(f"打包 {split} 数据集...")
+            pack_split(split)
+    image_datasets = {x: PackedImageDataset(x, packed_transforms[x]) for x in ['train', 'validation']}
+    if args.batch_aug:
+        # 训练集只读取 uint8 原图，增强在训练循环中整批完成
+        image_datasets['train'] = PackedImageDataset('train', None)
+else:
+    image_datasets = {
+        'train': datasets.ImageFolder(split_dir('train'), data_transforms['train']),
+        'validation': datasets.ImageFolder(split_dir('validation'), data_transforms['validation'])
+    }
+    if args.roi_crop:
+        # 训练集先裁剪到缺陷框再增强；验证集保持整图，与 app.py 推理时的输入一致
+        from annotations import RoiCropDataset
+        image_datasets['train'] = RoiCropDataset('train', data_transforms['train'], mode=args.roi_crop)
+
+# 批量增强（仅 --batch-aug 时启用）
+batch_augment = None
+if args.batch_aug:
+    from batch_augment import BatchAugment
+    batch_augment = BatchAugment(224)
 
 # 数据加载器（考核要求：Batch Size = 16）
 batch_size = 16
@@ -65,25 +90,15 @@ print(f"类别名称: {class_names}")
 # ============================================
 # 2. 模型构建（考核要求：ResNet18 + 参数冻结 + 自定义FC层）
 # ============================================
-# 加载预训练的 ResNet18 模型
-model = models.resnet18(pretrained=True)
+# 加载预训练的 ResNet18 模型，并修改全连接层
+# （考核要求：Linear(输入,256) -> ReLU -> Linear(256,6)，结构定义见 model_utils.build_model）
+model = build_model(pretrained=True)
+num_ftrs = model.fc[0].in_features
 
 # 冻结 ResNet18 的前8层参数（考核要求：冻结参数）
 # ResNet18 的结构：conv1 -> bn1 -> relu -> maxpool -> layer1 -> layer2 -> layer3 -> layer4 -> avgpool -> fc
 # 我们冻结除全连接层以外的所有层
-for name, param in model.named_parameters():
-    if 'fc' not in name:  # 冻结所有非fc层的参数
-        param.requires_grad = False
-
-# 获取原始全连接层的输入特征数
-num_ftrs = model.fc.in_features
-
-# 修改全连接层（考核要求：Linear(输入,256) -> ReLU -> Linear(256,6)）
-model.fc = nn.Sequential(
-    nn.Linear(num_ftrs, 256),   # 第一层全连接：输入特征 -> 256维
-    nn.ReLU(),                   # ReLU激活函数
-    nn.Linear(256, 6)           # 第二层全连接：256维 -> 6类缺陷
-)
+freeze_backbone(model)
 
 # 将模型移动到GPU（如果可用）
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -137,6 +152,8 @@ for epoch in range(num_epochs):
         # 遍历数据
         for inputs, labels in tqdm(dataloaders[phase], desc=f'{phase.capitalize()}'):
             inputs = inputs.to(device)
+            if phase == 'train' and batch_augment is not None:
+                inputs = batch_augment(inputs)
             labels = labels.to(device)
             
             # 清零梯度
@@ -144,7 +161,9 @@ for epoch in range(num_epochs):
             
             # 前向传播
             with torch.set_grad_enabled(phase == 'train'):
-                outputs = model(inputs)
+                with torch.autocast(device.type, dtype=torch.bfloat16, enabled=args.bf16):
+                    outputs = model(inputs)
+                outputs = outputs.float()  # loss 与 softmax 在 float32 下计算
                 _, preds = torch.max(outputs, 1)
                 loss = criterion(outputs, labels)
                 
@@ -221,30 +240,14 @@ print("="*50)
 model.load_state_dict(torch.load('best_model.pth'))
 model.eval()
 
-# 在验证集上进行最终测试
-test_corrects = 0
-all_preds = []
-all_labels = []
-
-with torch.no_grad():
-    for inputs, labels in dataloaders['validation']:
-        inputs = inputs.to(device)
-        labels = labels.to(device)
-        
-        outputs = model(inputs)
-        _, preds = torch.max(outputs, 1)
-        
-        test_corrects += torch.sum(preds == labels.data)
-        all_preds.extend(preds.cpu().numpy())
-        all_labels.extend(labels.cpu().numpy())
-
-test_acc = test_corrects.double() / dataset_sizes['validation']
-print(f"验证集最终准确率: {test_acc:.4f}")
+# 在验证集上进行最终测试（逐批次累加混淆矩阵，见 evaluate.py；也可单独运行 python evaluate.py best_model.pth）
+from evaluate import evaluate_model
+confusion = evaluate_model(model, dataloaders['validation'], device)
+print(f"验证集最终准确率: {confusion.accuracy():.4f}")
 
 # 打印各类别的准确率
-from sklearn.metrics import classification_report
 print("\n各类别分类报告:")
-print(classification_report(all_labels, all_preds, target_names=class_names))
+print(confusion.report(class_names))
 
 print("\n所有任务完成！")
 
@@ -0,0 +1,252 @@
+"""
+多进程数据并行训练（torch.distributed + gloo，CPU）
+
+train.py 是单进程训练（batch_size=16、num_workers=0），在多核 CPU 训练节点上大部分核心闲置。
+本脚本用 gloo 后端启动多个训练进程（rank）：
+- 每个 rank 通过 DistributedSampler 读取训练集的不同分片，验证集按 rank 交错切分（不重复、不补齐）；
+- 模型用 DistributedDataParallel 包装，主干冻结，只有全连接层的梯度在反向传播时做 all-reduce；
+- loss / 准确率计数在各 rank 间 all-reduce 后得到全局指标，由 rank 0 沿用 train.py 的逻辑保存最佳模型；
+- 每个 rank 的 CPU 线程数 = 核数 / 本机 rank 数，避免线程超额订阅；
+- 支持多机：各节点指定相同的 --master-addr / --master-port 和 --nnodes，以及各自的 --node-rank；
+  也可以直接用 torchrun 启动（读取 RANK / WORLD_SIZE / LOCAL_RANK 环境变量）。
+
+--scaling 模式分别以 1、2、4、8 个 rank 运行固定步数的训练，报告全局吞吐（images/sec）和扩展效率。
+
+用法：
+    python train_ddp.py --nprocs 8                                   # 单机 8 个 rank
+    python train_ddp.py --nprocs 8 --nnodes 2 --node-rank 0 --master-addr 10.0.0.1   # 两台机器，各运行一次
+    torchrun --nproc_per_node 8 train_ddp.py
+    python train_ddp.py --scaling 1,2,4,8 --threads 2                # 扩展效率测试
+"""
+
+import argparse
+import os
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
+from torchvision import datasets
+
+from model_utils import build_model, data_transforms, freeze_backbone, split_dir
+
+
+# ============================================
+# 1. 进程组与数据分片
+# ============================================
+def init_distributed(rank, world_size, master_addr, master_port, threads):
+    torch.set_num_threads(threads)
+    dist.init_process_group('gloo', init_method=f'tcp://{master_addr}:{master_port}',
+                            rank=rank, world_size=world_size)
+
+
+def load_datasets(packed=False):
+    if packed:
+        from packed_dataset import PackedImageDataset, packed_transforms
+        return {x: PackedImageDataset(x, packed_transforms[x]) for x in ['train', 'validation']}
+    return {x: datasets.ImageFolder(split_dir(x), data_transforms[x]) for x in ['train', 'validation']}
+
+
+def ensure_packed():
+    from packed_dataset import is_packed, pack_split
+    for split in ['train', 'validation']:
+        if not is_packed(split):
+            print(f"打包 {split} 数据集...")
+            pack_split(split)
+
+
+def build_loaders(rank, world_size, batch_size=16, packed=False, num_workers=0, seed=42):
+    """返回 (训练集 sampler, 训练 loader, 验证 loader)，batch_size 为每个 rank 的批大小"""
+    image_datasets = load_datasets(packed)
+    sampler = DistributedSampler(image_datasets['train'], num_replicas=world_size, rank=rank, shuffle=True, seed=seed)
+    train_loader = DataLoader(image_datasets['train'], batch_size=batch_size, sampler=sampler, num_workers=num_workers)
+    # DistributedSampler 会补齐样本使各 rank 数量相同，验证集改为交错切分，保证全局准确率精确
+    val_subset = Subset(image_datasets['validation'], range(rank, len(image_datasets['validation']), world_size))
+    val_loader = DataLoader(val_subset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    return sampler, train_loader, val_loader
+
+
+def build_ddp_model(rank):
+    """只有 rank 0 加载预训练权重，DDP 构造时把 rank 0 的参数和 BN 统计量广播到其他 rank"""
+    model = build_model(pretrained=rank == 0)
+    freeze_backbone(model)
+    return DistributedDataParallel(model)
+
+
+# ============================================
+# 2. 训练与验证
+# ============================================
+def run_epoch(model, loader, criterion, optimizer=None):
+    """训练（传入 optimizer）或验证一个 epoch，返回全局 (平均 loss, 准确率, 样本数, 各 rank 最长耗时)"""
+    training = optimizer is not None
+    model.train(training)
+    stats = torch.zeros(3, dtype=torch.float64)  # loss 总和、正确数、样本数
+    start = time.perf_counter()
+    for inputs, labels in loader:
+        with torch.set_grad_enabled(training):
+            outputs = model(inputs)
+            loss = criterion(outputs, labels)
+            if training:
+                optimizer.zero_grad()
+                loss.backward()  # DDP 在这里对全连接层梯度做 all-reduce
+                optimizer.step()
+        stats[0] += loss.item() * inputs.size(0)
+        stats[1] += (outputs.argmax(1) == labels).sum().item()
+        stats[2] += inputs.size(0)
+    elapsed = torch.tensor([time.perf_counter() - start], dtype=torch.float64)
+    dist.all_reduce(stats)
+    dist.all_reduce(elapsed, op=dist.ReduceOp.MAX)
+    loss_sum, correct, count = stats.tolist()
+    return loss_sum / count, correct / count, int(count), elapsed.item()
+
+
+def train_worker(local_rank, args):
+    if args.torchrun:
+        rank, world_size = int(os.environ['RANK']), int(os.environ['WORLD_SIZE'])
+        torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // int(os.environ['LOCAL_WORLD_SIZE'])))
+        dist.init_process_group('gloo')
+    else:
+        rank, world_size = args.node_rank * args.nprocs + local_rank, args.nnodes * args.nprocs
+        init_distributed(rank, world_size, args.master_addr, args.master_port,
+                         args.threads or max(1, (os.cpu_count() or 1) // args.nprocs))
+
+    if args.packed:
+        # 每台机器由本机第一个 rank 打包，其余 rank 等待打包完成后再读取
+        if local_rank == 0:
+            ensure_packed()
+        dist.barrier()
+
+    torch.manual_seed(args.seed + rank)
+    sampler, train_loader, val_loader = build_loaders(rank, world_size, args.batch_size, args.packed,
+                                                      args.workers, args.seed)
+    model = build_ddp_model(rank)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.SGD(filter(lambda p: p.requires_grad, model.parameters()), lr=args.lr, momentum=0.9)
+
+    if rank == 0:
+        print(f"✅ {world_size} 个 rank（gloo），每个 rank {torch.get_num_threads()} 个线程，"
+              f"全局 Batch Size {args.batch_size * world_size}")
+    best_acc = 0.0
+    throughputs = []
+    for epoch in range(args.epochs):
+        sampler.set_epoch(epoch)
+        train_loss, train_acc, seen, elapsed = run_epoch(model, train_loader, criterion, optimizer)
+        val_loss, val_acc, _, _ = run_epoch(model, val_loader, criterion)
+        throughputs.append(seen / elapsed)
+        if rank == 0:
+            print(f"Epoch {epoch + 1}/{args.epochs}  Train Loss: {train_loss:.4f} Acc: {train_acc:.4f}  "
+                  f"Validation Loss: {val_loss:.4f} Acc: {val_acc:.4f}  ({seen / elapsed:.1f} images/s)")
+        # 验证指标已 all-reduce，各 rank 判断一致；只有 rank 0 写文件
+        if val_acc > best_acc:
+            best_acc = val_acc
+            if rank == 0:
+                torch.save(model.module.state_dict(), args.output)
+                print(f'>>> 保存最佳模型，验证集准确率: {best_acc:.4f}')
+
+    if rank == 0:
+        print(f"\n训练完成！最佳验证集准确率: {best_acc:.4f}，"
+              f"平均训练吞吐 {sum(throughputs) / len(throughputs):.1f} images/s")
+    dist.destroy_process_group()
+
+
+# ============================================
+# 3. 扩展效率测试
+# ============================================
+def iterate_batches(sampler, loader):
+    epoch = 0
+    while True:
+        sampler.set_epoch(epoch)
+        yield from loader
+        epoch += 1
+
+
+def bench_worker(rank, world_size, master_port, steps, warmup, batch_size, packed, threads, results):
+    """固定步数的训练，rank 0 把全局吞吐写入 results"""
+    init_distributed(rank, world_size, '127.0.0.1', master_port, threads)
+    torch.manual_seed(rank)
+    sampler, train_loader, _ = build_loaders(rank, world_size, batch_size, packed)
+    model = build_ddp_model(rank).train()
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.SGD(filter(lambda p: p.requires_grad, model.parameters()), lr=1e-3, momentum=0.9)
+
+    batches = iterate_batches(sampler, train_loader)
+    for step in range(warmup + steps):
+        if step == warmup:
+            dist.barrier()
+            start = time.perf_counter()
+        inputs, labels = next(batches)
+        optimizer.zero_grad()
+        criterion(model(inputs), labels).backward()
+        optimizer.step()
+    elapsed = torch.tensor([time.perf_counter() - start], dtype=torch.float64)
+    dist.all_reduce(elapsed, op=dist.ReduceOp.MAX)
+    if rank == 0:
+        results.put((world_size, steps * batch_size * world_size / elapsed.item()))
+    dist.destroy_process_group()
+
+
+def scaling_report(rank_counts, args):
+    threads = args.threads or max(1, (os.cpu_count() or 1) // max(rank_counts))
+    print(f"扩展效率测试：每个 rank {threads} 个线程，Batch Size {args.batch_size}/rank，"
+          f"预热 {args.warmup} 步 + 计时 {args.steps} 步")
+    if max(rank_counts) * threads > (os.cpu_count() or 1):
+        print(f"⚠️ {max(rank_counts)} 个 rank × {threads} 线程超过 CPU 核数 {os.cpu_count()}，结果会偏低")
+    ctx = mp.get_context('spawn')
+    results = ctx.SimpleQueue()
+    throughput = {}
+    for i, world_size in enumerate(rank_counts):
+        # 每次运行换一个端口，避免上一个进程组的端口仍处于 TIME_WAIT
+        mp.spawn(bench_worker, args=(world_size, args.master_port + i, args.steps, args.warmup, args.batch_size,
+                                     args.packed, threads, results), nprocs=world_size, join=True)
+        _, throughput[world_size] = results.get()
+        print(f"  {world_size} rank: {throughput[world_size]:.1f} images/s")
+
+    base = throughput[rank_counts[0]] / rank_counts[0]
+    print("\n" + "=" * 48)
+    print(f"{'rank 数':>8s}{'images/s':>12s}{'加速比':>10s}{'扩展效率':>12s}")
+    print("=" * 48)
+    for world_size in rank_counts:
+        speedup = throughput[world_size] / throughput[rank_counts[0]]
+        print(f"{world_size:>8d}{throughput[world_size]:>12.1f}{speedup:>10.2f}"
+              f"{throughput[world_size] / (base * world_size):>12.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程数据并行训练（gloo，CPU）')
+    parser.add_argument('--nprocs', type=int, default=4, help='本机启动的 rank 数')
+    parser.add_argument('--nnodes', type=int, default=1, help='参与训练的机器数')
+    parser.add_argument('--node-rank', type=int, default=0, help='本机序号（0 为主节点）')
+    parser.add_argument('--master-addr', default=os.environ.get('MASTER_ADDR', '127.0.0.1'), help='主节点地址')
+    parser.add_argument('--master-port', type=int, default=int(os.environ.get('MASTER_PORT', 29500)),
+                        help='主节点端口')
+    parser.add_argument('--epochs', type=int, default=15, help='训练轮数')
+    parser.add_argument('--batch-size', type=int, default=16, help='每个 rank 的 Batch Size')
+    parser.add_argument('--lr', type=float, default=0.001, help='学习率（全局 Batch Size 变大时可相应调大）')
+    parser.add_argument('--workers', type=int, default=0, help='每个 rank 的 DataLoader 进程数')
+    parser.add_argument('--threads', type=int, default=None, help='每个 rank 的 CPU 线程数（默认 核数 / 本机 rank 数）')
+    parser.add_argument('--packed', action='store_true', help='使用 packed_dataset.py 预解码的内存映射数据集')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    parser.add_argument('--output', default='best_model.pth', help='最佳模型保存路径（rank 0 写入）')
+    parser.add_argument('--scaling', default=None, help='扩展效率测试的 rank 数（逗号分隔，如 1,2,4,8）')
+    parser.add_argument('--steps', type=int, default=30, help='扩展效率测试每次计时的训练步数')
+    parser.add_argument('--warmup', type=int, default=3, help='扩展效率测试的预热步数')
+    args = parser.parse_args()
+    args.torchrun = 'LOCAL_RANK' in os.environ and 'WORLD_SIZE' in os.environ
+
+    if args.scaling:
+        if args.packed:
+            ensure_packed()
+        scaling_report([int(n) for n in args.scaling.split(',')], args)
+    elif args.torchrun:
+        train_worker(int(os.environ['LOCAL_RANK']), args)
+    else:
+        mp.spawn(train_worker, args=(args,), nprocs=args.nprocs, join=True)
+
+
+if __name__ == '__main__':
+    main()
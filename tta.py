@@ -0,0 +1,215 @@
+"""
+批量测试时增强（TTA）
+
+对难以判断的图片，在多个增强视图（翻转、不同位置的裁剪、小角度旋转）上预测并聚合概率可以提高稳定性，
+但对每个视图单独调用 predict 会让延迟成倍增加。本模块：
+- 每张图片只做一次解码和缩放（Resize(256) + 居中 256x256），所有视图都在张量上切片、翻转或旋转得到；
+- 一张或多张图片的全部视图拼成一个批次，只做一次前向，再按 mean 或 max 聚合概率；
+- 视图数 n_views 是延迟与准确率之间的调节旋钮（按 TTA_VIEWS 的顺序取前 n 个）；
+- 指定 threshold 时先只计算中心视图（即普通预测），置信度低于阈值才补算其余视图。
+
+用法：
+    python tta.py                                   # 在验证集上对比不同视图数 / 聚合方式 / 阈值的准确率与延迟
+    python tta.py --views 1,4,9 --reduce max
+"""
+
+import argparse
+import math
+import time
+
+import torch
+import torch.nn.functional as F
+from torchvision import transforms
+
+from model_utils import IMAGENET_MEAN, IMAGENET_STD, MODEL_PATH, class_names, load_model, split_dir
+
+RESIZE = 256
+CROP = 224
+ROTATION_DEG = 10
+
+# 视图顺序即优先级：n_views=1 等价于普通 predict（中心裁剪）
+TTA_VIEWS = ('center', 'hflip', 'vflip', 'top_left', 'bottom_right', 'rot+', 'rot-', 'top_right', 'bottom_left')
+
+
+def to_rgb(image):
+    return image.convert('RGB')
+
+
+def _base_transform(input_mode):
+    """解码 + 缩放到 256x256（不做 224 中心裁剪，裁剪在张量上完成）"""
+    if input_mode == 'gray':
+        from grayscale import to_gray
+        return transforms.Compose([
+            transforms.Lambda(to_gray),
+            transforms.Resize(RESIZE),
+            transforms.CenterCrop(RESIZE),
+            transforms.ToTensor(),
+        ])
+    return transforms.Compose([
+        transforms.Lambda(to_rgb),
+        transforms.Resize(RESIZE),
+        transforms.CenterCrop(RESIZE),
+        transforms.ToTensor(),
+        transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD),
+    ])
+
+
+base_transforms = {mode: _base_transform(mode) for mode in ('rgb', 'gray')}
+
+
+# ============================================
+# 1. 在张量上构建视图
+# ============================================
+def _crop(x, top, left):
+    return x[:, :, top:top + CROP, left:left + CROP]
+
+
+def _rotate(x, degrees):
+    """整批小角度旋转，边界像素外延填充"""
+    theta = math.radians(degrees)
+    matrix = torch.tensor([[math.cos(theta), -math.sin(theta), 0.0],
+                           [math.sin(theta), math.cos(theta), 0.0]], dtype=x.dtype)
+    grid = F.affine_grid(matrix.expand(x.shape[0], 2, 3), list(x.shape), align_corners=False)
+    return F.grid_sample(x, grid, mode='bilinear', padding_mode='border', align_corners=False)
+
+
+def build_views(base, views=TTA_VIEWS):
+    """
+    base: [B, C, 256, 256] -> [V*B, C, 224, 224]，按视图分组排列（先是所有图片的第 1 个视图，依此类推）
+    """
+    offset = (RESIZE - CROP) // 2
+    far = RESIZE - CROP
+    center = _crop(base, offset, offset)
+    builders = {
+        'center': lambda: center,
+        'hflip': lambda: center.flip(3),
+        'vflip': lambda: center.flip(2),
+        'top_left': lambda: _crop(base, 0, 0),
+        'bottom_right': lambda: _crop(base, far, far),
+        'top_right': lambda: _crop(base, 0, far),
+        'bottom_left': lambda: _crop(base, far, 0),
+        # 先旋转 256 的底图再中心裁剪，避免旋转后四角出现外延像素
+        'rot+': lambda: _crop(_rotate(base, ROTATION_DEG), offset, offset),
+        'rot-': lambda: _crop(_rotate(base, -ROTATION_DEG), offset, offset),
+    }
+    return torch.cat([builders[name]() for name in views])
+
+
+def aggregate(probs, num_images, reduce='mean'):
+    """[V*B, K] -> [B, K]；max 聚合后重新归一化"""
+    probs = probs.view(-1, num_images, probs.shape[1])
+    if reduce == 'max':
+        probs = probs.max(dim=0).values
+        return probs / probs.sum(dim=1, keepdim=True)
+    return probs.mean(dim=0)
+
+
+# ============================================
+# 2. 批量 TTA 推理
+# ============================================
+def view_probs(model, base, views):
+    """对 [B, C, 256, 256] 的底图构建指定视图并一次前向，返回未聚合的概率 [V*B, K]"""
+    with torch.inference_mode():
+        return torch.softmax(torch.as_tensor(model(build_views(base, views))), dim=1)
+
+
+def tta_probs(model, base, n_views=len(TTA_VIEWS), reduce='mean'):
+    """对 [B, C, 256, 256] 的底图做 n_views 视图 TTA，一次前向，返回聚合后的概率 [B, K]"""
+    return aggregate(view_probs(model, base, TTA_VIEWS[:n_views]), base.shape[0], reduce)
+
+
+def refine_probs(model, base, center_probs, n_views, reduce='mean'):
+    """选择性 TTA：复用已计算的中心视图概率 [B, K]，只补算其余 n_views - 1 个视图，再一起聚合"""
+    extra_probs = view_probs(model, base, TTA_VIEWS[1:n_views])
+    return aggregate(torch.cat([center_probs, extra_probs]), base.shape[0], reduce)
+
+
+def predict_tta(image, model, input_mode='rgb', n_views=6, reduce='mean', threshold=None):
+    """
+    与 model_utils.predict 相同的返回值，另加实际使用的视图数：(类别名, 置信度百分比, 各类别概率, 视图数)
+    threshold（0~1）非空时先计算中心视图，置信度达到阈值直接返回，否则补算其余视图并与中心视图一起聚合
+    """
+    base = base_transforms[input_mode](image).unsqueeze(0)
+    used = n_views
+    if threshold is not None and n_views > 1:
+        center_probs = view_probs(model, base, TTA_VIEWS[:1])
+        if center_probs.max().item() >= threshold:
+            probs, used = center_probs[0], 1
+        else:
+            probs = refine_probs(model, base, center_probs, n_views, reduce)[0]
+    else:
+        probs = tta_probs(model, base, n_views, reduce)[0]
+
+    confidence, predicted_idx = torch.max(probs, 0)
+    return class_names[predicted_idx.item()], confidence.item() * 100, probs.numpy(), used
+
+
+# ============================================
+# 3. 验证集对比
+# ============================================
+def load_bases(input_mode='rgb'):
+    """验证集全部图片解码为底图张量 [N, C, 256, 256] 和标签"""
+    from torchvision import datasets
+    dataset = datasets.ImageFolder(split_dir('validation'), base_transforms[input_mode])
+    bases, labels = zip(*[dataset[i] for i in range(len(dataset))])
+    return torch.stack(bases), torch.tensor(labels)
+
+
+def evaluate(model, bases, labels, n_views, reduce, batch_size, threshold=None):
+    """返回 (准确率, 平均每张图片延迟 ms, 使用 TTA 的图片占比)"""
+    correct = 0
+    tta_count = 0
+    start = time.perf_counter()
+    for i in range(0, len(labels), batch_size):
+        base = bases[i:i + batch_size]
+        if threshold is None:
+            probs = tta_probs(model, base, n_views, reduce)
+            tta_count += len(base) if n_views > 1 else 0
+        else:
+            # 经过 aggregate 得到普通张量（推理模式下产生的张量不能在模式外原地修改）
+            probs = tta_probs(model, base, 1)
+            # 与 predict_tta 一致：只对低置信度的图片补算其余视图，中心视图的结果直接复用
+            uncertain = probs.max(dim=1).values < threshold
+            if uncertain.any() and n_views > 1:
+                probs[uncertain] = refine_probs(model, base[uncertain], probs[uncertain], n_views, reduce)
+                tta_count += int(uncertain.sum())
+        correct += (probs.argmax(1) == labels[i:i + batch_size]).sum().item()
+    elapsed = time.perf_counter() - start
+    return correct / len(labels), elapsed / len(labels) * 1000, tta_count / len(labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量测试时增强（TTA）')
+    parser.add_argument('--model', default=MODEL_PATH, help='模型文件路径')
+    parser.add_argument('--gray', action='store_true', help='使用单通道快速推理路径')
+    parser.add_argument('--backend', default=None, choices=['eager', 'torchscript', 'onnx'],
+                        help='推理后端（默认按模型文件扩展名推断，torchscript/onnx 需先运行 export.py）')
+    parser.add_argument('--views', default='1,2,4,6,9', help='对比的视图数（逗号分隔，最多 9）')
+    parser.add_argument('--reduce', default='mean', choices=['mean', 'max'], help='概率聚合方式')
+    parser.add_argument('--thresholds', default='0.9,0.99', help='按置信度选择性 TTA 的阈值（逗号分隔）')
+    parser.add_argument('--batch-size', type=int, default=1, help='每批图片数（每张图片的全部视图在同一批次中）')
+    parser.add_argument('--threads', type=int, default=None, help='推理使用的 CPU 线程数')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    input_mode = 'gray' if args.gray else 'rgb'
+    model = load_model(args.model, input_mode=input_mode, backend=args.backend)
+    bases, labels = load_bases(input_mode)
+    view_counts = [min(int(v), len(TTA_VIEWS)) for v in args.views.split(',')]
+
+    print(f"验证集 {len(labels)} 张图片，聚合方式: {args.reduce}，batch={args.batch_size}")
+    print("=" * 64)
+    print(f"{'模式':<24s}{'准确率':>10s}{'延迟(ms/张)':>14s}{'TTA 占比':>12s}")
+    print("=" * 64)
+    for n in view_counts:
+        acc, ms, frac = evaluate(model, bases, labels, n, args.reduce, args.batch_size)
+        print(f"{f'{n} 个视图':<24s}{acc:>10.4f}{ms:>14.2f}{frac:>12.1%}")
+    n = max(view_counts)
+    for threshold in [float(t) for t in args.thresholds.split(',') if t]:
+        acc, ms, frac = evaluate(model, bases, labels, n, args.reduce, args.batch_size, threshold)
+        print(f"{f'{n} 个视图，置信度<{threshold:g}':<24s}{acc:>10.4f}{ms:>14.2f}{frac:>12.1%}")
+
+
+if __name__ == '__main__':
+    main()